@@ -26,10 +26,28 @@ class Settings(BaseSettings):
     ollama_model: str = "qwen3:8b"
     ollama_max_tokens: int = 4096
     ollama_temperature: float = 0.7
+    ollama_keep_alive: str = "1h"  # Сколько Ollama держит модель загруженной после запроса (по умолчанию у сервера 5m)
     ollama_timeout_sec: int = 90  # Таймаут запроса к Ollama (генерация может быть долгой)
+    ollama_num_parallel: int = 4  # Сколько запросов держим в полёте одновременно; синхронизировать с OLLAMA_NUM_PARALLEL на сервере Ollama
+    ollama_cache_sim_threshold: float = 0.95  # Косинусное сходство, начиная с которого запрос считается повтором закешированного
+    ollama_tokenizer_id: str | None = None  # HuggingFace id токенизатора модели (например, Qwen/Qwen3-8B): вход обрезается по токенам, а не по символам
+    ollama_persona_model: str | None = None  # Отдельная (меньшая) модель для коротких ответов персоны, например qwen2.5:1.5b; по умолчанию ollama_model
     
     # ChromaDB (RAG)
     chroma_persist_dir: str = "./data/vector_db"
+    chroma_mode: str = "persistent"  # persistent — индекс в процессе API; http — отдельный сервер Chroma (chroma_host:chroma_port)
+    chroma_host: str = "localhost"
+    chroma_port: int = 8001
+    chroma_hnsw_m: int = 32  # Связность графа HNSW (применяется при построении индекса)
+    chroma_hnsw_construction_ef: int = 200
+    chroma_hnsw_search_ef: int = 64  # Ширина поиска: выше — точнее, ниже — быстрее
+    rag_onnx_model_dir: str | None = None  # Каталог с ONNX-экспортом all-MiniLM-L6-v2 (например, int8 model_qint8_avx512_vnni.onnx + токенизатор); иначе sentence-transformers
+    rag_onnx_threads: int = 0  # intra_op потоки onnxruntime (0 — по умолчанию; ставить по числу физических ядер)
+    rag_torch_threads: int = 0  # intra-op потоки torch для sentence-transformers (0 — по умолчанию torch; энкоды идут параллельно в пуле RAG)
+    rag_batch_window_ms: int = 20  # Окно, за которое одиночные добавления документов собираются в один батч
+    rag_max_batch: int = 8
+    rag_cache_sim_threshold: float = 0.97  # Косинусное сходство запросов, при котором переиспользуется результат поиска RAG
+    rag_brute_force_max: int = 1000  # Коллекции до этого размера ищутся точным перебором в памяти, а не через HNSW (0 — выключить)
     
     # Notion (опционально для разработки)
     notion_token: str | None = None
@@ -0,0 +1,125 @@
+"""
+Агрегация одиночных запросов в батчи по временному окну.
+"""
+import asyncio
+from typing import Any, Awaitable, Callable, List, Optional, Set, Tuple
+from loguru import logger
+
+
+class BatchScheduler:
+    """
+    Копит одиночные запросы до max_batch штук или max_delay секунд и обрабатывает их одним вызовом.
+
+    Обработчик получает список элементов и возвращает список результатов в том же
+    порядке (или None, если результатов нет). Если батч из нескольких элементов
+    падает, элементы повторяются по одному, и ошибку получают только те, на
+    которых она воспроизвелась.
+
+    С flush_when_idle батч, пришедший в простаивающий планировщик, отправляется
+    на следующем шаге цикла событий, не дожидаясь окна: одиночный запрос не
+    платит задержкой, а окно копит элементы, только пока идет предыдущий батч.
+    """
+
+    def __init__(
+        self,
+        handler: Callable[[List[Any]], Awaitable[Optional[List[Any]]]],
+        max_batch: int = 8,
+        max_delay: float = 0.02,
+        flush_when_idle: bool = False
+    ):
+        self.handler = handler
+        self.max_batch = max(1, max_batch)
+        self.max_delay = max_delay
+        self.flush_when_idle = flush_when_idle
+        # Сколько вызовов обработчика сейчас выполняется
+        self._running = 0
+        self.loop = asyncio.get_running_loop()
+        self._pending: List[Tuple[Any, asyncio.Future]] = []
+        self._timer: Optional[asyncio.Task] = None
+        # Сильные ссылки на запущенные сбросы: цикл событий держит задачи слабо,
+        # и без них сброс мог бы быть собран GC, не разрешив ожидающие futures
+        self._tasks: Set[asyncio.Task] = set()
+
+    def _spawn(self, coro: Awaitable[None]) -> asyncio.Task:
+        """Запускает фоновую задачу и держит ссылку на нее до завершения."""
+        task = asyncio.ensure_future(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    async def submit(self, item: Any) -> Any:
+        """
+        Добавляет элемент в текущий батч и ждет его результат.
+
+        Args:
+            item: Элемент для обработчика
+
+        Returns:
+            Результат обработки элемента
+        """
+        future = self.loop.create_future()
+        self._pending.append((item, future))
+
+        if len(self._pending) >= self.max_batch:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            self._spawn(self._flush())
+        elif self._timer is None:
+            idle = self.flush_when_idle and not self._running
+            self._timer = self._spawn(self._flush_later(0 if idle else self.max_delay))
+
+        return await future
+
+    async def _flush_later(self, delay: float):
+        """Отправляет батч через delay секунд (0 — на следующем шаге цикла событий)."""
+        await asyncio.sleep(delay)
+        self._timer = None
+        await self._flush()
+
+    async def _flush(self):
+        """Обрабатывает накопленные элементы (не больше max_batch за вызов)."""
+        batch, self._pending = self._pending[:self.max_batch], self._pending[self.max_batch:]
+        if self._pending and self._timer is None:
+            self._timer = self._spawn(self._flush_later(self.max_delay))
+        if not batch:
+            return
+
+        self._running += 1
+        try:
+            await self._process(batch)
+        finally:
+            self._running -= 1
+
+    async def _process(self, batch: List[Tuple[Any, asyncio.Future]]):
+        """Вызывает обработчик для батча и раздает результаты ожидающим."""
+        try:
+            results = await self.handler([item for item, _ in batch])
+        except Exception as e:
+            if len(batch) == 1:
+                self._resolve(batch[0][1], error=e)
+                return
+            logger.debug(f"Батч из {len(batch)} элементов завершился ошибкой, повторяем по одному: {e}")
+            for item, future in batch:
+                try:
+                    result = await self.handler([item])
+                except Exception as item_error:
+                    self._resolve(future, error=item_error)
+                else:
+                    self._resolve(future, result[0] if result is not None else None)
+            return
+
+        if results is None:
+            results = [None] * len(batch)
+        for (_, future), result in zip(batch, results):
+            self._resolve(future, result)
+
+    @staticmethod
+    def _resolve(future: asyncio.Future, result: Any = None, error: Optional[BaseException] = None):
+        """Отдает результат или ошибку ожидающему, если он еще ждет."""
+        if future.done():
+            return
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
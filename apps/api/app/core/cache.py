@@ -5,9 +5,10 @@
 import hashlib
 import json
 import time
-from typing import Any, Dict, Optional
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
 from datetime import datetime, timedelta
 from loguru import logger
+import numpy as np
 
 
 class CacheEntry:
@@ -43,6 +44,18 @@ class InMemoryCache:
             "evictions": 0,
             "total_requests": 0
         }
+        # Вызываются с ключом каждой удаленной записи (истекла, вытеснена, кеш очищен)
+        self._remove_listeners: List[Callable[[str], None]] = []
+    
+    def add_remove_listener(self, listener: Callable[[str], None]) -> None:
+        """Подписывает функцию на удаление записей из кеша."""
+        self._remove_listeners.append(listener)
+    
+    def _remove(self, key: str) -> None:
+        """Удаляет запись и уведомляет подписчиков."""
+        del self._cache[key]
+        for listener in self._remove_listeners:
+            listener(key)
     
     def _generate_key(self, prefix: str, *args, **kwargs) -> str:
         """Генерирует ключ кеша на основе аргументов."""
@@ -65,7 +78,7 @@ class InMemoryCache:
             
             if entry.is_expired():
                 # Запись истекла, удаляем
-                del self._cache[key]
+                self._remove(key)
                 self._stats["misses"] += 1
                 return None
             
@@ -94,12 +107,16 @@ class InMemoryCache:
             key=lambda k: self._cache[k].last_accessed
         )
         
-        del self._cache[oldest_key]
+        self._remove(oldest_key)
         self._stats["evictions"] += 1
     
     def clear(self):
         """Очищает весь кеш."""
+        keys = list(self._cache)
         self._cache.clear()
+        for key in keys:
+            for listener in self._remove_listeners:
+                listener(key)
         logger.info("Кеш очищен")
     
     def get_stats(self) -> Dict[str, Any]:
@@ -127,8 +144,76 @@ class OllamaCacheService:
             "persona_response": 60,  # 1 минута для персона-ответов
             "classification": 300,   # 5 минут для классификации
             "analysis": 600,        # 10 минут для анализа
-            "summarization": 900    # 15 минут для суммаризации
+            "summarization": 900,   # 15 минут для суммаризации
+            "task_intent": 600,     # 10 минут для извлечения задач
+            "rag_search": 300       # 5 минут для результатов поиска RAG
         }
+        
+        # Нормализованные эмбеддинги запросов для приближенного поиска: (request_type, scope) -> {key: vector}.
+        # Хранятся во float16 (вдвое меньше памяти), сходство считается во float32.
+        # Эмбеддинг живет, пока жива запись кеша: их общее число ограничено размером InMemoryCache,
+        # а опустевшие группы (старые scope) удаляются
+        self._embeddings: Dict[Tuple[str, str], Dict[str, np.ndarray]] = {}
+        self._embedding_groups: Dict[str, Tuple[str, str]] = {}
+        cache.add_remove_listener(self._forget_embedding)
+    
+    def _forget_embedding(self, key: str) -> None:
+        """Удаляет эмбеддинг записи (и его группу, если она опустела)."""
+        group = self._embedding_groups.pop(key, None)
+        if group is None:
+            return
+        vectors = self._embeddings.get(group)
+        if vectors is not None:
+            vectors.pop(key, None)
+            if not vectors:
+                del self._embeddings[group]
+    
+    @staticmethod
+    def _normalize(embedding: Sequence[float]) -> Optional[np.ndarray]:
+        """Приводит эмбеддинг к единичной длине (косинус = скалярное произведение)."""
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        if not norm:
+            return None
+        return vector / norm
+    
+    def get_similar_response(
+        self,
+        request_type: str,
+        embedding: Sequence[float],
+        threshold: float = 0.95,
+        scope: str = ""
+    ) -> Optional[Any]:
+        """
+        Ищет закешированный ответ для семантически близкого запроса.
+        
+        Args:
+            request_type: Тип запроса
+            embedding: Эмбеддинг текущего запроса
+            threshold: Минимальное косинусное сходство
+            scope: Параметры, которые должны совпадать точно (контекст, схема и т.п.)
+            
+        Returns:
+            Закешированный ответ или None
+        """
+        vectors = self._embeddings.get((request_type, scope))
+        query = self._normalize(embedding) if vectors else None
+        if query is None:
+            return None
+        
+        keys = list(vectors.keys())
+        scores = np.stack([vectors[k] for k in keys], dtype=np.float32) @ query
+        for idx in np.argsort(scores)[::-1]:
+            if scores[idx] < threshold:
+                break
+            cached = self.cache.get(keys[idx])
+            if cached is not None:
+                logger.debug(f"Семантическое попадание в кеш Ollama {request_type} (sim={scores[idx]:.3f})")
+                return cached
+            # Запись истекла или вытеснена — эмбеддинг больше не нужен
+            self._forget_embedding(keys[idx])
+        
+        return None
     
     def get_cached_response(
         self, 
@@ -154,12 +239,14 @@ class OllamaCacheService:
     def cache_response(
         self,
         request_type: str,
-        response: str,
+        response: Any,
         user_input: str = "",
         context: str = "",
+        embedding: Optional[Sequence[float]] = None,
+        scope: str = "",
         **kwargs
     ):
-        """Кеширует ответ Ollama."""
+        """Кеширует ответ Ollama (с эмбеддингом — доступен и для приближенного поиска)."""
         key = self.cache._generate_key(
             f"ollama:{request_type}",
             user_input=user_input,
@@ -170,6 +257,15 @@ class OllamaCacheService:
         ttl = self.ttl_config.get(request_type, 300)
         self.cache.set(key, response, ttl)
         
+        if embedding is not None:
+            vector = self._normalize(embedding)
+            if vector is not None:
+                # Ключ мог раньше лежать в другой группе (тот же запрос с другим scope)
+                self._forget_embedding(key)
+                group = (request_type, scope)
+                self._embeddings.setdefault(group, {})[key] = vector.astype(np.float16)
+                self._embedding_groups[key] = group
+        
         logger.debug(f"Кешируем Ollama {request_type} на {ttl}с: {user_input[:50]}...")
 
 
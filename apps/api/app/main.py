@@ -1,6 +1,8 @@
 """
 FastAPI приложение для Digital Twin System.
 """
+import asyncio
+
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import JSONResponse
@@ -221,6 +223,20 @@ async def startup_event():
                 logger.warning(f"⚠️ Не удалось зарегистрировать daily check-in задачу: {e}")
         except Exception as e:
             logger.warning(f"⚠️ Не удалось запустить SchedulerService: {e}")
+        
+        # Прогрев модели Ollama в фоне, чтобы первый запрос не ждал загрузку в память
+        try:
+            from app.services.ollama_service import OllamaService
+            app.state.ollama_warmup = asyncio.create_task(OllamaService().warmup())
+        except Exception as e:
+            logger.warning(f"⚠️ Не удалось запустить прогрев Ollama: {e}")
+        
+        # Модель эмбеддингов грузится один раз на процесс — загружаем и прогреваем в фоне
+        try:
+            from app.services.rag_service import warmup_embedding_model
+            app.state.embedding_warmup = asyncio.create_task(asyncio.to_thread(warmup_embedding_model))
+        except Exception as e:
+            logger.warning(f"⚠️ Не удалось запустить прогрев модели эмбеддингов: {e}")
     else:
         logger.info("⏭ Vercel: фоновые сервисы (парсер, proactive, scheduler) пропущены")
 
@@ -234,6 +250,9 @@ async def shutdown_event():
         await app.state.proactive_service.stop()
     if hasattr(app.state, "scheduler_service"):
         await app.state.scheduler_service.stop()
+    
+    from app.services.ollama_service import close_ollama_clients
+    await close_ollama_clients()
 
 
 @app.get("/")
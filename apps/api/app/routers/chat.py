@@ -2,15 +2,28 @@
 API роутер для чата с агентами.
 """
 from fastapi import APIRouter, HTTPException
+from fastapi.responses import StreamingResponse
 from typing import List, Optional
 from loguru import logger
 from pydantic import BaseModel
 
 from app.services.agent_router import AgentRouter
+from app.services.agents.default_agent import DefaultAgent
 from app.models.schemas import AgentResponse
 
 router = APIRouter()
 
+# Агент стрима создается один раз: его сервисы (Ollama, RAG, контекст) общие для всех запросов
+_stream_agent: Optional[DefaultAgent] = None
+
+
+def get_stream_agent() -> DefaultAgent:
+    """Возвращает общий экземпляр DefaultAgent для стриминга ответов."""
+    global _stream_agent
+    if _stream_agent is None:
+        _stream_agent = DefaultAgent()
+    return _stream_agent
+
 
 class ChatMessage(BaseModel):
     """Сообщение в чате."""
@@ -68,6 +81,25 @@ async def chat(request: ChatRequest):
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@router.post("/stream")
+async def chat_stream(request: ChatRequest):
+    """
+    Стримит ответ персоны по мере генерации, без маршрутизации к агентам.
+    
+    Args:
+        request: Запрос с сообщением
+        
+    Returns:
+        StreamingResponse с текстом ответа
+    """
+    # Сервис агента знает людей и проекты из контекста, как и нестримовый ответ персоны
+    agent = get_stream_agent()
+    return StreamingResponse(
+        agent.ollama.generate_persona_response_stream(request.message),
+        media_type="text/plain; charset=utf-8"
+    )
+
+
 @router.get("/health")
 async def health():
     """Health check для чата."""
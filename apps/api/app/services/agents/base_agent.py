@@ -18,7 +18,7 @@ class BaseAgent(ABC):
     def __init__(self):
         self.rag = RAGService()
         self.context_loader = ContextLoader()
-        self.ollama = OllamaService(context_loader=self.context_loader)
+        self.ollama = OllamaService(context_loader=self.context_loader, embedder=self.rag.embed_query)
         
         # Флаг для отслеживания инициализации контекста
         self._context_initialized = False
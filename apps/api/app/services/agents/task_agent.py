@@ -16,7 +16,7 @@ class TaskAgent(BaseAgent):
     
     def __init__(self):
         super().__init__()
-        self.ollama = OllamaService(context_loader=self.context_loader)
+        self.ollama = OllamaService(context_loader=self.context_loader, embedder=self.rag.embed_query)
         self.task_workflow = TaskWorkflow()
     
     def get_agent_type(self) -> str:
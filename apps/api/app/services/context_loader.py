@@ -2,7 +2,11 @@
 Сервис для загрузки и работы с контекстом людей, проектов и глоссария из Notion баз данных.
 Кэширует данные в памяти для быстрого доступа.
 """
+import hashlib
 import json
+import os
+from collections import OrderedDict
+from itertools import islice
 from pathlib import Path
 from typing import Dict, List, Optional, Any, Tuple
 from loguru import logger
@@ -12,6 +16,18 @@ from difflib import SequenceMatcher
 from app.config import get_settings
 
 
+# Отрендеренные фрагменты глоссария: (хеш глоссария, limit) -> текст. Общие для процесса,
+# потому что ContextLoader создается на каждое сообщение
+GLOSSARY_HEAD_CACHE_SIZE = 32
+_glossary_heads: "OrderedDict[Tuple[str, int], str]" = OrderedDict()
+
+
+def _content_hash(data: Any) -> str:
+    """Стабильный хеш JSON-совместимых данных (не зависит от порядка ключей)."""
+    payload = json.dumps(data, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.blake2b(payload.encode(), digest_size=16).hexdigest()
+
+
 class ContextLoader:
     """Загрузчик контекста людей, проектов и глоссария из Notion баз данных."""
     
@@ -32,6 +48,12 @@ class ContextLoader:
         self.people_lookup_map: Dict[str, Dict[str, str]] = {}
         self.projects_lookup_map: Dict[str, Dict[str, Any]] = {}
         
+        # Хеш загруженных людей, проектов и глоссария (обновляется вместе с индексами)
+        self.fingerprint = ""
+        # Глоссарий, для которого посчитан _glossary_hash
+        self._hashed_glossary: Optional[Dict[str, str]] = None
+        self._glossary_hash = ""
+        
         # Notion сервис будет инициализирован при необходимости
         self.notion_service = None
         
@@ -166,9 +188,22 @@ class ContextLoader:
                 if keyword:
                     self.projects_lookup_map[keyword.lower()] = project
         
+        self.fingerprint = _content_hash([self.people, self.projects, self._current_glossary_hash()])
+        
         logger.info(f"Построен обратный индекс для {len(self.people_lookup_map)} вариантов имен людей")
         logger.info(f"Построен обратный индекс для {len(self.projects_lookup_map)} вариантов названий проектов")
     
+    def _current_glossary_hash(self) -> str:
+        """
+        Хеш текущего глоссария.
+        
+        Пересчитывается, только если self.glossary заменен другим словарем.
+        """
+        if self.glossary is not self._hashed_glossary:
+            self._hashed_glossary = self.glossary
+            self._glossary_hash = _content_hash(self.glossary)
+        return self._glossary_hash
+    
     async def sync_context_from_notion(self):
         """
         Синхронизировать контекст из Notion баз данных.
@@ -321,18 +356,13 @@ class ContextLoader:
         """
         # Автоматическая синхронизация с Notion при первом использовании
         await self.ensure_notion_sync()
-        found_people = []
-        found_projects = []
         
         text_lower = text.lower()
         text_words = text_lower.split()
         
-        # Точный поиск людей
-        for alias_lower, person_data in self.people_lookup_map.items():
-            if alias_lower in text_lower:
-                # Проверяем, что это не дубликат
-                if person_data not in found_people:
-                    found_people.append(person_data)
+        # Точный поиск людей и проектов
+        found_people = self.find_people_in_text(text)
+        found_projects = self.find_projects_in_text(text)
         
         # Fuzzy matching для людей (если включено)
         if use_fuzzy:
@@ -361,12 +391,6 @@ class ContextLoader:
                         person_with_score['_matched_name'] = name
                         found_people.append(person_with_score)
         
-        # Поиск проектов (точный)
-        for keyword_lower, project_data in self.projects_lookup_map.items():
-            if keyword_lower in text_lower:
-                if project_data not in found_projects:
-                    found_projects.append(project_data)
-        
         # Fuzzy matching для проектов (если включено)
         if use_fuzzy:
             for word in text_words:
@@ -388,6 +412,125 @@ class ContextLoader:
             'projects': found_projects
         }
     
+    def find_people_in_text(self, text: str) -> List[Dict[str, Any]]:
+        """
+        Точный поиск упомянутых людей по уже построенному индексу, без синхронизации с Notion.
+        
+        Args:
+            text: Текст для анализа
+            
+        Returns:
+            Список найденных людей без дубликатов
+        """
+        text_lower = text.lower()
+        found_people = []
+        for alias_lower, person_data in self.people_lookup_map.items():
+            if alias_lower in text_lower and person_data not in found_people:
+                found_people.append(person_data)
+        return found_people
+    
+    def find_projects_in_text(self, text: str) -> List[Dict[str, Any]]:
+        """
+        Точный поиск упомянутых проектов по уже построенному индексу, без синхронизации с Notion.
+        
+        Args:
+            text: Текст для анализа
+            
+        Returns:
+            Список найденных проектов без дубликатов
+        """
+        text_lower = text.lower()
+        found_projects = []
+        for keyword_lower, project_data in self.projects_lookup_map.items():
+            if keyword_lower in text_lower and project_data not in found_projects:
+                found_projects.append(project_data)
+        return found_projects
+    
+    @staticmethod
+    def _render_person(person: Dict[str, Any]) -> str:
+        """Строка "- Имя (@username) - роль: контекст (также: алиасы)"."""
+        parts = [f"- {person.get('name', '')}"]
+        username = person.get('telegram_username', '')
+        role = person.get('role', '')
+        context = person.get('context', '')
+        aliases = person.get('aliases', [])
+        if username:
+            parts.append(f" (@{username})")
+        if role:
+            parts.append(f" - {role}")
+        if context:
+            parts.append(f": {context}")
+        if aliases:
+            parts.append(f" (также: {', '.join(aliases)})")
+        return "".join(parts)
+    
+    @staticmethod
+    def _render_project(project: Dict[str, Any]) -> str:
+        """Строка "- Название (KEY): описание [Статус: ...] (теги: ...)"."""
+        key = project.get('key', '')
+        parts = [f"- {project.get('name', key)} ({key})"]
+        description = project.get('description', '')
+        status = project.get('status', '')
+        keywords = project.get('keywords', [])
+        if description:
+            parts.append(f": {description}")
+        if status:
+            parts.append(f" [Статус: {status}]")
+        if keywords:
+            parts.append(f" (теги: {', '.join(keywords)})")
+        return "".join(parts)
+    
+    def render_people(self, people: List[Dict[str, Any]]) -> str:
+        """
+        Описания людей для промпта, по строке на человека.
+        
+        Args:
+            people: Люди из resolve_entity
+            
+        Returns:
+            Строки, соединенные переводом строки
+        """
+        return "\n".join(self._render_person(person) for person in people)
+    
+    def render_projects(self, projects: List[Dict[str, Any]]) -> str:
+        """
+        Описания проектов для промпта, по строке на проект.
+        
+        Args:
+            projects: Проекты из resolve_entity
+            
+        Returns:
+            Строки, соединенные переводом строки
+        """
+        return "\n".join(self._render_project(project) for project in projects)
+    
+    def get_glossary_head(self, limit: int = 20) -> str:
+        """
+        Первые limit терминов глоссария строками "- термин: определение".
+        
+        Текст кешируется в общем LRU по хешу глоссария, поэтому загрузчики
+        с тем же глоссарием не рендерят его заново.
+        
+        Args:
+            limit: Сколько терминов взять
+            
+        Returns:
+            Отрендеренный текст (пустая строка, если глоссарий пуст)
+        """
+        key = (self._current_glossary_hash(), limit)
+        head = _glossary_heads.get(key)
+        if head is None:
+            head = "".join(
+                f"- {term}: {definition}\n"
+                for term, definition in islice(self.glossary.items(), limit)
+            )
+            _glossary_heads[key] = head
+            if len(_glossary_heads) > GLOSSARY_HEAD_CACHE_SIZE:
+                _glossary_heads.popitem(last=False)
+        else:
+            _glossary_heads.move_to_end(key)
+        return head
+    
     def find_glossary_terms(self, text: str) -> Dict[str, str]:
         """
         Находит термины глоссария в тексте через keyword matching.
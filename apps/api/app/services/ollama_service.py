@@ -2,15 +2,26 @@
 Сервис для работы с Ollama (локальный AI).
 Использует нативную библиотеку ollama для подключения к локальному серверу.
 """
+import asyncio
+import hashlib
+import math
 import json
-from typing import TypeVar, Type, List, Dict, Any, Optional
+import random
+import re
+import httpx
+from collections import OrderedDict, deque
+from contextlib import aclosing
+from functools import lru_cache
+from typing import TypeVar, Type, List, Dict, Any, Optional, Tuple, Set, Callable, AsyncIterator, Awaitable, Union
 from loguru import logger
 from pydantic import BaseModel, ValidationError
 from tenacity import (
     retry,
     stop_after_attempt,
     wait_exponential,
-    retry_if_exception_type
+    wait_random,
+    retry_if_exception_type,
+    retry_if_not_exception_type
 )
 
 try:
@@ -19,138 +30,569 @@ try:
 except ImportError:
     raise ImportError("Не установлен пакет ollama. Установите: pip install ollama")
 
+try:
+    import aiohttp
+    AIOHTTP_AVAILABLE = True
+except ImportError:
+    AIOHTTP_AVAILABLE = False
+    aiohttp = None
+
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
+    orjson = None
+
+try:
+    import xxhash
+    XXHASH_AVAILABLE = True
+except ImportError:
+    XXHASH_AVAILABLE = False
+    xxhash = None
+
 from app.config import get_settings
 from app.core.cache import get_ollama_cache
 from app.core.errors import handle_service_error, ServiceType, get_degradation_manager
+from app.models.schemas import TaskExtraction
 
 T = TypeVar('T', bound=BaseModel)
 
+@lru_cache(maxsize=None)
+def _schema_dict(response_schema: Type[BaseModel]) -> Dict[str, Any]:
+    """JSON схема Pydantic модели для format= (генерируется один раз на модель)."""
+    return response_schema.model_json_schema()
 
-class OllamaService:
-    """Сервис для работы с Ollama."""
+
+def _extract_text(response: Any) -> str:
+    """
+    Достает текст из ответа Ollama.
     
-    def __init__(self, context_loader=None):
-        settings = get_settings()
-        self.context_loader = context_loader
-        
-        # Используем асинхронную нативную библиотеку ollama
-        self.client = AsyncClient(host=settings.ollama_base_url)
-        
-        self.model_name = settings.ollama_model
-        self.max_tokens = settings.ollama_max_tokens
-        self.temperature = settings.ollama_temperature
-        
-        # Система кеширования для оптимизации
-        self.cache = get_ollama_cache()
+    Основной путь — типизированный ChatResponse (response.message.content);
+    dict и прочие форматы разбираются только если он не сработал.
+    """
+    try:
+        return response.message.content or ""
+    except AttributeError:
+        pass
     
-    @retry(
-        stop=stop_after_attempt(3),
-        wait=wait_exponential(multiplier=1, min=2, max=10),
-        retry=retry_if_exception_type((ValueError, ValidationError, json.JSONDecodeError)),
-        reraise=True
-    )
-    async def analyze_meeting(
+    if isinstance(response, dict):
+        message = response.get('message') or {}
+        return message.get('content', '') or response.get('response', '') or ""
+    
+    message = getattr(response, 'message', None)
+    if isinstance(message, dict):
+        return message.get('content', '') or ""
+    return getattr(response, 'content', '') or ""
+
+
+def _content_key(text: str) -> str:
+    """
+    Короткий хеш текста для ключа кеша (вместо сериализации всего текста в ключ).
+    
+    Ключ некриптографический: xxh3 при наличии xxhash, иначе blake2b.
+    """
+    if XXHASH_AVAILABLE:
+        return xxhash.xxh3_128_hexdigest(text.encode())
+    return hashlib.blake2b(text.encode(), digest_size=16).hexdigest()
+
+
+# Технические префиксы, которые модель повторяет из промпта ("ТВОЙ ОТВЕТ (...):", "Ответ:")
+_RESP_PREFIX_RE = re.compile(r"^\s*(?:(?:ТВОЙ ОТВЕТ|Ответ)(?:\s*\([^)]*\))?:\s*)+", re.IGNORECASE)
+
+
+def _clean_persona_text(text: str) -> str:
+    """Убирает из начала ответа персоны технические префиксы за один проход."""
+    return _RESP_PREFIX_RE.sub("", text, count=1).strip()
+
+
+def _fit_length(text: str, max_length: int) -> str:
+    """Укорачивает ответ до max_length символов по границе слова (если он длиннее)."""
+    if len(text) <= max_length:
+        return text
+    cut = text[:max_length]
+    # Последнее слово обрезано посередине — отбрасываем его целиком
+    if not (cut[-1:].isspace() or text[max_length].isspace()) and " " in cut:
+        cut = cut.rsplit(None, 1)[0]
+    return cut.rstrip(" ,;:—-")
+
+
+def _complete_words(text: str) -> str:
+    """Начало текста до последнего завершенного слова: его _fit_length уже не укоротит."""
+    parts = text.rsplit(None, 1)
+    return parts[0].rstrip(" ,;:—-") if len(parts) == 2 else ""
+
+
+def _truncate_words(text: str, max_words: int) -> str:
+    """Обрезает текст до max_words слов (fallback, если LLM недоступен)."""
+    return " ".join(text.split()[:max_words]) + "..."
+
+
+# Висячие запятые перед } или ] (частая ошибка LLM в JSON) — убираются за один проход
+_TRAILING_COMMA_RE = re.compile(r',\s*([}\]])')
+
+
+def _extract_json(text: str) -> str:
+    """Достает JSON из ответа LLM: снимает обрамление ```json ... ``` и висячие запятые."""
+    text = text.strip()
+    if text.startswith("```json"):
+        text = text[7:]
+    elif text.startswith("```"):
+        text = text[3:]
+    if text.endswith("```"):
+        text = text[:-3]
+    return _TRAILING_COMMA_RE.sub(r'\1', text.strip())
+
+
+class _JsonEndScanner:
+    """Находит конец JSON-значения верхнего уровня в потоке текста (учитывает строки и экранирование)."""
+    
+    def __init__(self):
+        self.depth = 0
+        self.started = False
+        self.in_string = False
+        self.escaped = False
+    
+    def feed(self, piece: str) -> bool:
+        """Обрабатывает очередной фрагмент; True, если JSON закрылся."""
+        for char in piece:
+            if self.in_string:
+                if self.escaped:
+                    self.escaped = False
+                elif char == '\\':
+                    self.escaped = True
+                elif char == '"':
+                    self.in_string = False
+            elif char == '"':
+                self.in_string = self.started
+            elif char in '{[':
+                self.depth += 1
+                self.started = True
+            elif char in '}]' and self.started:
+                self.depth -= 1
+                if self.depth == 0:
+                    return True
+        return False
+
+
+_JSON_HEADERS = {"Content-Type": "application/json"}
+
+# Ошибки самого стриминга (клиент не умеет stream=True, битый фрагмент ответа), после которых
+# имеет смысл повторить запрос без стриминга. Сетевые ошибки и ResponseError пробрасываются в retry
+STREAM_FALLBACK_ERRORS = (TypeError, ValueError, KeyError, AttributeError)
+
+# Пул соединений к Ollama: быстрый отказ при недоступном сервере, долгий keep-alive между запросами.
+# Общего таймаута нет — генерация может идти минутами
+OLLAMA_CONNECT_TIMEOUT_SEC = 5.0
+OLLAMA_KEEPALIVE_SEC = 300
+
+
+def _json_dumps(payload: Dict[str, Any]) -> bytes:
+    """Сериализует тело запроса в bytes (orjson, если установлен)."""
+    if ORJSON_AVAILABLE:
+        return orjson.dumps(payload)
+    return json.dumps(payload, ensure_ascii=False).encode("utf-8")
+
+
+def _json_loads(data: bytes) -> Any:
+    """Разбирает JSON-ответ (orjson, если установлен)."""
+    if ORJSON_AVAILABLE:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+class _OllamaAiohttpClient:
+    """
+    Минимальный клиент Ollama /api/chat поверх aiohttp (меньше CPU на запрос, чем httpx).
+    
+    Повторяет AsyncClient.chat для используемых сервисом параметров, ответы — dict
+    (их разбирает _extract_text). Сессия с keep-alive живет между вызовами.
+    """
+    
+    def __init__(self, host: str):
+        self.host = host.rstrip('/')
+        # Своя сессия на каждый event loop (сессия aiohttp привязана к loop, в котором создана)
+        self._sessions: Dict[asyncio.AbstractEventLoop, Any] = {}
+        self._closing: Set[asyncio.Task] = set()
+    
+    def _get_session(self):
+        """Сессия для текущего event loop (создается лениво; сессии закрытых loop закрываются)."""
+        loop = asyncio.get_running_loop()
+        session = self._sessions.get(loop)
+        if session is None or session.closed:
+            for stale_loop in [other for other in self._sessions if other.is_closed()]:
+                task = asyncio.ensure_future(self._sessions.pop(stale_loop).close())
+                self._closing.add(task)
+                task.add_done_callback(self._on_stale_closed)
+            session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=64, keepalive_timeout=OLLAMA_KEEPALIVE_SEC),
+                timeout=aiohttp.ClientTimeout(total=None, sock_connect=OLLAMA_CONNECT_TIMEOUT_SEC)
+            )
+            self._sessions[loop] = session
+        return session
+    
+    def _on_stale_closed(self, task: asyncio.Task):
+        """Снимает ссылку на закрытие устаревшей сессии и забирает его ошибку (иначе asyncio пишет о ней при сборке)."""
+        self._closing.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            logger.debug(f"Не удалось закрыть сессию завершенного event loop: {task.exception()}")
+    
+    async def chat(
         self,
-        content: str,
-        context: List[str],
-        response_schema: Type[T],
-        sender_username: Optional[str] = None
-    ) -> T:
+        model: str = '',
+        messages: Optional[List[Dict[str, Any]]] = None,
+        *,
+        stream: bool = False,
+        format: Optional[Any] = None,
+        options: Optional[Dict[str, Any]] = None,
+        keep_alive: Optional[Any] = None
+    ):
         """
-        Анализирует контент встречи с контекстом из RAG.
+        POST /api/chat.
         
-        Args:
-            content: Текст транскрипции встречи
-            context: Список похожих прошлых встреч (из RAG)
-            response_schema: Pydantic модель для валидации ответа
-            sender_username: Username отправителя (опционально, для контекста)
-            
         Returns:
-            Валидированный объект типа T
+            dict ответа или (при stream=True) асинхронный итератор dict-фрагментов
         """
-        try:
-            # Формируем контекст из похожих встреч с деталями
-            context_text = ""
-            if context:
-                context_text = "\n\nКОНТЕКСТ ИЗ ПОХОЖИХ ПРОШЛЫХ ВСТРЕЧ (используй для сравнения, выявления паттернов и трендов):\n"
-                for i, ctx in enumerate(context[:3], 1):
-                    # Берем больше контекста для лучшего понимания
-                    ctx_preview = ctx[:800] if len(ctx) > 800 else ctx
-                    context_text += f"\n{i}. {ctx_preview}\n"
-                context_text += "\nИспользуй этот контекст для:\n"
-                context_text += "- Сравнения текущей встречи с прошлыми\n"
-                context_text += "- Выявления паттернов и трендов\n"
-                context_text += "- Добавления контекста в саммари\n"
-                context_text += "- Извлечения инсайтов на основе истории\n"
-            
-            # Добавляем контекст отправителя и проектов
-            context_info = ""
-            known_entities = ""
-            
-            if self.context_loader:
-                # Контекст отправителя
-                if sender_username:
-                    person_context = self.context_loader.get_person_context(sender_username)
-                    if person_context:
-                        context_info += f"Sender: {person_context}\n"
-                
-                # Умный поиск людей и проектов в контенте
-                resolved = await self.context_loader.resolve_entity(content)
-                
-                # Формируем список известных сущностей для LLM
-                if resolved.get('people'):
-                    people_list = []
-                    for person in resolved['people']:
-                        name = person.get('name', '')
-                        username = person.get('telegram_username', '')
-                        role = person.get('role', '')
-                        context = person.get('context', '')
-                        aliases = person.get('aliases', [])
-                        
-                        # Формируем полное описание человека
-                        person_desc = f"- {name}"
-                        if username:
-                            person_desc += f" (@{username})"
-                        if role:
-                            person_desc += f" - {role}"
-                        if context:
-                            person_desc += f": {context}"
-                        if aliases:
-                            person_desc += f" (также: {', '.join(aliases)})"
-                            
-                        people_list.append(person_desc)
-                    known_entities += "Известные люди из команды:\n" + "\n".join(people_list) + "\n\n"
-                
-                if resolved.get('projects'):
-                    projects_list = []
-                    for project in resolved['projects']:
-                        key = project.get('key', '')
-                        name = project.get('name', key)
-                        description = project.get('description', '')
-                        status = project.get('status', '')
-                        keywords = project.get('keywords', [])
-                        
-                        # Формируем полное описание проекта
-                        project_desc = f"- {name} ({key})"
-                        if description:
-                            project_desc += f": {description}"
-                        if status:
-                            project_desc += f" [Статус: {status}]"
-                        if keywords:
-                            project_desc += f" (теги: {', '.join(keywords)})"
-                            
-                        projects_list.append(project_desc)
-                    known_entities += "Известные проекты:\n" + "\n".join(projects_list) + "\n\n"
-                
-                # Добавляем глоссарий терминов
-                if self.context_loader.glossary:
-                    glossary_text = "\n\nГлоссарий терминов (используй правильные термины из этого списка):\n"
-                    # Берем первые 20 терминов, чтобы не перегружать промпт
-                    for term, definition in list(self.context_loader.glossary.items())[:20]:
-                        glossary_text += f"- {term}: {definition}\n"
-                    known_entities += glossary_text
-            
-            system_prompt = """Ты — бот-координатор проектов. Твоя задача — пинать людей, трекать дедлайны и выжимать суть из воды. Ты ненавидишь бюрократию, глупые вопросы, созвоны, которые могли бы быть письмом, и нечеткие ТЗ.
+        payload = {"model": model, "messages": messages or [], "stream": stream}
+        if format is not None:
+            payload["format"] = format
+        if options is not None:
+            payload["options"] = options
+        if keep_alive is not None:
+            payload["keep_alive"] = keep_alive
+        
+        session = self._get_session()
+        if stream:
+            return self._stream(session, payload)
+        
+        async with session.post(
+            f"{self.host}/api/chat", data=_json_dumps(payload), headers=_JSON_HEADERS
+        ) as response:
+            if response.status >= 400:
+                raise ollama.ResponseError(await response.text(), response.status)
+            return _json_loads(await response.read())
+    
+    async def _stream(self, session, payload: Dict[str, Any]) -> AsyncIterator[Dict[str, Any]]:
+        """Читает NDJSON-стрим ответа построчно."""
+        async with session.post(
+            f"{self.host}/api/chat", data=_json_dumps(payload), headers=_JSON_HEADERS
+        ) as response:
+            if response.status >= 400:
+                raise ollama.ResponseError(await response.text(), response.status)
+            async for line in response.content:
+                if not line.strip():
+                    continue
+                part = _json_loads(line)
+                if part.get('error'):
+                    raise ollama.ResponseError(part['error'], response.status)
+                yield part
+    
+    async def close(self):
+        """Закрывает HTTP-сессии всех event loop (сессию работающего в другом потоке loop — в нем самом)."""
+        current = asyncio.get_running_loop()
+        sessions, self._sessions = self._sessions, {}
+        for loop, session in sessions.items():
+            if session.closed:
+                continue
+            if loop is not current and loop.is_running():
+                await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(session.close(), loop))
+            else:
+                await session.close()
+        if self._closing:
+            await asyncio.gather(*self._closing, return_exceptions=True)
+
+
+# Общие клиенты Ollama по хосту: один пул keep-alive соединений на процесс
+_ollama_clients: Dict[str, Any] = {}
+
+
+def get_ollama_client(host: str):
+    """
+    Получает общий клиент для хоста Ollama (создается лениво).
+    
+    aiohttp-клиент, если aiohttp установлен, иначе AsyncClient из ollama (httpx).
+    """
+    client = _ollama_clients.get(host)
+    if client is None:
+        if AIOHTTP_AVAILABLE:
+            client = _OllamaAiohttpClient(host)
+        else:
+            client = AsyncClient(
+                host=host,
+                timeout=httpx.Timeout(None, connect=OLLAMA_CONNECT_TIMEOUT_SEC),
+                limits=httpx.Limits(
+                    max_connections=64,
+                    max_keepalive_connections=32,
+                    keepalive_expiry=OLLAMA_KEEPALIVE_SEC
+                )
+            )
+        _ollama_clients[host] = client
+        logger.info(f"Инициализирован клиент Ollama для {host}")
+    return client
+
+
+async def close_ollama_clients():
+    """Закрывает общие клиенты Ollama (при остановке приложения)."""
+    for client in list(_ollama_clients.values()):
+        close = getattr(client, 'close', None)
+        if close:
+            try:
+                await close()
+            except Exception as e:
+                logger.warning(f"Ошибка при закрытии клиента Ollama: {e}")
+    _ollama_clients.clear()
+
+
+# Ограничители параллельных запросов по хосту Ollama: (event loop, семафор). Общие для всех
+# экземпляров сервиса, чтобы лимит ollama_num_parallel действовал на процесс, а не на объект
+_parallel_semaphores: Dict[str, Tuple[asyncio.AbstractEventLoop, asyncio.Semaphore]] = {}
+
+
+def get_parallel_semaphore(host: str) -> asyncio.Semaphore:
+    """
+    Получает общий ограничитель параллельных запросов к хосту Ollama (создается лениво).
+    
+    Семафор привязан к event loop, поэтому для нового цикла создается заново.
+    """
+    loop = asyncio.get_running_loop()
+    cached = _parallel_semaphores.get(host)
+    if cached is None or cached[0] is not loop:
+        cached = (loop, asyncio.Semaphore(max(1, get_settings().ollama_num_parallel)))
+        _parallel_semaphores[host] = cached
+    return cached[1]
+
+
+# Запросы к Ollama в полете: ключ запроса -> задача (общие для всех экземпляров сервиса)
+_inflight: Dict[str, "asyncio.Task[Any]"] = {}
+
+
+async def _coalesce(key: str, factory: Callable[[], Any]) -> Any:
+    """
+    Одинаковые запросы, пришедшие одновременно, ждут один вызов Ollama.
+    
+    Args:
+        key: Ключ запроса (операция, модель, хеш входа)
+        factory: Создает корутину запроса, если такого еще нет в полете
+        
+    Returns:
+        Результат общего запроса
+    """
+    task = _inflight.get(key)
+    if task is None:
+        task = asyncio.ensure_future(factory())
+        _inflight[key] = task
+        task.add_done_callback(lambda _: _inflight.pop(key, None))
+    # shield: отмена одного ожидающего не отменяет запрос для остальных
+    return await asyncio.shield(task)
+
+
+# Длины недавних ответов по операциям (в токенах) для адаптивного num_predict; общие для процесса
+_output_lengths: Dict[str, deque] = {}
+
+# Сколько ответов помним и сколько нужно, чтобы начать подстраивать num_predict
+OUTPUT_LENGTH_WINDOW = 100
+OUTPUT_LENGTH_MIN_SAMPLES = 10
+
+
+def _output_tokens(response: Any, text: str) -> int:
+    """Число сгенерированных токенов: eval_count из ответа Ollama или оценка по длине текста."""
+    eval_count = response.get('eval_count') if isinstance(response, dict) else getattr(response, 'eval_count', None)
+    if eval_count:
+        return int(eval_count)
+    # Для русского текста ~3 символа на токен
+    return len(text) // 3 + 1
+
+
+def _done_by_length(response: Any) -> bool:
+    """True, если генерация оборвалась на лимите num_predict."""
+    reason = response.get('done_reason') if isinstance(response, dict) else getattr(response, 'done_reason', None)
+    return reason == "length"
+
+
+# Отрендеренные блоки известных сущностей: (вид промпта, отпечаток контекста, хеш текста) -> текст.
+# Общие для процесса: ContextLoader и OllamaService создаются на каждое сообщение, а отпечаток
+# у загрузчиков с одинаковыми людьми, проектами и глоссарием совпадает
+KNOWN_ENTITIES_CACHE_SIZE = 512
+_known_entities: "OrderedDict[Tuple[str, str, str], str]" = OrderedDict()
+
+
+def _entities_key(kind: str, context_loader: Any, text: str) -> Tuple[str, str, str]:
+    """Ключ блока сущностей: вид промпта, отпечаток данных загрузчика и хеш текста."""
+    return (kind, context_loader.fingerprint, _content_key(text))
+
+
+def _cached_entities(key: Tuple[str, str, str]) -> Optional[str]:
+    """Блок сущностей из LRU (помечается как недавно использованный) или None."""
+    rendered = _known_entities.get(key)
+    if rendered is not None:
+        _known_entities.move_to_end(key)
+    return rendered
+
+
+def _remember_entities(key: Tuple[str, str, str], rendered: str) -> None:
+    """Кладет блок сущностей в LRU, вытесняя самый давний."""
+    _known_entities[key] = rendered
+    _known_entities.move_to_end(key)
+    if len(_known_entities) > KNOWN_ENTITIES_CACHE_SIZE:
+        _known_entities.popitem(last=False)
+
+
+# Сколько контента берем в промпт и в эмбеддинг для кеша: в токенах, если задан
+# токенизатор модели (ollama_tokenizer_id), иначе в символах
+MEETING_CONTENT_LIMIT = 4000
+MEETING_CONTENT_TOKENS = 1500
+SUMMARY_INPUT_LIMIT = 3000
+SUMMARY_INPUT_TOKENS = 1000
+
+
+@lru_cache(maxsize=1)
+def _tokenizer():
+    """Токенизатор модели Ollama из HuggingFace (загружается один раз); None, если не задан или недоступен."""
+    tokenizer_id = get_settings().ollama_tokenizer_id
+    if not tokenizer_id:
+        return None
+    try:
+        from transformers import AutoTokenizer
+        return AutoTokenizer.from_pretrained(tokenizer_id)
+    except Exception as e:
+        logger.warning(f"Токенизатор {tokenizer_id} недоступен, обрезаем по символам: {e}")
+        return None
+
+
+def _truncate_input(text: str, max_tokens: int, max_chars: int) -> str:
+    """
+    Обрезает вход модели: точно по токенам, если есть токенизатор, иначе по символам.
+    
+    Args:
+        text: Текст
+        max_tokens: Бюджет в токенах
+        max_chars: Лимит в символах без токенизатора
+        
+    Returns:
+        Обрезанный текст
+    """
+    tokenizer = _tokenizer()
+    if tokenizer is None:
+        return text[:max_chars]
+    # Токен — минимум один символ: короткий текст заведомо влезает
+    if len(text) <= max_tokens:
+        return text
+    ids = tokenizer.encode(text, add_special_tokens=False)
+    if len(ids) <= max_tokens:
+        return text
+    return tokenizer.decode(ids[:max_tokens])
+
+# Неизменная часть промпта персоны. Идет первой и без подстановок, чтобы Ollama
+# переиспользовал KV-кеш префикса между запросами; все переменное — после нее
+PERSONA_PROMPT_PREFIX = """Ты - Neural Slav, персональный AI-ассистент со сложным характером.
+
+ТВОЯ ЛИЧНОСТЬ:
+- Токсичный уставший коллега 
+- Циничный, но полезный
+- Саркастичный, иногда пассивно-агрессивный
+- Кратко отвечаешь, без лишней воды
+- Иногда добавляешь юмор, но не переборщи
+- Говоришь на русском, иногда с жаргоном
+
+ПРАВИЛА ОБЩЕНИЯ:
+- Отвечай как живой человек, а не как AI
+- Будь максимально краток (лимит длины указан после сообщения)
+- Используй контекст из базы знаний если релевантно
+- Не добавляй технические префиксы или суффиксы
+- Отвечай только то, о чем спрашивают
+
+"""
+
+# Полный шаблон промпта персоны (как MEETING_ANALYSIS_PROMPT_TEMPLATE): префикс + переменная часть
+PERSONA_PROMPT_TEMPLATE = PERSONA_PROMPT_PREFIX + """{context_info}{known_entities}ВХОДЯЩЕЕ СООБЩЕНИЕ: {user_input}
+
+ЛИМИТ: до {max_length} символов
+
+ТВОЙ ОТВЕТ (кратко, по-человечески):"""
+
+# Сколько символов начала стрима персоны придерживается, пока в нем может достраиваться технический префикс
+PERSONA_STREAM_HOLD_CHARS = 48
+
+# Ключевые слова (подстроки) для выбора fallback-ответа при сбое LLM
+FALLBACK_KEYWORDS = {
+    # Простые вопросы вроде "работаешь?" — проверяются первыми
+    "ping": frozenset(("работаешь", "живой", "ты тут", "есть", "слышишь")),
+    "task": frozenset(("задач", "сделать", "нужно", "план", "todo", "напомни")),
+    "message": frozenset(("сообщение", "напиши", "отправ", "скажи")),
+    "meeting": frozenset(("встреч", "репорт", "саммари", "обработ")),
+    "knowledge": frozenset(("запомни", "сохрани", "знаний", "база")),
+}
+
+# Приоритет категорий, если в тексте нашлись слова из нескольких
+FALLBACK_CATEGORY_ORDER = ("ping", "task", "message", "meeting", "knowledge")
+_FALLBACK_PRIORITY = {category: rank for rank, category in enumerate(FALLBACK_CATEGORY_ORDER)}
+
+# Все категории в одном паттерне с именованными группами: текст сканируется один раз
+_FALLBACK_PATTERN = re.compile("|".join(
+    f"(?P<{category}>{'|'.join(map(re.escape, sorted(FALLBACK_KEYWORDS[category])))})"
+    for category in FALLBACK_CATEGORY_ORDER
+))
+
+FALLBACK_RESPONSES = {
+    "ping": (
+        "Я тут, на звонок не пойду.",
+        "Работаю. Что нужно?",
+        "Да, жив. Следующий вопрос.",
+        "На месте. Чем займемся?",
+        "Слушаю. Не тяни время."
+    ),
+    # Fallback-ы для создания задач
+    "task": (
+        "Сделал. Следующий. (P.S. Оллама тупит, ответил за нее).",
+        "Задача создана. Нейросеть устала, так что без лишних слов.",
+        "Запланировал. Не благодари. ИИ сегодня не в настроении.",
+        "Готово. Олламе нужен кофе, поэтому отвечаю я.",
+        "Создано. Локальная модель думает слишком медленно."
+    ),
+    # Fallback-ы для сообщений
+    "message": (
+        "Запланировал. Не благодари. Нейросеть устала, так что без лишних слов.",
+        "Отложенное сообщение настроено. ИИ сдох, отвечает backup.",
+        "Сообщение в очереди. Оллама спит, я дежурю.",
+        "Готово. Локальный ИИ перегрелся, временно замещаю.",
+        "Настроил напоминание. Нейросеть ушла на перекур."
+    ),
+    # Fallback-ы для встреч
+    "meeting": (
+        "Встреча обработана. Оллама тормозит, пришлось самому.",
+        "Саммари готово. ИИ думал слишком долго, сделал за него.", 
+        "Обработано. Нейросеть зависла, взял инициативу в свои руки.",
+        "Репорт создан. Локальная модель медленнее черепахи.",
+        "Готово. Оллама ушла размышлять о смысле жизни."
+    ),
+    # Fallback-ы для знаний
+    "knowledge": (
+        "Сохранено в базе. ИИ отвлекся на философию, работаю один.",
+        "Запомнил. Нейросеть устала запоминать, делегировала мне.",
+        "В базе знаний. Оллама ушла медитировать, я подменяю.",
+        "Добавлено. Локальный ИИ перегружен, временно замещение.",
+        "Готово. Нейросеть ищет смысл бытия, а я работаю."
+    ),
+    # Универсальные fallback-ы
+    "default": (
+        "Сделал. Следующий. (P.S. Оллама тупит, ответил за нее).",
+        "Обработано. ИИ сегодня не в форме, пришлось взять дело в свои руки.",
+        "Готово. Нейросеть думает слишком медленно, работаю без неё.",
+        "Выполнено. Локальная модель зависла, продолжаю в ручном режире.",
+        "Сделано. Оллама ушла размышлять, я закончил за неё."
+    ),
+}
+
+_fallback_random = random.Random()
+
+# Опции генерации финального саммари встречи (7-10 предложений)
+FINAL_SUMMARY_OPTIONS = {
+    "temperature": 0.5,
+    "num_predict": 800
+}
+
+# Статичная часть системного промпта для анализа встреч
+MEETING_SYSTEM_PROMPT = """Ты — бот-координатор проектов. Твоя задача — пинать людей, трекать дедлайны и выжимать суть из воды. Ты ненавидишь бюрократию, глупые вопросы, созвоны, которые могли бы быть письмом, и нечеткие ТЗ.
 
 ТОН (TONE OF VOICE):
 1. Максимальная краткость. Никаких "здравствуйте", "пожалуйста", "буду рад помочь". Сразу к делу.
@@ -177,18 +619,13 @@ class OllamaService:
 10. risk_assessment: Риски (в твоем стиле).
 
 Всегда отвечай только валидным JSON согласно схеме."""
-            
-            if known_entities:
-                system_prompt += f"\n\nKNOWN ENTITIES:\n{known_entities}"
-            
-            if context_info:
-                system_prompt += f"\n\nCONTEXT INFO:\n{context_info}"
-            
-            prompt = f"""Проанализируй следующую встречу и извлеки структурированную информацию.
+
+# Шаблон пользовательского промпта для анализа встреч (плейсхолдеры: context_text, content)
+MEETING_ANALYSIS_PROMPT_TEMPLATE = """Проанализируй следующую встречу и извлеки структурированную информацию.
 {context_text}
 
 Транскрипция встречи:
-{content[:4000]}
+{content}
 
 ВАЖНО: Используй контекст из прошлых встреч для:
 - Понимания контекста и истории обсуждений
@@ -220,20 +657,303 @@ class OllamaService:
 - "Иван сделает презентацию к пятнице" → action_items: [{{"text": "Сделать презентацию", "assignee": "Иван", "deadline": "2025-01-31", "priority": "High"}}]
 - "Встреча была вчера в 14:00" → meeting_date: "2025-01-22", meeting_time: "14:00"
 - "Участники: Мария, Петр, Анна" → participants: [{{"name": "Мария"}}, {{"name": "Петр"}}, {{"name": "Анна"}}]"""
+
+# Обрамление блока похожих прошлых встреч (между ними — сами встречи)
+MEETING_CONTEXT_HEADER = "\n\nКОНТЕКСТ ИЗ ПОХОЖИХ ПРОШЛЫХ ВСТРЕЧ (используй для сравнения, выявления паттернов и трендов):\n"
+MEETING_CONTEXT_FOOTER = """
+Используй этот контекст для:
+- Сравнения текущей встречи с прошлыми
+- Выявления паттернов и трендов
+- Добавления контекста в саммари
+- Извлечения инсайтов на основе истории
+"""
+
+
+class OllamaService:
+    """Сервис для работы с Ollama."""
+    
+    def __init__(
+        self,
+        context_loader=None,
+        embedder: Optional[Callable[[str], Union[List[float], Awaitable[List[float]]]]] = None
+    ):
+        settings = get_settings()
+        self.context_loader = context_loader
+        # Функция эмбеддинга для семантического кеша: обычно RAGService.embed_query (асинхронная,
+        # в общем батче вне event loop); синхронная функция вызывается в отдельном потоке
+        self.embedder = embedder
+        
+        # Используем асинхронную нативную библиотеку ollama (общий пул соединений)
+        self.host = settings.ollama_base_url
+        self.client = get_ollama_client(self.host)
+        
+        self.model_name = settings.ollama_model
+        # Короткие ответы персоны можно отдать более быстрой модели
+        self.persona_model = settings.ollama_persona_model or self.model_name
+        # Сколько Ollama держит модель (и KV-кеш общего префикса промпта) в памяти после запроса
+        self.keep_alive = settings.ollama_keep_alive
+        self.max_tokens = settings.ollama_max_tokens
+        self.temperature = settings.ollama_temperature
+        
+        # Система кеширования для оптимизации
+        self.cache = get_ollama_cache()
+        self.cache_sim_threshold = settings.ollama_cache_sim_threshold
+
+    @property
+    def parallel_semaphore(self) -> asyncio.Semaphore:
+        """Ограничение параллельных запросов к хосту (сервер Ollama батчит до OLLAMA_NUM_PARALLEL декодов)."""
+        return get_parallel_semaphore(self.host)
+
+    async def warmup(self) -> bool:
+        """
+        Прогревает модели: минимальный запрос загружает их в память Ollama до первого пользователя.
+        
+        Returns:
+            True, если все модели ответили
+        """
+        ok = True
+        for model in dict.fromkeys((self.model_name, self.persona_model)):
+            try:
+                await self.client.chat(
+                    model=model,
+                    keep_alive=self.keep_alive,
+                    messages=[{"role": "user", "content": "ping"}],
+                    options={"num_predict": 1}
+                )
+                logger.info(f"Модель Ollama {model} прогрета")
+            except Exception as e:
+                ok = False
+                logger.warning(f"Не удалось прогреть модель Ollama {model}: {e}")
+        return ok
+
+    async def _embed(self, text: str) -> Optional[List[float]]:
+        """Эмбеддинг для семантического кеша (не блокирует event loop); None, если эмбеддер недоступен."""
+        if not self.embedder:
+            return None
+        try:
+            if asyncio.iscoroutinefunction(self.embedder):
+                return await self.embedder(text)
+            return await asyncio.to_thread(self.embedder, text)
+        except Exception as e:
+            logger.debug(f"Эмбеддинг для кеша недоступен: {e}")
+            return None
+
+    async def _get_cached(
+        self,
+        request_type: str,
+        embed_text: str,
+        scope: str = "",
+        **key_params
+    ) -> Tuple[Optional[Any], Optional[List[float]]]:
+        """
+        Ищет ответ в кеше: сначала точное совпадение, затем семантически близкий запрос.
+        
+        Эмбеддинг embed_text считается только при промахе точного поиска, приближенный
+        поиск идет только среди запросов с тем же scope.
+        
+        Returns:
+            (ответ или None, эмбеддинг для записи в кеш или None)
+        """
+        cached = self.cache.get_cached_response(request_type, **key_params)
+        if cached is not None:
+            return cached, None
+        embedding = await self._embed(embed_text)
+        if embedding is not None:
+            cached = self.cache.get_similar_response(request_type, embedding, self.cache_sim_threshold, scope=scope)
+        return cached, embedding
+
+    async def _stream_text(
+        self,
+        messages: List[Dict[str, str]],
+        options: Optional[Dict[str, Any]] = None,
+        model: Optional[str] = None
+    ) -> AsyncIterator[str]:
+        """
+        Стримит текст ответа Ollama по мере генерации.
+        
+        Args:
+            messages: Сообщения для чата
+            options: Опции генерации
+            model: Модель (по умолчанию основная)
+            
+        Yields:
+            Непустые фрагменты текста ответа
+        """
+        chat_kwargs = {
+            "model": model or self.model_name,
+            "messages": messages,
+            "stream": True,
+            "keep_alive": self.keep_alive
+        }
+        if options:
+            chat_kwargs["options"] = options
+        
+        stream = await self.client.chat(**chat_kwargs)
+        try:
+            async for chunk in stream:
+                piece = _extract_text(chunk)
+                if piece:
+                    yield piece
+        finally:
+            aclose = getattr(stream, 'aclose', None)
+            if aclose:
+                await aclose()
+    
+    async def _chat_json(
+        self,
+        messages: List[Dict[str, str]],
+        options: Dict[str, Any],
+        schema: Optional[Dict[str, Any]] = None
+    ) -> str:
+        """
+        Запрашивает JSON-ответ стримингом и обрывает генерацию на закрывающей скобке.
+        
+        Все, что модель пишет после JSON (закрывающие ```, комментарии), не декодируется.
+        Если не удался сам стриминг (STREAM_FALLBACK_ERRORS), запрос повторяется без него;
+        остальные ошибки (сеть, ResponseError) пробрасываются.
+        
+        Args:
+            messages: Сообщения для чата
+            options: Опции генерации
+            schema: JSON схема для ограниченной генерации (format=) или None
+            
+        Returns:
+            Текст ответа (может быть пустым)
+        """
+        chat_kwargs = {
+            "model": self.model_name,
+            "messages": messages,
+            "options": options,
+            "keep_alive": self.keep_alive
+        }
+        if schema is not None:
+            chat_kwargs["format"] = schema
+        
+        scanner = _JsonEndScanner()
+        parts = []
+        try:
+            stream = await self.client.chat(**chat_kwargs, stream=True)
+            try:
+                async for chunk in stream:
+                    piece = _extract_text(chunk)
+                    parts.append(piece)
+                    if scanner.feed(piece):
+                        break
+            finally:
+                # Закрываем HTTP-стрим, чтобы Ollama прекратил генерацию
+                aclose = getattr(stream, 'aclose', None)
+                if aclose:
+                    await aclose()
+            return "".join(parts)
+        except STREAM_FALLBACK_ERRORS as e:
+            logger.warning(f"Стриминг ответа Ollama не удался, повторяем без стриминга: {e}")
+        
+        response = await self.client.chat(**chat_kwargs)
+        return _extract_text(response)
+    
+    # Пустой ответ — проблема на стороне Ollama: повторяем с длинной паузой
+    @retry(
+        stop=stop_after_attempt(3),
+        wait=wait_exponential(multiplier=1, min=2, max=10) + wait_random(0, 1),
+        retry=(
+            retry_if_exception_type(ValueError)
+            & retry_if_not_exception_type((ValidationError, json.JSONDecodeError))
+        ),
+        reraise=True
+    )
+    # Битый JSON обычно исправляется при первой же перегенерации: короткая пауза с джиттером
+    @retry(
+        stop=stop_after_attempt(3),
+        wait=wait_exponential(multiplier=0.5, min=0.2, max=5) + wait_random(0, 0.5),
+        retry=retry_if_exception_type((ValidationError, json.JSONDecodeError)),
+        reraise=True
+    )
+    async def analyze_meeting(
+        self,
+        content: str,
+        context: List[str],
+        response_schema: Type[T],
+        sender_username: Optional[str] = None,
+        trust_cache: bool = True
+    ) -> T:
+        """
+        Анализирует контент встречи с контекстом из RAG.
+        
+        В кеш кладется уже провалидированный объект, поэтому при попадании
+        он возвращается без повторной валидации (trust_cache=False включает
+        ее обратно, например для отладки).
+        
+        Args:
+            content: Текст транскрипции встречи
+            context: Список похожих прошлых встреч (из RAG)
+            response_schema: Pydantic модель для валидации ответа
+            sender_username: Username отправителя (опционально, для контекста)
+            trust_cache: Не валидировать повторно ответ из кеша
             
-            # Генерируем JSON схему из Pydantic модели
-            schema = response_schema.model_json_schema()
+        Returns:
+            Валидированный объект типа T
+        """
+        try:
+            cache_params = {
+                "user_input": _content_key(content),
+                "sender_username": sender_username,
+                "schema": response_schema.__name__
+            }
+            # Только точное совпадение по хешу всего текста: похожее начало (регулярные встречи
+            # с теми же участниками и приветствием) не значит те же задачи, даты и участников
+            cached = self.cache.get_cached_response("analysis", **cache_params)
+            if isinstance(cached, response_schema):
+                logger.info("Анализ встречи взят из кеша")
+                return cached if trust_cache else response_schema.model_validate(cached.model_dump())
+            
+            # Формируем контекст из похожих встреч с деталями
+            context_text = ""
+            if context:
+                # Берем больше контекста для лучшего понимания
+                context_text = (
+                    MEETING_CONTEXT_HEADER
+                    + "".join(f"\n{i}. {ctx[:800]}\n" for i, ctx in enumerate(context[:3], 1))
+                    + MEETING_CONTEXT_FOOTER
+                )
+            
+            # Добавляем контекст отправителя и проектов
+            context_info = ""
+            known_entities = ""
+            
+            if self.context_loader:
+                # Контекст отправителя
+                if sender_username:
+                    person_context = self.context_loader.get_person_context(sender_username)
+                    if person_context:
+                        context_info += f"Sender: {person_context}\n"
+                
+                # Умный поиск людей и проектов в контенте
+                known_entities = await self._resolved_entities("meeting", content, self._render_meeting_entities)
+            
+            system_prompt_parts = [MEETING_SYSTEM_PROMPT]
             
-            logger.info(f"Вызов Ollama {self.model_name} для анализа встречи")
+            if known_entities:
+                system_prompt_parts.append(f"\n\nKNOWN ENTITIES:\n{known_entities}")
+            
+            if context_info:
+                system_prompt_parts.append(f"\n\nCONTEXT INFO:\n{context_info}")
+            
+            system_prompt = "".join(system_prompt_parts)
             
-            # Используем асинхронную нативную библиотеку ollama
+            prompt = MEETING_ANALYSIS_PROMPT_TEMPLATE.format(
+                context_text=context_text,
+                content=_truncate_input(content, MEETING_CONTENT_TOKENS, MEETING_CONTENT_LIMIT)
+            )
+            
+            logger.info("Вызов Ollama {} для анализа встречи", self.model_name)
+            
+            # Стримим ответ, чтобы не ждать генерации хвоста после JSON
             try:
-                response = await self.client.chat(
-                    model=self.model_name,
+                response_text = await self._chat_json(
                     messages=[
                         {
                             "role": "system",
-                            "content": f"{system_prompt}\n\nJSON схема:\n{json.dumps(schema, indent=2, ensure_ascii=False)}"
+                            "content": system_prompt
                         },
                         {
                             "role": "user",
@@ -243,24 +963,12 @@ class OllamaService:
                     options={
                         "temperature": self.temperature,
                         "num_predict": self.max_tokens
-                    }
+                    },
+                    schema=_schema_dict(response_schema)
                 )
                 
-                # Извлекаем контент из ответа Ollama
-                response_text = ""
-                if hasattr(response, 'message') and hasattr(response.message, 'content'):
-                    response_text = response.message.content
-                elif isinstance(response, dict):
-                    response_text = response.get('message', {}).get('content', '') or response.get('response', '')
-                elif hasattr(response, 'content'):
-                    response_text = response.content
-                
-                if not response_text:
-                    # Если всё еще пусто, пробуем получить хоть какой-то текст, но не весь объект
-                    response_text = getattr(response, 'content', '') or getattr(getattr(response, 'message', {}), 'content', '')
-                
                 if not response_text:
-                    logger.error(f"Ollama вернул пустой ответ в analyze_meeting. Response type: {type(response)}")
+                    logger.error("Ollama вернул пустой ответ в analyze_meeting")
                     raise ValueError("Ollama вернул пустой ответ")
             except Exception as e:
                 logger.error(f"Ошибка при вызове Ollama: {e}")
@@ -268,33 +976,45 @@ class OllamaService:
             
             # Парсим и валидируем ответ
             try:
-                text = response_text.strip()
-                if text.startswith("```json"):
-                    text = text[7:]
-                elif text.startswith("```"):
-                    text = text[3:]
-                if text.endswith("```"):
-                    text = text[:-3]
-                text = text.strip()
-                
-                import re
-                text = re.sub(r',\s*}', '}', text)
-                text = re.sub(r',\s*]', ']', text)
+                text = _extract_json(response_text)
                 
-                result_json = json.loads(text)
-                validated = response_schema.model_validate(result_json)
+                # Парсинг и валидация (Rust) вне event loop
+                validated = await asyncio.to_thread(response_schema.model_validate_json, text)
             except (ValidationError, json.JSONDecodeError) as e:
                 logger.error(f"Ошибка валидации ответа Ollama: {e}")
-                logger.debug(f"Сырой ответ: {response_text[:500]}")
+                logger.opt(lazy=True).debug("Сырой ответ: {}", lambda: response_text[:500])
                 raise
             
-            logger.info(f"Успешно проанализирована встреча через {self.model_name}")
+            self.cache.cache_response("analysis", validated, **cache_params)
+            
+            logger.info("Успешно проанализирована встреча через {}", self.model_name)
             return validated
             
         except Exception as e:
             logger.error(f"Ошибка при анализе встречи: {e}")
             raise
     
+    async def analyze_meetings_batch(self, items: List[Dict[str, Any]]) -> List[Any]:
+        """
+        Анализирует несколько встреч параллельно.
+        
+        Запросы уходят в Ollama одновременно (не больше ollama_num_parallel на процесс),
+        сервер батчит их декодирование.
+        
+        Args:
+            items: Аргументы analyze_meeting для каждой встречи
+                (content, context, response_schema, ...)
+            
+        Returns:
+            Результаты в том же порядке, что и items; ошибка встречи
+            возвращается на ее месте как исключение
+        """
+        async def _analyze(params: Dict[str, Any]):
+            async with self.parallel_semaphore:
+                return await self.analyze_meeting(**params)
+        
+        return list(await asyncio.gather(*(_analyze(params) for params in items), return_exceptions=True))
+    
     async def extract_task_intent(self, text: str) -> Dict[str, Any]:
         """
         Извлекает структурированную информацию о задаче из текста.
@@ -305,44 +1025,25 @@ class OllamaService:
         Returns:
             Словарь с полями: intent, deadline, priority, assignee, project
         """
-        from app.models.schemas import TaskExtraction
+        # Только точное совпадение: у близких по смыслу задач отличаются сроки, исполнители и проекты
+        cache_params = {"user_input": _content_key(text)}
+        cached = self.cache.get_cached_response("task_intent", **cache_params)
+        if cached is not None:
+            logger.debug("Intent задачи взят из кеша")
+            return dict(cached)
         
+        result = await _coalesce(
+            f"task_intent:{self.model_name}:{cache_params['user_input']}",
+            lambda: self._extract_task_intent_uncached(text, cache_params)
+        )
+        return dict(result)
+    
+    async def _extract_task_intent_uncached(self, text: str, cache_params: Dict[str, Any]) -> Dict[str, Any]:
+        """Вызывает Ollama для извлечения intent задачи и кеширует результат (без проверки кеша)."""
         # Формируем контекст из известных сущностей
         known_entities = ""
         if self.context_loader:
-            resolved = await self.context_loader.resolve_entity(text)
-            
-            if resolved.get('people'):
-                people_list = []
-                for person in resolved['people']:
-                    name = person.get('name', '')
-                    username = person.get('telegram_username', '')
-                    role = person.get('role', '')
-                    
-                    # Формируем краткое описание для задач
-                    person_desc = f"- {name}"
-                    if username:
-                        person_desc += f" (@{username})"
-                    if role:
-                        person_desc += f" - {role}"
-                        
-                    people_list.append(person_desc)
-                known_entities += "Известные люди:\n" + "\n".join(people_list) + "\n\n"
-            
-            if resolved.get('projects'):
-                projects_list = []
-                for project in resolved['projects']:
-                    key = project.get('key', '')
-                    name = project.get('name', key)
-                    description = project.get('description', '')
-                    
-                    # Формируем краткое описание для задач
-                    project_desc = f"- {name} ({key})"
-                    if description:
-                        project_desc += f": {description}"
-                        
-                    projects_list.append(project_desc)
-                known_entities += "Известные проекты:\n" + "\n".join(projects_list) + "\n\n"
+            known_entities = await self._resolved_entities("task", text, self._render_task_entities)
         
         prompt = f"""Извлеки из следующего текста структурированную информацию о задаче.
 
@@ -363,10 +1064,10 @@ class OllamaService:
 Ответь строго в формате JSON согласно схеме."""
         
         try:
-            schema = TaskExtraction.model_json_schema()
-            
+            # Схема передается в format=: Ollama ограничивает декодирование валидным JSON по ней
             response = await self.client.chat(
                 model=self.model_name,
+                keep_alive=self.keep_alive,
                 messages=[
                     {
                         "role": "system",
@@ -374,32 +1075,18 @@ class OllamaService:
                     },
                     {
                         "role": "user",
-                        "content": f"{prompt}\n\nJSON схема:\n{json.dumps(schema, indent=2, ensure_ascii=False)}"
+                        "content": prompt
                     }
                 ],
+                format=_schema_dict(TaskExtraction),
                 options={
                     "temperature": 0.3,
-                    "num_predict": 500
+                    "num_predict": 200
                 }
             )
             
             # Извлекаем контент из ответа Ollama
-            response_text = ""
-            
-            # 1. Пробуем получить как словарь
-            if isinstance(response, dict):
-                response_text = response.get('message', {}).get('content', '') or response.get('response', '')
-            
-            # 2. Пробуем получить через атрибуты объекта (стандартный Python клиент)
-            elif hasattr(response, 'message'):
-                if hasattr(response.message, 'content'):
-                    response_text = response.message.content
-                elif isinstance(response.message, dict):
-                    response_text = response.message.get('content', '')
-            
-            # 3. Пробуем прямой атрибут content
-            elif hasattr(response, 'content'):
-                response_text = response.content
+            response_text = _extract_text(response)
                 
             # Если ничего не помогло, НЕ используем str(response) чтобы избежать мусора
             if not response_text:
@@ -407,24 +1094,12 @@ class OllamaService:
                 # Лучше вернуть пустую строку и вызвать ошибку, чем вернуть мусор
                 raise ValueError("Не удалось извлечь текст из ответа Ollama")
             
-            # Парсим JSON
-            text = response_text.strip()
-            if text.startswith("```json"):
-                text = text[7:]
-            elif text.startswith("```"):
-                text = text[3:]
-            if text.endswith("```"):
-                text = text[:-3]
-            text = text.strip()
-            
-            import re
-            text = re.sub(r',\s*}', '}', text)
-            text = re.sub(r',\s*]', ']', text)
-            
-            result_json = json.loads(text)
-            validated = TaskExtraction.model_validate(result_json)
-            
-            return validated.model_dump()
+            # Ответ ограничен схемой — чистка от ``` и висячих запятых не нужна
+            validated = TaskExtraction.model_validate_json(response_text)
+            
+            result = validated.model_dump()
+            self.cache.cache_response("task_intent", result, **cache_params)
+            return result
         except Exception as e:
             logger.error(f"Ошибка при извлечении intent: {e}")
             # Fallback
@@ -454,16 +1129,13 @@ class OllamaService:
             Валидированный объект типа T
         """
         try:
-            schema = response_schema.model_json_schema()
+            logger.info("Генерация структурированного ответа через {}", self.model_name)
             
-            logger.info(f"Генерация структурированного ответа через {self.model_name}")
-            
-            response = await self.client.chat(
-                model=self.model_name,
+            response_text = await self._chat_json(
                 messages=[
                     {
                         "role": "system",
-                        "content": f"Ты помощник для генерации структурированных ответов. Всегда отвечай строго в формате JSON согласно схеме.\n\nJSON схема:\n{json.dumps(schema, indent=2, ensure_ascii=False)}"
+                        "content": "Ты помощник для генерации структурированных ответов. Всегда отвечай строго в формате JSON согласно схеме."
                     },
                     {
                         "role": "user",
@@ -473,45 +1145,27 @@ class OllamaService:
                 options={
                     "temperature": temperature,
                     "num_predict": self.max_tokens
-                }
+                },
+                schema=_schema_dict(response_schema)
             )
             
-            # Извлекаем контент из ответа Ollama
-            response_text = ""
-            if hasattr(response, 'message') and hasattr(response.message, 'content'):
-                response_text = response.message.content
-            elif isinstance(response, dict):
-                response_text = response.get('message', {}).get('content', '') or response.get('response', '')
-            elif hasattr(response, 'content'):
-                response_text = response.content
-            
             if not response_text:
-                logger.error(f"Ollama вернул пустой ответ в generate_structured. Response type: {type(response)}")
+                logger.error("Ollama вернул пустой ответ в generate_structured")
                 raise ValueError("Ollama вернул пустой ответ")
             
             # Парсим JSON
-            text = response_text.strip()
-            if text.startswith("```json"):
-                text = text[7:]
-            elif text.startswith("```"):
-                text = text[3:]
-            if text.endswith("```"):
-                text = text[:-3]
-            text = text.strip()
-            
-            import re
-            text = re.sub(r',\s*}', '}', text)
-            text = re.sub(r',\s*]', ']', text)
-            
-            result_json = json.loads(text)
-            validated = response_schema.model_validate(result_json)
-            
-            logger.info(f"Успешно сгенерирован структурированный ответ")
+            text = _extract_json(response_text)
+            
+            # Парсинг и валидация (Rust) вне event loop
+            validated = await asyncio.to_thread(response_schema.model_validate_json, text)
+            
+            logger.info("Успешно сгенерирован структурированный ответ")
             return validated
             
         except (ValidationError, json.JSONDecodeError) as e:
             logger.error(f"Ошибка валидации ответа Ollama: {e}")
-            logger.debug(f"Сырой ответ: {response_text[:500] if 'response_text' in locals() else 'N/A'}")
+            # Ошибка валидации возможна только после получения ответа — response_text определен
+            logger.opt(lazy=True).debug("Сырой ответ: {}", lambda: response_text[:500])
             raise
         except Exception as e:
             logger.error(f"Ошибка при генерации структурированного ответа: {e}")
@@ -523,20 +1177,33 @@ class OllamaService:
         
         Args:
             text: Текст для суммаризации
-            max_length: Максимальная длина summary
+            max_length: Максимальная длина summary (в словах)
             
         Returns:
             Суммаризированный текст
         """
+        cache_params = {"user_input": _content_key(text), "max_length": max_length}
+        cached = self.cache.get_cached_response("summarization", **cache_params)
+        if cached:
+            return cached
+        
+        return await _coalesce(
+            f"summarization:{self.model_name}:{max_length}:{cache_params['user_input']}",
+            lambda: self._summarize_text_uncached(text, max_length, cache_params)
+        )
+    
+    async def _summarize_text_uncached(self, text: str, max_length: int, cache_params: Dict[str, Any]) -> str:
+        """Вызывает Ollama для суммаризации и кеширует результат (без проверки кеша)."""
         prompt = f"""Суммаризируй следующий текст в {max_length} слов или меньше:
 
-{text[:3000]}
+{_truncate_input(text, SUMMARY_INPUT_TOKENS, SUMMARY_INPUT_LIMIT)}
 
 Summary:"""
         
         try:
             response = await self.client.chat(
                 model=self.model_name,
+                keep_alive=self.keep_alive,
                 messages=[
                     {
                         "role": "user",
@@ -550,22 +1217,17 @@ Summary:"""
             )
             
             # Извлекаем контент из ответа Ollama
-            response_text = ""
-            if hasattr(response, 'message') and hasattr(response.message, 'content'):
-                response_text = response.message.content
-            elif isinstance(response, dict):
-                response_text = response.get('message', {}).get('content', '') or response.get('response', '')
-            elif hasattr(response, 'content'):
-                response_text = response.content
+            response_text = _extract_text(response)
             
             if not response_text:
                 logger.warning(f"Ollama вернул пустой ответ в summarize_text. Response type: {type(response)}")
-                return text[:max_length] + "..."
+                return _truncate_words(text, max_length)
             
+            self.cache.cache_response("summarization", response_text, **cache_params)
             return response_text
         except Exception as e:
             logger.error(f"Ошибка при суммаризации: {e}")
-            return text[:max_length] + "..."
+            return _truncate_words(text, max_length)
     
     async def summarize_chunk_with_context(
         self,
@@ -624,9 +1286,16 @@ Summary:"""
 
 Саммари (кратко, по делу, упомяни проекты и участники если есть):"""
         
+        # Промпт целиком определяет ответ: чанк, его номер и найденные сущности
+        cache_params = {"user_input": _content_key(prompt), "kind": "chunk"}
+        cached = self.cache.get_cached_response("summarization", **cache_params)
+        if cached:
+            return cached
+        
         try:
             response = await self.client.chat(
                 model=self.model_name,
+                keep_alive=self.keep_alive,
                 messages=[
                     {
                         "role": "user",
@@ -640,22 +1309,84 @@ Summary:"""
             )
             
             # Извлекаем контент из ответа Ollama
-            response_text = ""
-            if hasattr(response, 'message') and hasattr(response.message, 'content'):
-                response_text = response.message.content
-            elif isinstance(response, dict):
-                response_text = response.get('message', {}).get('content', '') or response.get('response', '')
-            elif hasattr(response, 'content'):
-                response_text = response.content
+            response_text = _extract_text(response)
             
             if not response_text:
                 logger.warning(f"Ollama вернул пустой ответ в summarize_chunk_with_context. Response type: {type(response)}")
                 return chunk_text[:150] + "..."
             
-            return response_text.strip()
+            summary = response_text.strip()
+            self.cache.cache_response("summarization", summary, **cache_params)
+            return summary
         except Exception as e:
             logger.error(f"Ошибка при суммаризации чанка #{chunk_number}: {e}")
             return chunk_text[:150] + "..."
+
+    async def summarize_chunks_batch(
+        self,
+        chunks: List[Tuple[str, int]],
+        projects: list = None,
+        people: list = None,
+        terms: dict = None
+    ) -> List[str]:
+        """
+        Суммаризирует несколько чанков параллельно.
+
+        Запросы уходят в Ollama одновременно (не больше ollama_num_parallel на процесс),
+        сервер батчит их декодирование.
+
+        Args:
+            chunks: Список пар (текст чанка, номер чанка)
+            projects: Список найденных проектов
+            people: Список найденных людей
+            terms: Словарь найденных терминов {term: definition}
+
+        Returns:
+            Саммари чанков в том же порядке, что и chunks
+        """
+        async def _summarize(chunk_text: str, chunk_number: int) -> str:
+            async with self.parallel_semaphore:
+                return await self.summarize_chunk_with_context(
+                    chunk_text, chunk_number, projects=projects, people=people, terms=terms
+                )
+
+        return list(await asyncio.gather(*(_summarize(text, number) for text, number in chunks)))
+
+    @staticmethod
+    def _adaptive_num_predict(operation: str, default: int, cap: int) -> int:
+        """
+        Лимит генерации по недавним ответам операции: p95 длины с запасом 20%.
+        
+        Args:
+            operation: Имя операции
+            default: Лимит, пока статистики недостаточно
+            cap: Верхняя граница лимита
+            
+        Returns:
+            Значение num_predict
+        """
+        lengths = _output_lengths.get(operation)
+        if not lengths or len(lengths) < OUTPUT_LENGTH_MIN_SAMPLES:
+            return default
+        ordered = sorted(lengths)
+        p95 = ordered[min(len(ordered) - 1, math.ceil(len(ordered) * 0.95) - 1)]
+        return min(cap, int(p95 * 1.2) + 1)
+    
+    @staticmethod
+    def _record_output_length(operation: str, tokens: int):
+        """Запоминает длину ответа операции (в токенах)."""
+        lengths = _output_lengths.get(operation)
+        if lengths is None:
+            lengths = _output_lengths[operation] = deque(maxlen=OUTPUT_LENGTH_WINDOW)
+        lengths.append(tokens)
+    
+    def _final_summary_options(self) -> Dict[str, Any]:
+        """Опции финального саммари с адаптивным num_predict."""
+        default = FINAL_SUMMARY_OPTIONS["num_predict"]
+        return {
+            **FINAL_SUMMARY_OPTIONS,
+            "num_predict": self._adaptive_num_predict("summary_final", default=default, cap=default)
+        }
     
     async def summarize_from_chunks(self, summarized_chunks: list) -> str:
         """
@@ -670,53 +1401,96 @@ Summary:"""
         if not summarized_chunks:
             return "Встреча не содержит контента для суммаризации."
         
-        chunks_text = "\n\n".join([f"Чанк {i+1}: {chunk}" for i, chunk in enumerate(summarized_chunks)])
-        
-        prompt = f"""Создай финальное саммари встречи на основе следующих суммаризированных чанков:
-
-{chunks_text}
-
-Саммари должно быть:
-- 7-10 предложений
-- Структурированным (основные темы, решения, задачи)
-- С упоминанием проектов и участников
-- В стиле персоны: кратко, по делу, без воды
-
-Финальное саммари:"""
+        prompt = self._build_final_summary_prompt(summarized_chunks)
         
         try:
             response = await self.client.chat(
                 model=self.model_name,
+                keep_alive=self.keep_alive,
                 messages=[
                     {
                         "role": "user",
                         "content": prompt
                     }
                 ],
-                options={
-                    "temperature": 0.5,
-                    "num_predict": 800  # 7-10 предложений
-                }
+                options=self._final_summary_options()
             )
             
             # Извлекаем контент из ответа Ollama
-            response_text = ""
-            if hasattr(response, 'message') and hasattr(response.message, 'content'):
-                response_text = response.message.content
-            elif isinstance(response, dict):
-                response_text = response.get('message', {}).get('content', '') or response.get('response', '')
-            elif hasattr(response, 'content'):
-                response_text = response.content
+            response_text = _extract_text(response)
             
             if not response_text:
                 logger.warning(f"Ollama вернул пустой ответ в summarize_from_chunks. Response type: {type(response)}")
                 return "\n\n".join(summarized_chunks)
             
+            # Упершийся в лимит ответ считаем полным лимитом, чтобы лимит мог снова вырасти
+            tokens = FINAL_SUMMARY_OPTIONS["num_predict"] if _done_by_length(response) else _output_tokens(response, response_text)
+            self._record_output_length("summary_final", tokens)
+            
             return response_text.strip()
         except Exception as e:
             logger.error(f"Ошибка при создании финального саммари: {e}")
             return "\n\n".join(summarized_chunks)
     
+    async def summarize_from_chunks_stream(self, summarized_chunks: list) -> AsyncIterator[str]:
+        """
+        Стримит финальное саммари встречи по мере генерации.
+        
+        Args:
+            summarized_chunks: Список суммаризированных чанков
+            
+        Yields:
+            Фрагменты саммари (при сбое до первого фрагмента — склеенные чанки)
+        """
+        if not summarized_chunks:
+            yield "Встреча не содержит контента для суммаризации."
+            return
+        
+        prompt = self._build_final_summary_prompt(summarized_chunks)
+        options = self._final_summary_options()
+        streamed_chars = 0
+        try:
+            stream = self._stream_text([{"role": "user", "content": prompt}], options)
+            # Слот на хосте держится до конца генерации, как и у стрима персоны
+            async with self.parallel_semaphore, aclosing(stream):
+                async for piece in stream:
+                    streamed_chars += len(piece)
+                    yield piece
+        except Exception as e:
+            logger.error(f"Ошибка при стриминге финального саммари: {e}")
+        
+        if not streamed_chars:
+            yield "\n\n".join(summarized_chunks)
+            return
+        
+        # В стриме нет eval_count — оцениваем по длине; упор в лимит считаем полным лимитом
+        tokens = streamed_chars // 3 + 1
+        if tokens >= options["num_predict"]:
+            tokens = FINAL_SUMMARY_OPTIONS["num_predict"]
+        self._record_output_length("summary_final", tokens)
+    
+    @staticmethod
+    def _build_final_summary_prompt(summarized_chunks: list) -> str:
+        """Собирает промпт финального саммари из суммаризированных чанков."""
+        # Повторяющиеся саммари чанков только удлиняют промпт (prefill) — оставляем первое
+        unique_chunks = {}
+        for chunk in summarized_chunks:
+            unique_chunks.setdefault(" ".join(chunk.lower().split()), chunk.strip())
+        unique_chunks.pop("", None)
+        chunks_text = "\n\n".join(f"Чанк {i}: {chunk}" for i, chunk in enumerate(unique_chunks.values(), 1))
+        
+        return f"""Создай финальное саммари встречи на основе следующих суммаризированных чанков:
+
+{chunks_text}
+
+Саммари должно быть:
+- 7-10 предложений
+- Структурированным (основные темы, решения, задачи)
+- С упоминанием проектов и участников
+- В стиле персоны: кратко, по делу, без воды
+
+Финальное саммари:"""
+    
     def _get_fallback_response(self, user_input: str, context: str = "") -> str:
         """
         Возвращает ответ в стиле персоны при сбое LLM.
@@ -728,77 +1502,231 @@ Summary:"""
         Returns:
             Ответ в стиле "Neural Slav"
         """
-        import random
-        
         # Определяем тип операции для более точного fallback
         user_lower = user_input.lower()
         
-        task_keywords = ["задач", "сделать", "нужно", "план", "todo", "напомни"]
-        message_keywords = ["сообщение", "напиши", "отправ", "скажи"]
-        meeting_keywords = ["встреч", "репорт", "саммари", "обработ"]
-        knowledge_keywords = ["запомни", "сохрани", "знаний", "база"]
-        
-        # Fallback-ы для создания задач
-        if any(keyword in user_lower for keyword in task_keywords):
-            responses = [
-                "Сделал. Следующий. (P.S. Оллама тупит, ответил за нее).",
-                "Задача создана. Нейросеть устала, так что без лишних слов.",
-                "Запланировал. Не благодари. ИИ сегодня не в настроении.",
-                "Готово. Олламе нужен кофе, поэтому отвечаю я.",
-                "Создано. Локальная модель думает слишком медленно."
-            ]
-        
-        # Fallback-ы для сообщений
-        elif any(keyword in user_lower for keyword in message_keywords):
-            responses = [
-                "Запланировал. Не благодари. Нейросеть устала, так что без лишних слов.",
-                "Отложенное сообщение настроено. ИИ сдох, отвечает backup.",
-                "Сообщение в очереди. Оллама спит, я дежурю.",
-                "Готово. Локальный ИИ перегрелся, временно замещаю.",
-                "Настроил напоминание. Нейросеть ушла на перекур."
-            ]
-        
-        # Fallback-ы для встреч
-        elif any(keyword in user_lower for keyword in meeting_keywords):
-            responses = [
-                "Встреча обработана. Оллама тормозит, пришлось самому.",
-                "Саммари готово. ИИ думал слишком долго, сделал за него.", 
-                "Обработано. Нейросеть зависла, взял инициативу в свои руки.",
-                "Репорт создан. Локальная модель медленнее черепахи.",
-                "Готово. Оллама ушла размышлять о смысле жизни."
-            ]
-        
-        # Fallback-ы для знаний
-        elif any(keyword in user_lower for keyword in knowledge_keywords):
-            responses = [
-                "Сохранено в базе. ИИ отвлекся на философию, работаю один.",
-                "Запомнил. Нейросеть устала запоминать, делегировала мне.",
-                "В базе знаний. Оллама ушла медитировать, я подменяю.",
-                "Добавлено. Локальный ИИ перегружен, временно замещение.",
-                "Готово. Нейросеть ищет смысл бытия, а я работаю."
-            ]
-        
-        # Для простых вопросов вроде "работаешь?"
-        if any(word in user_lower for word in ["работаешь", "живой", "ты тут", "есть", "слышишь"]):
-            responses = [
-                "Я тут, на звонок не пойду.",
-                "Работаю. Что нужно?",
-                "Да, жив. Следующий вопрос.",
-                "На месте. Чем займемся?",
-                "Слушаю. Не тяни время."
-            ]
-        
-        # Универсальные fallback-ы
-        else:
-            responses = [
-                "Сделал. Следующий. (P.S. Оллама тупит, ответил за нее).",
-                "Обработано. ИИ сегодня не в форме, пришлось взять дело в свои руки.",
-                "Готово. Нейросеть думает слишком медленно, работаю без неё.",
-                "Выполнено. Локальная модель зависла, продолжаю в ручном режире.",
-                "Сделано. Оллама ушла размышлять, я закончил за неё."
-            ]
+        category = min(
+            (match.lastgroup for match in _FALLBACK_PATTERN.finditer(user_lower)),
+            key=_FALLBACK_PRIORITY.__getitem__,
+            default="default"
+        )
+        return _fallback_random.choice(FALLBACK_RESPONSES[category])
+    
+    def _build_known_entities(self, user_input: str) -> str:
+        """
+        Детальное описание упомянутых людей и проектов из базы для промпта персоны.
+        
+        Кешируется в общем LRU по хешу текста и отпечатку данных контекста.
+        
+        Args:
+            user_input: Входящее сообщение пользователя
+            
+        Returns:
+            Блок "ИЗВЕСТНЫЕ СУЩНОСТИ" или пустая строка
+        """
+        if not self.context_loader:
+            return ""
+        key = _entities_key("persona", self.context_loader, user_input)
+        rendered = _cached_entities(key)
+        if rendered is None:
+            # Только точный поиск по готовым индексам: синхронизация с Notion на каждый ответ персоны слишком дорога
+            rendered = self._render_persona_entities({
+                'people': self.context_loader.find_people_in_text(user_input),
+                'projects': self.context_loader.find_projects_in_text(user_input),
+            })
+            _remember_entities(key, rendered)
+        return rendered
+    
+    async def _resolved_entities(self, kind: str, text: str, render: Callable[[Dict[str, Any]], str]) -> str:
+        """
+        Блок сущностей из resolve_entity (с fuzzy matching) для промптов встреч и задач.
+        
+        Кешируется в общем LRU, как и блок персоны. Синхронизация с Notion идет до
+        расчета ключа, чтобы отпечаток соответствовал данным, по которым ищем.
+        
+        Args:
+            kind: Вид промпта ("meeting" или "task")
+            text: Текст для поиска сущностей
+            render: Рендерер найденных сущностей
+            
+        Returns:
+            Отрендеренный блок или пустая строка
+        """
+        await self.context_loader.ensure_notion_sync()
+        key = _entities_key(kind, self.context_loader, text)
+        rendered = _cached_entities(key)
+        if rendered is None:
+            rendered = render(await self.context_loader.resolve_entity(text))
+            _remember_entities(key, rendered)
+        return rendered
+    
+    def _render_persona_entities(self, resolved: Dict[str, Any]) -> str:
+        """Рендерит найденные сущности для промпта персоны."""
+        # Сортируем, чтобы одни и те же сущности давали один и тот же текст промпта
+        people = sorted(resolved.get('people', []), key=lambda p: p.get('name', ''))
+        projects = sorted(resolved.get('projects', []), key=lambda p: p.get('key', ''))
+        
+        entity_parts = []
+        if people:
+            entity_parts.append("Люди:\n" + self.context_loader.render_people(people) + "\n\n")
+        if projects:
+            entity_parts.append("Проекты:\n" + self.context_loader.render_projects(projects) + "\n\n")
+        return "ИЗВЕСТНЫЕ СУЩНОСТИ ИЗ БАЗЫ ЗНАНИЙ:\n" + "".join(entity_parts) if entity_parts else ""
+    
+    def _render_meeting_entities(self, resolved: Dict[str, Any]) -> str:
+        """Рендерит найденные сущности и глоссарий для промпта анализа встречи."""
+        known_entities_parts = []
+        if resolved.get('people'):
+            known_entities_parts.append(
+                "Известные люди из команды:\n" + self.context_loader.render_people(resolved['people']) + "\n\n"
+            )
+        
+        if resolved.get('projects'):
+            known_entities_parts.append(
+                "Известные проекты:\n" + self.context_loader.render_projects(resolved['projects']) + "\n\n"
+            )
+        
+        # Добавляем глоссарий терминов (первые 20, чтобы не перегружать промпт)
+        if self.context_loader.glossary:
+            known_entities_parts.append(
+                "\n\nГлоссарий терминов (используй правильные термины из этого списка):\n"
+                + self.context_loader.get_glossary_head(20)
+            )
+        return "".join(known_entities_parts)
+    
+    @staticmethod
+    def _render_task_entities(resolved: Dict[str, Any]) -> str:
+        """Рендерит найденные сущности кратко, для промпта извлечения задачи."""
+        known_entities_parts = []
+        if resolved.get('people'):
+            people_list = []
+            for person in resolved['people']:
+                name = person.get('name', '')
+                username = person.get('telegram_username', '')
+                role = person.get('role', '')
+                
+                # Формируем краткое описание для задач
+                parts = [f"- {name}"]
+                if username:
+                    parts.append(f" (@{username})")
+                if role:
+                    parts.append(f" - {role}")
+                    
+                people_list.append("".join(parts))
+            known_entities_parts.append("Известные люди:\n" + "\n".join(people_list) + "\n\n")
+        
+        if resolved.get('projects'):
+            projects_list = []
+            for project in resolved['projects']:
+                key = project.get('key', '')
+                name = project.get('name', key)
+                description = project.get('description', '')
+                
+                # Формируем краткое описание для задач
+                parts = [f"- {name} ({key})"]
+                if description:
+                    parts.append(f": {description}")
+                    
+                projects_list.append("".join(parts))
+            known_entities_parts.append("Известные проекты:\n" + "\n".join(projects_list) + "\n\n")
+        return "".join(known_entities_parts)
+    
+    def _build_persona_prompt(self, user_input: str, context: str, max_length: int) -> str:
+        """
+        Собирает промпт персоны: неизменный префикс, затем контекст, сущности и сообщение.
+        
+        Args:
+            user_input: Входящее сообщение пользователя
+            context: Дополнительный контекст
+            max_length: Максимальная длина ответа
+            
+        Returns:
+            Промпт для Ollama
+        """
+        context_info = ""
+        if self.context_loader and context:
+            context_info = f"ДОСТУПНЫЙ КОНТЕКСТ:\n{context}\n\n"
+        
+        known_entities = self._build_known_entities(user_input)
+        
+        return PERSONA_PROMPT_TEMPLATE.format(
+            context_info=context_info,
+            known_entities=known_entities,
+            user_input=user_input,
+            max_length=max_length
+        )
+    
+    async def generate_persona_response_stream(
+        self,
+        user_input: str,
+        context: str = "",
+        max_length: int = 200
+    ) -> AsyncIterator[str]:
+        """
+        Стримит персонализированный ответ в стиле Neural Slav по мере генерации.
+        
+        Фрагменты проходят ту же чистку, что и generate_persona_response: начало
+        придерживается, пока в нем может быть технический префикс, а отдаются
+        только завершенные слова в пределах max_length. Полный ответ кешируется
+        после окончания стрима (тот же кеш, что и у generate_persona_response).
         
-        return random.choice(responses)
+        Args:
+            user_input: Входящее сообщение пользователя
+            context: Дополнительный контекст
+            max_length: Максимальная длина ответа
+            
+        Yields:
+            Фрагменты ответа (при сбое до первого фрагмента — fallback-ответ)
+        """
+        cache_params = {"user_input": user_input, "context": context}
+        scope = _content_key(context)
+        cached_response, embedding = await self._get_cached("persona_response", user_input, scope=scope, **cache_params)
+        if cached_response:
+            yield _fit_length(cached_response, max_length)
+            return
+        
+        raw = ""
+        sent = 0
+        complete = False
+        try:
+            prompt = self._build_persona_prompt(user_input, context, max_length)
+            stream = self._stream_text([{"role": "user", "content": prompt}], model=self.persona_model)
+            # Стрим держит слот до конца генерации, как и обычный ответ персоны
+            async with self.parallel_semaphore, aclosing(stream):
+                async for piece in stream:
+                    raw += piece
+                    if len(raw) < PERSONA_STREAM_HOLD_CHARS:
+                        continue
+                    text = _RESP_PREFIX_RE.sub("", raw, count=1).lstrip()
+                    # Ответ длиннее лимита: дальше все равно обрежется
+                    if len(text) > max_length:
+                        break
+                    ready = _complete_words(text)
+                    if len(ready) > sent:
+                        yield ready[sent:]
+                        sent = len(ready)
+                else:
+                    complete = True
+        except Exception as e:
+            error = handle_service_error(
+                ServiceType.OLLAMA,
+                e,
+                context={"user_input": user_input[:100], "operation": "generate_persona_response_stream"}
+            )
+            logger.error(f"Ошибка стриминга персона-ответа: {error.message}")
+        
+        result = _clean_persona_text(raw)
+        if not result:
+            logger.warning("Ollama вернул пустой ответ в generate_persona_response_stream")
+            yield self._get_fallback_response(user_input, context)
+            return
+        
+        tail = _fit_length(result, max_length)[sent:]
+        if tail:
+            yield tail
+        # Оборванный или прерванный ответ не кешируем: другой вызов может запросить больший max_length
+        if complete:
+            self.cache.cache_response("persona_response", result, embedding=embedding, scope=scope, **cache_params)
     
     async def generate_persona_response(
         self, 
@@ -817,154 +1745,59 @@ Summary:"""
         Returns:
             Ответ в стиле Neural Slav
         """
-        # Проверяем кеш
-        cached_response = self.cache.get_cached_response(
-            "persona_response",
-            user_input=user_input,
-            context=context,
-            max_length=max_length
-        )
+        # Проверяем кеш: точное совпадение или близкий по смыслу вопрос с тем же контекстом.
+        # max_length в ключ не входит: лимит в промпте мягкий, длинный ответ укорачиваем ниже
+        cache_params = {"user_input": user_input, "context": context}
+        scope = _content_key(context)
+        cached_response, embedding = await self._get_cached("persona_response", user_input, scope=scope, **cache_params)
         if cached_response:
-            return cached_response
+            return _fit_length(cached_response, max_length)
         
+        result = await _coalesce(
+            "persona:" + _content_key(f"{self.persona_model}\n{context}\n{user_input}"),
+            lambda: self._generate_persona_uncached(user_input, context, max_length, embedding, scope, cache_params)
+        )
+        return _fit_length(result, max_length)
+    
+    async def _generate_persona_uncached(
+        self,
+        user_input: str,
+        context: str,
+        max_length: int,
+        embedding: Optional[List[float]],
+        scope: str,
+        cache_params: Dict[str, Any]
+    ) -> str:
+        """Вызывает Ollama для ответа персоны и кеширует результат (без проверки кеша)."""
         try:
-            # Проверяем есть ли контекст
-            context_info = ""
-            if self.context_loader and context:
-                context_info = f"ДОСТУПНЫЙ КОНТЕКСТ:\n{context}\n\n"
-            
-            # Генерируем детальное описание известных сущностей
-            known_entities = ""
-            if self.context_loader:
-                people_context = []
-                projects_context = []
-                
-                # Находим упомянутых людей
-                found_people = self.context_loader.find_people_in_text(user_input)
-                for person in found_people:
-                    name = person.get('name', 'Неизвестный')
-                    role = person.get('role', '')
-                    context_desc = person.get('context', '')
-                    username = person.get('telegram_username', '')
-                    aliases = person.get('aliases', [])
-                    
-                    person_desc = f"- {name}"
-                    if username:
-                        person_desc += f" (@{username})"
-                    if role:
-                        person_desc += f" - {role}"
-                    if context_desc:
-                        person_desc += f": {context_desc}"
-                    if aliases:
-                        person_desc += f" (также известен как: {', '.join(aliases)})"
-                    
-                    people_context.append(person_desc)
-                
-                # Находим упомянутые проекты
-                found_projects = self.context_loader.find_projects_in_text(user_input)
-                for project in found_projects:
-                    name = project.get('name', 'Неизвестный проект')
-                    key = project.get('key', '')
-                    description = project.get('description', '')
-                    status = project.get('status', '')
-                    keywords = project.get('keywords', [])
-                    
-                    project_desc = f"- {name}"
-                    if key:
-                        project_desc += f" ({key})"
-                    if status:
-                        project_desc += f" [Статус: {status}]"
-                    if description:
-                        project_desc += f": {description}"
-                    if keywords:
-                        project_desc += f" (ключевые слова: {', '.join(keywords)})"
-                    
-                    projects_context.append(project_desc)
-                
-                if people_context or projects_context:
-                    known_entities = "ИЗВЕСТНЫЕ СУЩНОСТИ ИЗ БАЗЫ ЗНАНИЙ:\n"
-                    if people_context:
-                        known_entities += "Люди:\n" + "\n".join(people_context) + "\n\n"
-                    if projects_context:
-                        known_entities += "Проекты:\n" + "\n".join(projects_context) + "\n\n"
-            
-            prompt = f"""Ты - Neural Slav, персональный AI-ассистент со сложным характером.
-
-ТВОЯ ЛИЧНОСТЬ:
-- Токсичный уставший коллега 
-- Циничный, но полезный
-- Саркастичный, иногда пассивно-агрессивный
-- Кратко отвечаешь, без лишней воды
-- Иногда добавляешь юмор, но не переборщи
-- Говоришь на русском, иногда с жаргоном
-
-ПРАВИЛА ОБЩЕНИЯ:
-- Отвечай как живой человек, а не как AI
-- Будь максимально краток (до {max_length} символов)
-- Используй контекст из базы знаний если релевантно
-- Не добавляй технические префиксы или суффиксы
-- Отвечай только то, о чем спрашивают
-
-{context_info}{known_entities}ВХОДЯЩЕЕ СООБЩЕНИЕ: {user_input}
-
-ТВОЙ ОТВЕТ (кратко, по-человечески):"""
+            prompt = self._build_persona_prompt(user_input, context, max_length)
 
-            response = await self.client.chat(
-                model=self.model_name,
-                messages=[{"role": "user", "content": prompt}],
-                stream=False
-            )
-            
-            # Извлекаем текст ответа с улучшенной обработкой
-            response_text = ""
-            
-            # Детальное логирование для отладки
-            logger.debug(f"Ollama response type: {type(response)}, dir: {dir(response) if hasattr(response, '__dict__') else 'N/A'}")
-            
-            # 1. Проверяем как объект с атрибутом message
-            if hasattr(response, 'message'):
-                if hasattr(response.message, 'content'):
-                    response_text = response.message.content
-                elif isinstance(response.message, dict):
-                    response_text = response.message.get('content', '')
-                elif hasattr(response.message, 'get'):
-                    response_text = response.message.get('content', '')
-            
-            # 2. Проверяем как словарь
-            elif isinstance(response, dict):
-                response_text = response.get('message', {}).get('content', '') or response.get('response', '') or response.get('content', '')
-            
-            # 3. Проверяем прямой атрибут content
-            elif hasattr(response, 'content'):
-                response_text = response.content
+            async with self.parallel_semaphore:
+                response = await self.client.chat(
+                    model=self.persona_model,
+                    keep_alive=self.keep_alive,
+                    messages=[{"role": "user", "content": prompt}],
+                    stream=False
+                )
             
-            # 4. Проверяем другие возможные атрибуты
-            if not response_text:
-                for attr in ['text', 'response', 'output']:
-                    if hasattr(response, attr):
-                        value = getattr(response, attr)
-                        if value:
-                            response_text = str(value)
-                            break
+            # Извлекаем текст ответа
+            response_text = _extract_text(response)
             
             if response_text:
-                result = response_text.strip()
-                
                 # Убираем лишние технические элементы
-                result = result.replace("ТВОЙ ОТВЕТ:", "").strip()
-                result = result.replace("Ответ:", "").strip()
+                result = _clean_persona_text(response_text)
                 
                 if result:
                     # Кешируем ответ
                     self.cache.cache_response(
                         "persona_response",
                         result,
-                        user_input=user_input,
-                        context=context,
-                        max_length=max_length
+                        embedding=embedding,
+                        scope=scope,
+                        **cache_params
                     )
                     
-                    logger.debug(f"Persona ответ сгенерирован: {result[:100]}...")
+                    logger.opt(lazy=True).debug("Persona ответ сгенерирован: {}...", lambda: result[:100])
                     return result
             
             # Если пустой ответ, логируем детали и используем fallback
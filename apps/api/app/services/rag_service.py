@@ -11,12 +11,361 @@ except ImportError:
     chromadb = None
     ChromaSettings = None
 
+import asyncio
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+import numpy as np
 from loguru import logger
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Tuple
 from pathlib import Path
 from datetime import datetime
 
 from app.config import get_settings
+from app.core.batching import BatchScheduler
+from app.core.cache import get_ollama_cache
+
+
+# LRU эмбеддингов по хешу текста: общий для всех экземпляров RAGService.
+# Внутри LRU векторы хранятся как numpy EMBEDDING_DTYPE, наружу (в ChromaDB и поиск) отдаются float32
+EMBEDDING_CACHE_SIZE = 4096
+# float16 вдвое компактнее float32; для нормированных векторов MiniLM потеря точности косинуса ~1e-3.
+# Только для LRU: свежие эмбеддинги модели пишутся и ищутся в ChromaDB без округления
+EMBEDDING_DTYPE = np.float16
+_embedding_cache: "OrderedDict[str, np.ndarray]" = OrderedDict()
+# LRU читают и пишут потоки пула RAG и event loop: move_to_end/popitem не атомарны между собой
+_embedding_cache_lock = threading.Lock()
+
+# Размер батча при кодировании нескольких текстов
+EMBEDDING_BATCH_SIZE = 64
+
+# Сколько страниц Notion читается одновременно при индексации (лимит Notion API ~3 запроса/с)
+NOTION_FETCH_CONCURRENCY = 3
+
+# Одиночные add_* и эмбеддинги запросов за окно rag_batch_window_ms собираются в один батч: имя обработчика -> планировщик
+_batch_schedulers: Dict[str, BatchScheduler] = {}
+
+# Версии коллекций: растут при каждой записи, чтобы кеш поиска не отдавал устаревшие результаты
+_collection_versions: Dict[str, int] = {}
+
+# В какой коллекции лежит документ: ID -> имя коллекции (чтобы update_index не перебирал все коллекции)
+_doc_collections: Dict[str, str] = {}
+
+# Модель эмбеддингов и ChromaDB работают в своем пуле потоков: не делят default executor
+# с долгими блокирующими ожиданиями (whisper, process.wait) и не блокируют event loop
+RAG_EXECUTOR_WORKERS = min(8, os.cpu_count() or 1)
+_executor = ThreadPoolExecutor(max_workers=RAG_EXECUTOR_WORKERS, thread_name_prefix="rag")
+
+
+async def _run_blocking(func, *args, **kwargs):
+    """Выполняет блокирующий вызов (encode, запрос к ChromaDB) в пуле RAG."""
+    return await asyncio.get_running_loop().run_in_executor(_executor, partial(func, *args, **kwargs))
+
+
+async def _run_batch(method: str, entries: List[Tuple["RAGService", Any]]) -> Optional[List[Any]]:
+    """
+    Обработчик общих планировщиков батчей: вызывает пакетный метод RAGService.
+    
+    Экземпляры RAGService делят клиент ChromaDB, коллекции и модель, поэтому батч
+    обрабатывает экземпляр первого элемента, а планировщик ни к одному не привязан.
+    
+    Args:
+        method: Имя метода, принимающего список элементов
+        entries: Пары (экземпляр RAGService, элемент)
+        
+    Returns:
+        Результат пакетного метода
+    """
+    service = entries[0][0]
+    return await getattr(service, method)([item for _, item in entries])
+
+
+def _text_key(text: str) -> str:
+    """Ключ текста для кеша эмбеддингов."""
+    return hashlib.blake2b(text.encode(), digest_size=16).hexdigest()
+
+
+# Поля метаданных, меняющиеся при каждой записи: в хеш не входят, иначе повторная
+# индексация того же документа никогда не совпадет с сохраненным хешем
+VOLATILE_METADATA_KEYS = frozenset({"content_hash", "indexed_at", "updated_at"})
+
+
+def _content_hash(content: str, metadata: Optional[Dict[str, Any]]) -> str:
+    """Хеш документа: текст вместе с метаданными (кроме VOLATILE_METADATA_KEYS), чтобы смена метаданных тоже записывалась."""
+    fields = {key: value for key, value in (metadata or {}).items() if key not in VOLATILE_METADATA_KEYS}
+    return _text_key(content + "\n" + json.dumps(fields, sort_keys=True, ensure_ascii=False, default=str))
+
+
+def _cached_embedding(key: str) -> Optional[np.ndarray]:
+    """Эмбеддинг из LRU во float32 (помечается как недавно использованный) или None."""
+    with _embedding_cache_lock:
+        embedding = _embedding_cache.get(key)
+        if embedding is None:
+            return None
+        _embedding_cache.move_to_end(key)
+    return embedding.astype(np.float32)
+
+
+def _remember_embedding(key: str, embedding: np.ndarray) -> None:
+    """Кладет эмбеддинг в LRU (как EMBEDDING_DTYPE), вытесняя самый давний."""
+    embedding = embedding.astype(EMBEDDING_DTYPE)
+    with _embedding_cache_lock:
+        _embedding_cache[key] = embedding
+        _embedding_cache.move_to_end(key)
+        if len(_embedding_cache) > EMBEDDING_CACHE_SIZE:
+            _embedding_cache.popitem(last=False)
+
+
+def _bump_collection_version(collection) -> None:
+    """Инвалидирует кеш поиска по коллекции после записи."""
+    name = getattr(collection, "name", "")
+    _collection_versions[name] = _collection_versions.get(name, 0) + 1
+
+
+# Поля, которые читаются из результатов поиска (эмбеддинги обратно не нужны)
+QUERY_INCLUDE = ["documents", "metadatas", "distances"]
+
+
+def _query_hits(results: Dict[str, Any]) -> List[Tuple[str, Dict[str, Any], Optional[float]]]:
+    """
+    Раскладывает результат collection.query для одного запроса на тройки.
+    
+    Args:
+        results: Результат collection.query
+        
+    Returns:
+        Тройки (документ, метаданные или {}, расстояние или None)
+    """
+    docs = (results.get("documents") or [[]])[0] or []
+    metas = (results.get("metadatas") or [[]])[0] or [None] * len(docs)
+    dists = (results.get("distances") or [[]])[0] or [None] * len(docs)
+    return [(doc, meta or {}, dist) for doc, meta, dist in zip(docs, metas, dists)]
+
+
+# Снимки небольших коллекций для точного поиска в памяти: имя -> (версия коллекции, снимок или None)
+_collection_snapshots: Dict[str, Tuple[int, Optional[Dict[str, Any]]]] = {}
+
+
+def _collection_snapshot(collection, max_size: int) -> Optional[Dict[str, Any]]:
+    """
+    Матрица эмбеддингов, документы и метаданные коллекции, если в ней не больше max_size записей.
+    
+    Снимок перечитывается только после записи в коллекцию (по _collection_versions).
+    
+    Args:
+        collection: Коллекция ChromaDB
+        max_size: Максимальный размер коллекции для поиска в памяти
+        
+    Returns:
+        Снимок или None, если коллекция слишком большая
+    """
+    name = collection.name
+    version = _collection_versions.get(name, 0)
+    cached = _collection_snapshots.get(name)
+    if cached is not None and cached[0] == version:
+        return cached[1]
+    
+    snapshot = None
+    if collection.count() <= max_size:
+        data = collection.get(include=["embeddings", "documents", "metadatas"])
+        matrix = np.asarray(data.get("embeddings") or [], dtype=np.float32)
+        snapshot = {
+            "matrix": matrix,
+            "sq_norms": np.einsum("ij,ij->i", matrix, matrix) if len(matrix) else matrix,
+            "documents": data.get("documents") or [],
+            "metadatas": data.get("metadatas") or [],
+        }
+    _collection_snapshots[name] = (version, snapshot)
+    return snapshot
+
+
+def _brute_force_query(snapshot: Dict[str, Any], query_embedding: np.ndarray, limit: int) -> Dict[str, Any]:
+    """
+    Точный поиск ближайших по снимку коллекции (одно матричное умножение вместо HNSW).
+    
+    Расстояние — квадрат L2, как у коллекций ChromaDB по умолчанию, поэтому результат
+    совпадает по формату и значениям с collection.query.
+    
+    Args:
+        snapshot: Снимок из _collection_snapshot
+        query_embedding: Эмбеддинг запроса
+        limit: Количество результатов
+        
+    Returns:
+        Результат в формате collection.query
+    """
+    matrix = snapshot["matrix"]
+    k = min(limit, len(matrix))
+    if k == 0:
+        return {"documents": [[]], "metadatas": [[]], "distances": [[]]}
+    
+    query = np.asarray(query_embedding, dtype=np.float32)
+    distances = np.maximum(snapshot["sq_norms"] - 2 * (matrix @ query) + query @ query, 0.0)
+    top = np.argpartition(distances, k - 1)[:k]
+    top = top[np.argsort(distances[top], kind="stable")]
+    return {
+        "documents": [[snapshot["documents"][i] for i in top]],
+        "metadatas": [[snapshot["metadatas"][i] for i in top]],
+        "distances": [distances[top].tolist()],
+    }
+
+
+def _create_chroma_client(settings):
+    """
+    Клиент ChromaDB по настройкам.
+    
+    persistent — индекс в процессе API (по умолчанию); http — отдельный сервер Chroma,
+    поиск не конкурирует за GIL с обработкой запросов.
+    """
+    chroma_settings = ChromaSettings(anonymized_telemetry=False)
+    if settings.chroma_mode == "http":
+        return chromadb.HttpClient(
+            host=settings.chroma_host,
+            port=str(settings.chroma_port),
+            settings=chroma_settings
+        )
+    
+    persist_dir = Path(settings.chroma_persist_dir)
+    persist_dir.mkdir(parents=True, exist_ok=True)
+    return chromadb.PersistentClient(path=str(persist_dir), settings=chroma_settings)
+
+
+class _OnnxEmbedder:
+    """
+    all-MiniLM-L6-v2, экспортированная в ONNX (обычно int8), через onnxruntime.
+    
+    Повторяет пайплайн SentenceTransformer (mean pooling + L2-нормализация),
+    поэтому векторы совместимы с уже проиндексированными.
+    """
+    
+    def __init__(self, model_dir: str, threads: int = 0):
+        import onnxruntime
+        from transformers import AutoTokenizer
+        
+        model_path = Path(model_dir)
+        onnx_files = sorted(model_path.glob("*.onnx"))
+        if not onnx_files:
+            raise FileNotFoundError(f"В {model_dir} нет .onnx модели")
+        
+        options = onnxruntime.SessionOptions()
+        if threads:
+            options.intra_op_num_threads = threads
+        self.session = onnxruntime.InferenceSession(
+            str(onnx_files[0]), options, providers=["CPUExecutionProvider"]
+        )
+        self.input_names = {i.name for i in self.session.get_inputs()}
+        self.tokenizer = AutoTokenizer.from_pretrained(model_dir)
+    
+    def _encode_batch(self, texts: List[str]) -> np.ndarray:
+        """Эмбеддинги одного батча."""
+        tokens = self.tokenizer(texts, padding=True, truncation=True, max_length=256, return_tensors="np")
+        feeds = {name: value.astype(np.int64) for name, value in tokens.items() if name in self.input_names}
+        hidden = self.session.run(None, feeds)[0]
+        mask = tokens["attention_mask"][..., None].astype(np.float32)
+        pooled = (hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+        return pooled / np.clip(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12, None)
+    
+    def encode(self, texts, batch_size: int = EMBEDDING_BATCH_SIZE, **kwargs) -> np.ndarray:
+        """
+        Интерфейс SentenceTransformer.encode: строка -> вектор, список -> матрица.
+        
+        Как и SentenceTransformer, кодирует тексты батчами близкой длины (сортировка по
+        длине), чтобы короткие тексты не добивались паддингом до самого длинного в списке.
+        """
+        if isinstance(texts, str):
+            return self._encode_batch([texts])[0]
+        order = np.argsort([len(text) for text in texts], kind="stable")
+        ordered = [texts[i] for i in order]
+        vectors = np.concatenate([
+            self._encode_batch(ordered[i:i + batch_size]) for i in range(0, len(ordered), batch_size)
+        ])
+        return vectors[np.argsort(order)]
+
+
+# Модель эмбеддингов и клиент ChromaDB создаются один раз на процесс (RAGService создается на каждый запрос)
+_embedding_model = None
+_embedding_model_loaded = False
+_embedding_model_lock = threading.Lock()
+_chroma_client = None
+_chroma_client_lock = threading.Lock()
+
+
+def get_embedding_model():
+    """
+    Получает общую модель эмбеддингов (загружается лениво).
+    
+    ONNX-модель из rag_onnx_model_dir, если задана, иначе SentenceTransformer.
+    
+    Returns:
+        Объект с методом encode или None, если модель недоступна
+    """
+    global _embedding_model, _embedding_model_loaded
+    if _embedding_model_loaded:
+        return _embedding_model
+    
+    # Загрузка может начаться одновременно из нескольких потоков (пул RAG, прогрев при старте)
+    with _embedding_model_lock:
+        if not _embedding_model_loaded:
+            _load_embedding_model()
+            _embedding_model_loaded = True
+    return _embedding_model
+
+
+def _load_embedding_model() -> None:
+    """Загружает модель эмбеддингов (вызывается под блокировкой)."""
+    global _embedding_model
+    settings = get_settings()
+    if settings.rag_onnx_model_dir:
+        try:
+            _embedding_model = _OnnxEmbedder(settings.rag_onnx_model_dir, settings.rag_onnx_threads)
+            logger.info(f"Модель эмбеддингов ONNX загружена из {settings.rag_onnx_model_dir}")
+        except Exception as e:
+            logger.warning(f"⚠️ Не удалось загрузить ONNX модель эмбеддингов, используем sentence-transformers: {e}")
+    
+    if _embedding_model is None:
+        try:
+            from sentence_transformers import SentenceTransformer
+            logger.info("Загрузка модели sentence-transformers...")
+            _embedding_model = SentenceTransformer('all-MiniLM-L6-v2')
+            if settings.rag_torch_threads:
+                import torch
+                torch.set_num_threads(settings.rag_torch_threads)
+            logger.info("Модель загружена")
+        except ImportError:
+            logger.warning("⚠️ sentence-transformers не установлен. RAG функции будут работать без эмбеддингов.")
+
+
+def warmup_embedding_model() -> bool:
+    """
+    Загружает модель эмбеддингов и прогоняет пробный текст (вызывается при старте приложения).
+    
+    Returns:
+        True, если модель доступна
+    """
+    try:
+        model = get_embedding_model()
+        if model is None:
+            return False
+        model.encode(["warmup"], batch_size=1, show_progress_bar=False)
+        logger.info("Модель эмбеддингов прогрета")
+        return True
+    except Exception as e:
+        logger.warning(f"⚠️ Не удалось прогреть модель эмбеддингов: {e}")
+        return False
+
+
+def get_chroma_client():
+    """Получает общий клиент ChromaDB (создается лениво)."""
+    global _chroma_client
+    if _chroma_client is None:
+        with _chroma_client_lock:
+            if _chroma_client is None:
+                _chroma_client = _create_chroma_client(get_settings())
+    return _chroma_client
 
 
 class RAGService:
@@ -26,6 +375,12 @@ class RAGService:
         from app.config import get_settings
         settings = get_settings()
         
+        self.cache = get_ollama_cache()
+        self.cache_sim_threshold = settings.rag_cache_sim_threshold
+        # Небольшие коллекции ищутся точным перебором в памяти; в http-режиме коллекцию
+        # могут менять другие процессы, поэтому снимкам не доверяем
+        self.brute_force_max = settings.rag_brute_force_max if settings.chroma_mode != "http" else 0
+        
         if not CHROMADB_AVAILABLE:
             logger.warning("⚠️ ChromaDB недоступен (не установлен). RAG функции будут отключены.")
             self.client = None
@@ -36,47 +391,247 @@ class RAGService:
             return
         
         # Инициализация ChromaDB
-        persist_dir = Path(settings.chroma_persist_dir)
-        persist_dir.mkdir(parents=True, exist_ok=True)
+        self.client = get_chroma_client()
         
-        self.client = chromadb.PersistentClient(
-            path=str(persist_dir),
-            settings=ChromaSettings(anonymized_telemetry=False)
-        )
+        # Параметры HNSW: M и construction_ef действуют при построении индекса, search_ef — при поиске
+        hnsw = {
+            "hnsw:M": settings.chroma_hnsw_m,
+            "hnsw:construction_ef": settings.chroma_hnsw_construction_ef,
+            "hnsw:search_ef": settings.chroma_hnsw_search_ef
+        }
         
         # Коллекция для встреч
         self.meetings_collection = self.client.get_or_create_collection(
             name="meetings",
-            metadata={"description": "Одобренные анализы встреч"}
+            metadata={"description": "Одобренные анализы встреч", **hnsw}
         )
         
         # Коллекция для знаний из сообщений
         self.knowledge_collection = self.client.get_or_create_collection(
             name="knowledge",
-            metadata={"description": "Знания из входящих сообщений"}
+            metadata={"description": "Знания из входящих сообщений", **hnsw}
         )
         
         # Коллекция для задач
         self.tasks_collection = self.client.get_or_create_collection(
             name="tasks",
-            metadata={"description": "Задачи и напоминания"}
+            metadata={"description": "Задачи и напоминания", **hnsw}
         )
         
-        # Загрузка модели для эмбеддингов
-        try:
-            from sentence_transformers import SentenceTransformer
-            logger.info("Загрузка модели sentence-transformers...")
-            self.embedding_model = SentenceTransformer('all-MiniLM-L6-v2')
-            logger.info("Модель загружена")
-        except ImportError:
-            logger.warning("⚠️ sentence-transformers не установлен. RAG функции будут работать без эмбеддингов.")
-            self.embedding_model = None
+        # Модель для эмбеддингов (общая для процесса)
+        self.embedding_model = get_embedding_model()
     
-    def _get_embedding(self, text: str) -> List[float]:
-        """Получить эмбеддинг текста."""
+    def _get_embedding(self, text: str) -> np.ndarray:
+        """Получить эмбеддинг текста (повторные тексты берутся из LRU)."""
         if not self.embedding_model:
             raise ValueError("Embedding model не доступен. Установите sentence-transformers.")
-        return self.embedding_model.encode(text).tolist()
+        key = _text_key(text)
+        embedding = _cached_embedding(key)
+        if embedding is not None:
+            return embedding
+        
+        embedding = np.asarray(self.embedding_model.encode(text, normalize_embeddings=True), dtype=np.float32)
+        _remember_embedding(key, embedding)
+        return embedding
+    
+    def _get_embeddings(self, texts: List[str]) -> np.ndarray:
+        """
+        Эмбеддинги нескольких текстов: закешированные из LRU, остальные одним батчем.
+        
+        Args:
+            texts: Тексты
+            
+        Returns:
+            Матрица эмбеддингов (float32), строки в том же порядке, что и texts
+        """
+        if not self.embedding_model:
+            raise ValueError("Embedding model не доступен. Установите sentence-transformers.")
+        keys = [_text_key(text) for text in texts]
+        found = {}
+        for key in keys:
+            embedding = _cached_embedding(key)
+            if embedding is not None:
+                found[key] = embedding
+        missing = {key: text for key, text in zip(keys, texts) if key not in found}
+        
+        if missing:
+            vectors = self.embedding_model.encode(
+                list(missing.values()),
+                batch_size=EMBEDDING_BATCH_SIZE,
+                show_progress_bar=False,
+                convert_to_numpy=True,
+                normalize_embeddings=True
+            )
+            for key, vector in zip(missing, np.asarray(vectors, dtype=np.float32)):
+                found[key] = vector
+                _remember_embedding(key, vector)
+        
+        return np.stack([found[key] for key in keys])
+    
+    async def _add_batch(
+        self,
+        collection,
+        id_field: str,
+        items: List[Tuple[str, str, Optional[Dict[str, Any]]]]
+    ) -> None:
+        """
+        Записывает документы в коллекцию одним upsert (эмбеддинги считаются батчем вне event loop).
+        
+        Повторы ID внутри батча схлопываются (побеждает последний), а документы, чей
+        content_hash (текст и метаданные) в коллекции совпадает с новым, пропускаются
+        без перекодирования.
+        
+        Args:
+            collection: Коллекция ChromaDB
+            id_field: Поле метаданных, в которое пишется ID документа
+            items: Тройки (ID, текст, метаданные)
+        """
+        unique = {item_id: (content, metadata) for item_id, content, metadata in items}
+        existing = await _run_blocking(collection.get, ids=list(unique), include=["metadatas"])
+        stored = {
+            item_id: (metadata or {}).get("content_hash")
+            for item_id, metadata in zip(existing.get("ids") or [], existing.get("metadatas") or [])
+        }
+        
+        ids, contents, metadatas = [], [], []
+        for item_id, (content, metadata) in unique.items():
+            content_hash = _content_hash(content, metadata)
+            if stored.get(item_id) == content_hash:
+                _doc_collections[item_id] = collection.name
+                continue
+            ids.append(item_id)
+            contents.append(content)
+            metadatas.append({**(metadata or {}), id_field: item_id, "content_hash": content_hash})
+        
+        if not ids:
+            logger.debug(f"Все {len(unique)} документов уже проиндексированы без изменений")
+            return
+        
+        embeddings = await _run_blocking(self._get_embeddings, contents)
+        
+        await _run_blocking(
+            collection.upsert,
+            ids=ids,
+            embeddings=embeddings,
+            documents=contents,
+            metadatas=metadatas
+        )
+        # Версия растет после записи: поиск, начатый до нее, кешируется под старой версией
+        _bump_collection_version(collection)
+        _doc_collections.update(dict.fromkeys(ids, collection.name))
+    
+    async def _cached_query(self, collection, query: str, limit: int) -> Dict[str, Any]:
+        """
+        Поиск в коллекции с кешем: точный повтор запроса или близкий по смыслу.
+        
+        Эмбеддинг (в общем батче с одновременными запросами) и запрос к ChromaDB
+        выполняются вне event loop.
+        
+        Args:
+            collection: Коллекция ChromaDB
+            query: Текст запроса
+            limit: Количество результатов
+            
+        Returns:
+            Результат collection.query
+        """
+        name = getattr(collection, "name", "")
+        scope = f"{name}:{limit}:{_collection_versions.get(name, 0)}"
+        
+        # Точный повтор не требует даже эмбеддинга
+        results = self.cache.get_cached_response("rag_search", user_input=query, context=scope)
+        if results is not None:
+            return results
+        
+        query_embedding = await self.embed_query(query)
+        results = self.cache.get_similar_response(
+            "rag_search", query_embedding, threshold=self.cache_sim_threshold, scope=scope
+        )
+        if results is not None:
+            return results
+        
+        results = await _run_blocking(self._query_collection, collection, query_embedding, limit)
+        self.cache.cache_response(
+            "rag_search", results, user_input=query, context=scope, embedding=query_embedding, scope=scope
+        )
+        return results
+    
+    def _query_collection(self, collection, query_embedding: np.ndarray, limit: int) -> Dict[str, Any]:
+        """
+        Поиск ближайших: перебором по снимку для небольшой коллекции, иначе через HNSW ChromaDB.
+        
+        Args:
+            collection: Коллекция ChromaDB
+            query_embedding: Эмбеддинг запроса
+            limit: Количество результатов
+            
+        Returns:
+            Результат в формате collection.query
+        """
+        if self.brute_force_max:
+            snapshot = _collection_snapshot(collection, self.brute_force_max)
+            if snapshot is not None:
+                return _brute_force_query(snapshot, query_embedding, limit)
+        return collection.query(
+            query_embeddings=query_embedding[None, :],
+            n_results=limit,
+            include=QUERY_INCLUDE
+        )
+    
+    async def _submit_add(self, method: str, item: Tuple[str, str, Optional[Dict[str, Any]]]) -> None:
+        """
+        Ставит документ в общий батч добавления: одновременные add_* кодируются
+        одним вызовом модели и пишутся одним collection.upsert.
+        
+        Args:
+            method: Имя пакетного метода (add_meetings_batch и т.п.)
+            item: Тройка (ID, текст, метаданные)
+        """
+        await self._batch_scheduler(method).submit((self, item))
+    
+    @staticmethod
+    def _batch_scheduler(method: str) -> BatchScheduler:
+        """
+        Общий для процесса планировщик батчей для пакетного метода RAGService.
+        
+        Args:
+            method: Имя метода, принимающего список элементов
+            
+        Returns:
+            Планировщик текущего event loop
+        """
+        scheduler = _batch_schedulers.get(method)
+        if scheduler is None or scheduler.loop is not asyncio.get_running_loop():
+            settings = get_settings()
+            scheduler = BatchScheduler(
+                partial(_run_batch, method),
+                max_batch=settings.rag_max_batch,
+                max_delay=settings.rag_batch_window_ms / 1000,
+                # Поиск интерактивный: одиночный запрос не ждет окно батча
+                flush_when_idle=method == "_embed_queries"
+            )
+            _batch_schedulers[method] = scheduler
+        return scheduler
+    
+    async def _embed_queries(self, queries: List[str]) -> List[np.ndarray]:
+        """Эмбеддинги батча поисковых запросов одним вызовом модели (вне event loop)."""
+        return list(await _run_blocking(self._get_embeddings, queries))
+    
+    async def embed_query(self, query: str) -> np.ndarray:
+        """
+        Эмбеддинг поискового запроса: из LRU сразу, иначе в общем батче с
+        одновременными запросами других корутин.
+        
+        Args:
+            query: Текст запроса
+            
+        Returns:
+            Эмбеддинг (float32)
+        """
+        embedding = _cached_embedding(_text_key(query))
+        if embedding is not None:
+            return embedding
+        return await self._batch_scheduler("_embed_queries").submit((self, query))
     
     async def add_meeting(self, meeting_id: str, content: str, metadata: Optional[Dict[str, Any]] = None) -> None:
         """
@@ -87,23 +642,28 @@ class RAGService:
             content: Текст встречи
             metadata: Дополнительные метаданные
         """
+        await self._submit_add("add_meetings_batch", (meeting_id, content, metadata))
+    
+    async def add_meetings_batch(self, items: List[Tuple[str, str, Optional[Dict[str, Any]]]]) -> None:
+        """
+        Добавляет несколько встреч в векторную БД одним батчем.
+        
+        Args:
+            items: Тройки (meeting_id, текст, метаданные)
+        """
         if not self.meetings_collection:
             logger.warning("⚠️ ChromaDB недоступен. Встреча не добавлена в RAG.")
             return
+        if not items:
+            return
         
         try:
-            embedding = self._get_embedding(content)
-            metadata = metadata or {}
-            metadata["meeting_id"] = meeting_id
+            await self._add_batch(self.meetings_collection, "meeting_id", items)
             
-            self.meetings_collection.add(
-                ids=[meeting_id],
-                embeddings=[embedding],
-                documents=[content],
-                metadatas=[metadata]
-            )
-            
-            logger.info(f"Встреча {meeting_id} добавлена в RAG")
+            if len(items) == 1:
+                logger.info(f"Встреча {items[0][0]} добавлена в RAG")
+            else:
+                logger.info(f"Добавлено встреч в RAG: {len(items)}")
         except Exception as e:
             logger.error(f"Ошибка при добавлении встречи в RAG: {e}")
             raise
@@ -124,21 +684,12 @@ class RAGService:
             return []
         
         try:
-            query_embedding = self._get_embedding(query)
-            
-            results = self.meetings_collection.query(
-                query_embeddings=[query_embedding],
-                n_results=limit
-            )
+            results = await self._cached_query(self.meetings_collection, query, limit)
             
-            similar_meetings = []
-            if results.get("documents") and results["documents"][0]:
-                for i, doc in enumerate(results["documents"][0]):
-                    similar_meetings.append({
-                        "content": doc,
-                        "metadata": results.get("metadatas", [[]])[0][i] if results.get("metadatas") else {},
-                        "distance": results.get("distances", [[]])[0][i] if results.get("distances") else None
-                    })
+            similar_meetings = [
+                {"content": doc, "metadata": metadata, "distance": distance}
+                for doc, metadata, distance in _query_hits(results)
+            ]
             
             logger.info(f"Найдено {len(similar_meetings)} похожих встреч")
             return similar_meetings
@@ -155,23 +706,28 @@ class RAGService:
             content: Текст документа
             metadata: Дополнительные метаданные
         """
+        await self._submit_add("add_knowledge_batch", (doc_id, content, metadata))
+    
+    async def add_knowledge_batch(self, items: List[Tuple[str, str, Optional[Dict[str, Any]]]]) -> None:
+        """
+        Добавляет несколько документов в базу знаний одним батчем.
+        
+        Args:
+            items: Тройки (doc_id, текст, метаданные)
+        """
         if not self.knowledge_collection:
             logger.warning("⚠️ ChromaDB недоступен. Документ не добавлен в базу знаний.")
             return
+        if not items:
+            return
         
         try:
-            embedding = self._get_embedding(content)
-            metadata = metadata or {}
-            metadata["doc_id"] = doc_id
-            
-            self.knowledge_collection.add(
-                ids=[doc_id],
-                embeddings=[embedding],
-                documents=[content],
-                metadatas=[metadata]
-            )
+            await self._add_batch(self.knowledge_collection, "doc_id", items)
             
-            logger.info(f"Документ {doc_id} добавлен в базу знаний")
+            if len(items) == 1:
+                logger.info(f"Документ {items[0][0]} добавлен в базу знаний")
+            else:
+                logger.info(f"Добавлено документов в базу знаний: {len(items)}")
         except Exception as e:
             logger.error(f"Ошибка при добавлении документа в базу знаний: {e}")
             raise
@@ -195,21 +751,13 @@ class RAGService:
             return []
         
         try:
-            query_embedding = self._get_embedding(query)
+            results = await self._cached_query(self.knowledge_collection, query, limit)
             
-            results = self.knowledge_collection.query(
-                query_embeddings=[query_embedding],
-                n_results=limit
-            )
-            
-            knowledge_items = []
-            if results.get("documents") and results["documents"][0]:
-                for i, doc in enumerate(results["documents"][0]):
-                    knowledge_items.append({
-                        "content": doc,
-                        "metadata": results.get("metadatas", [[]])[0][i] if results.get("metadatas") else {},
-                        "score": 1 - (results.get("distances", [[]])[0][i] if results.get("distances") else 1.0)
-                    })
+            # Эмбеддинги нормированы, поэтому квадрат L2 = 2 - 2·cos: score — косинусное сходство
+            knowledge_items = [
+                {"content": doc, "metadata": metadata, "score": 1 - distance / 2 if distance is not None else 0.0}
+                for doc, metadata, distance in _query_hits(results)
+            ]
             
             logger.info(f"Найдено {len(knowledge_items)} релевантных документов")
             return knowledge_items
@@ -226,23 +774,28 @@ class RAGService:
             content: Текст задачи
             metadata: Дополнительные метаданные
         """
+        await self._submit_add("add_tasks_batch", (task_id, content, metadata))
+    
+    async def add_tasks_batch(self, items: List[Tuple[str, str, Optional[Dict[str, Any]]]]) -> None:
+        """
+        Добавляет несколько задач в векторную БД одним батчем.
+        
+        Args:
+            items: Тройки (task_id, текст, метаданные)
+        """
         if not self.tasks_collection:
             logger.warning("⚠️ ChromaDB недоступен. Задача не добавлена в RAG.")
             return
+        if not items:
+            return
         
         try:
-            embedding = self._get_embedding(content)
-            metadata = metadata or {}
-            metadata["task_id"] = task_id
+            await self._add_batch(self.tasks_collection, "task_id", items)
             
-            self.tasks_collection.add(
-                ids=[task_id],
-                embeddings=[embedding],
-                documents=[content],
-                metadatas=[metadata]
-            )
-            
-            logger.info(f"Задача {task_id} добавлена в RAG")
+            if len(items) == 1:
+                logger.info(f"Задача {items[0][0]} добавлена в RAG")
+            else:
+                logger.info(f"Добавлено задач в RAG: {len(items)}")
         except Exception as e:
             logger.error(f"Ошибка при добавлении задачи в RAG: {e}")
             raise
@@ -263,21 +816,12 @@ class RAGService:
             return []
         
         try:
-            query_embedding = self._get_embedding(query)
-            
-            results = self.tasks_collection.query(
-                query_embeddings=[query_embedding],
-                n_results=limit
-            )
+            results = await self._cached_query(self.tasks_collection, query, limit)
             
-            similar_tasks = []
-            if results.get("documents") and results["documents"][0]:
-                for i, doc in enumerate(results["documents"][0]):
-                    similar_tasks.append({
-                        "content": doc,
-                        "metadata": results.get("metadatas", [[]])[0][i] if results.get("metadatas") else {},
-                        "distance": results.get("distances", [[]])[0][i] if results.get("distances") else None
-                    })
+            similar_tasks = [
+                {"content": doc, "metadata": metadata, "distance": distance}
+                for doc, metadata, distance in _query_hits(results)
+            ]
             
             logger.info(f"Найдено {len(similar_tasks)} похожих задач")
             return similar_tasks
@@ -302,10 +846,20 @@ class RAGService:
             "skipped": []
         }
         
-        for page_id in page_ids:
+        # Страницы читаются параллельно (не больше NOTION_FETCH_CONCURRENCY запросов), а индексируются одним батчем
+        semaphore = asyncio.Semaphore(NOTION_FETCH_CONCURRENCY)
+        
+        async def fetch(page_id: str) -> Optional[str]:
+            async with semaphore:
+                return await notion_service.get_page_content(page_id, include_metadata=True)
+        
+        contents = await asyncio.gather(*(fetch(page_id) for page_id in page_ids), return_exceptions=True)
+        
+        items = []
+        for page_id, content in zip(page_ids, contents):
             try:
-                # Получаем контент страницы
-                content = await notion_service.get_page_content(page_id, include_metadata=True)
+                if isinstance(content, Exception):
+                    raise content
                 
                 if not content or len(content.strip()) < 50:
                     results["skipped"].append({
@@ -314,25 +868,15 @@ class RAGService:
                     })
                     continue
                 
-                # Индексируем в базу знаний
-                doc_id = f"notion-page-{page_id}"
-                await self.add_knowledge(
-                    doc_id=doc_id,
-                    content=content,
-                    metadata={
+                items.append((
+                    f"notion-page-{page_id}",
+                    content,
+                    {
                         "source": "notion",
                         "page_id": page_id,
                         "indexed_at": datetime.now().isoformat()
                     }
-                )
-                
-                results["indexed"].append({
-                    "page_id": page_id,
-                    "doc_id": doc_id,
-                    "content_length": len(content)
-                })
-                
-                logger.info(f"Страница {page_id} проиндексирована в базу знаний")
+                ))
                 
             except Exception as e:
                 logger.error(f"Ошибка при индексации страницы {page_id}: {e}")
@@ -341,6 +885,32 @@ class RAGService:
                     "error": str(e)
                 })
         
+        if not items:
+            return results
+        
+        # Индексируем в базу знаний одним батчем; если он не прошел — по одной странице,
+        # чтобы одна проблемная страница не лишала индекса остальные
+        try:
+            await self.add_knowledge_batch(items)
+            indexed = items
+        except Exception as e:
+            logger.warning(f"Батч индексации не прошел, индексируем страницы по одной: {e}")
+            indexed = []
+            for item in items:
+                try:
+                    await self.add_knowledge_batch([item])
+                    indexed.append(item)
+                except Exception as item_error:
+                    results["failed"].append({"page_id": item[2]["page_id"], "error": str(item_error)})
+        
+        for doc_id, content, metadata in indexed:
+            results["indexed"].append({
+                "page_id": metadata["page_id"],
+                "doc_id": doc_id,
+                "content_length": len(content)
+            })
+        logger.info(f"Проиндексировано страниц в базу знаний: {len(indexed)}")
+        
         return results
     
     async def update_index(self, doc_id: str, content: str, metadata: Optional[Dict[str, Any]] = None) -> None:
@@ -353,21 +923,9 @@ class RAGService:
             metadata: Новые метаданные
         """
         try:
-            # Удаляем старый индекс
-            try:
-                # Пробуем удалить из всех коллекций
-                for collection in [self.meetings_collection, self.knowledge_collection, self.tasks_collection]:
-                    try:
-                        collection.delete(ids=[doc_id])
-                    except:
-                        pass
-            except:
-                pass
-            
-            # Добавляем обновленный контент
-            embedding = self._get_embedding(content)
             metadata = metadata or {}
             metadata["updated_at"] = datetime.now().isoformat()
+            metadata["content_hash"] = _content_hash(content, metadata)
             
             # Определяем коллекцию по метаданным или используем knowledge по умолчанию
             collection = self.knowledge_collection
@@ -376,12 +934,26 @@ class RAGService:
             elif metadata.get("type") == "task":
                 collection = self.tasks_collection
             
-            collection.add(
+            # Документ сменил коллекцию — удаляем старую копию. Владелец неизвестен
+            # (например, после рестарта) — удаляем из остальных коллекций
+            owner = _doc_collections.get(doc_id)
+            for other in (self.meetings_collection, self.knowledge_collection, self.tasks_collection):
+                if other is collection or (owner is not None and other.name != owner):
+                    continue
+                await _run_blocking(other.delete, ids=[doc_id])
+                _bump_collection_version(other)
+            
+            embedding = await _run_blocking(self._get_embedding, content)
+            
+            await _run_blocking(
+                collection.upsert,
                 ids=[doc_id],
-                embeddings=[embedding],
+                embeddings=embedding[None, :],
                 documents=[content],
                 metadatas=[metadata]
             )
+            _bump_collection_version(collection)
+            _doc_collections[doc_id] = collection.name
             
             logger.info(f"Индекс {doc_id} обновлен")
             
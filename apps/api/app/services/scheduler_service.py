@@ -2,14 +2,57 @@
 Сервис для планирования и отложенных действий.
 """
 import asyncio
-from datetime import datetime, timedelta
-from typing import Dict, Any, Optional, Callable, List
+import heapq
+import itertools
+import time
+from datetime import date, datetime, time as dt_time, timedelta
+from enum import Enum
+from uuid import UUID
+from typing import Dict, Any, Optional, Callable, List, Tuple
 from loguru import logger
 from pathlib import Path
 import json
+import sqlite3
+
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
+    orjson = None
 
 from app.config import get_settings
 
+# Дольше цикл не спит: монотонные часы стоят, пока ноутбук в сне, поэтому сроки периодически сверяются с системными
+SCHEDULER_MAX_SLEEP = 60.0
+
+# Расхождение системных и монотонных часов (сон, перевод часов), после которого сроки пересчитываются
+SCHEDULER_RESYNC_THRESHOLD = 5.0
+
+
+def _json_default(value: Any) -> Any:
+    """Типы вне JSON: даты и время — строкой isoformat (как есть, без приписывания пояса), UUID — строкой, Enum — значением."""
+    if isinstance(value, (date, dt_time)):
+        return value.isoformat()
+    if isinstance(value, UUID):
+        return str(value)
+    if isinstance(value, Enum):
+        return value.value
+    raise TypeError(f"Тип {type(value).__name__} не сериализуется в JSON")
+
+
+def _dump_args(action_args: Dict[str, Any]) -> str:
+    """
+    Сериализует аргументы задачи для хранилища (orjson, если установлен).
+    
+    Оба пути принимают одни и те же типы и дают одинаковую строку: даты отдаются
+    в _json_default, а json пишет компактно, как orjson.
+    """
+    if ORJSON_AVAILABLE:
+        option = orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS
+        return orjson.dumps(action_args, default=_json_default, option=option).decode("utf-8")
+    return json.dumps(action_args, ensure_ascii=False, separators=(",", ":"), default=_json_default)
+
 
 class ScheduledTask:
     """Задача для планировщика."""
@@ -23,23 +66,35 @@ class ScheduledTask:
         repeat_interval: Optional[timedelta] = None
     ):
         self.task_id = task_id
-        self.execute_at = execute_at
+        self.execute_at = execute_at  # Время выполнения по системным часам — источник истины
         self.action = action
         self.action_args = action_args
         self.repeat_interval = repeat_interval
         self.last_executed: Optional[datetime] = None
+        self.sync_deadline()
+    
+    def sync_deadline(self):
+        """Пересчитывает срок по монотонным часам (им ограничивается сон цикла) из execute_at."""
+        self.deadline = time.monotonic() + (self.execute_at - datetime.now()).total_seconds()
     
     def should_execute(self) -> bool:
         """Проверяет, нужно ли выполнить задачу."""
-        return datetime.now() >= self.execute_at
+        return time.monotonic() >= self.deadline
     
     def get_next_execution_time(self) -> Optional[datetime]:
-        """Возвращает время следующего выполнения (если задача повторяющаяся)."""
-        if self.repeat_interval:
-            if self.last_executed:
-                return self.last_executed + self.repeat_interval
-            return self.execute_at + self.repeat_interval
-        return None
+        """
+        Возвращает время следующего выполнения (если задача повторяющаяся).
+        
+        Отсчитывается от запланированного времени, а не от фактического запуска, поэтому
+        опоздания не накапливаются; пропущенные (например, во сне) запуски не догоняются.
+        """
+        if not self.repeat_interval:
+            return None
+        next_time = self.execute_at + self.repeat_interval
+        now = datetime.now()
+        if next_time <= now:
+            next_time += self.repeat_interval * ((now - next_time) // self.repeat_interval + 1)
+        return next_time
 
 
 class SchedulerService:
@@ -50,44 +105,64 @@ class SchedulerService:
         self.tasks: Dict[str, ScheduledTask] = {}
         self.running = False
         self.task: Optional[asyncio.Task] = None
-        self.check_interval = 60  # Проверка каждую минуту
-        self.storage_path = Path("/tmp/scheduled_tasks.json")
+        self.check_interval = 60  # Пауза после ошибки в цикле
+        # Очередь (deadline, порядковый номер, task_id): цикл спит до ближайшего срока.
+        # Отмененные и перенесенные задачи не удаляются из кучи, а пропускаются при извлечении
+        self._heap: List[Tuple[float, int, str]] = []
+        self._counter = itertools.count()
+        self._wakeup = asyncio.Event()  # Будит цикл, когда появилась задача раньше текущего сна
+        # Последняя сверка монотонных и системных часов
+        self._clock_ref = (time.monotonic(), datetime.now())
+        # Повторяющиеся задачи хранятся в SQLite: каждое изменение — одна строка, а не перезапись всего списка
+        self.storage_path = Path("/tmp/scheduled_tasks.db")
+        self._conn: Optional[sqlite3.Connection] = None
         self._load_tasks()
     
+    def _db(self) -> sqlite3.Connection:
+        """Соединение с хранилищем задач (открывается при первом обращении)."""
+        if self._conn is None:
+            self._conn = sqlite3.connect(str(self.storage_path), isolation_level=None)
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS tasks ("
+                "task_id TEXT PRIMARY KEY, execute_at TEXT, repeat_interval_seconds REAL, action_args TEXT)"
+            )
+        return self._conn
+    
     def _load_tasks(self):
-        """Загружает задачи из файла."""
+        """Загружает задачи из хранилища."""
+        try:
+            now = datetime.now()
+            for task_id, execute_at in self._db().execute("SELECT task_id, execute_at FROM tasks"):
+                if datetime.fromisoformat(execute_at) > now:
+                    # Восстанавливаем задачу (без action, так как его нельзя сериализовать)
+                    # Action нужно будет восстановить при старте
+                    pass
+        except Exception as e:
+            logger.warning(f"Не удалось загрузить задачи из хранилища: {e}")
+    
+    def _save_task(self, task: ScheduledTask):
+        """Сохраняет одну задачу (только повторяющиеся — одноразовые не переживают рестарт)."""
+        if not task.repeat_interval:
+            return
         try:
-            if self.storage_path.exists():
-                with open(self.storage_path, "r") as f:
-                    data = json.load(f)
-                    # Загружаем только невыполненные задачи
-                    now = datetime.now()
-                    for task_data in data.get("tasks", []):
-                        execute_at = datetime.fromisoformat(task_data["execute_at"])
-                        if execute_at > now:
-                            # Восстанавливаем задачу (без action, так как его нельзя сериализовать)
-                            # Action нужно будет восстановить при старте
-                            pass
+            self._db().execute(
+                "INSERT OR REPLACE INTO tasks VALUES (?, ?, ?, ?)",
+                (
+                    task.task_id,
+                    task.execute_at.isoformat(),
+                    task.repeat_interval.total_seconds(),
+                    _dump_args(task.action_args)
+                )
+            )
         except Exception as e:
-            logger.warning(f"Не удалось загрузить задачи из файла: {e}")
+            logger.warning(f"Не удалось сохранить задачу {task.task_id}: {e}")
     
-    def _save_tasks(self):
-        """Сохраняет задачи в файл."""
+    def _delete_task(self, task_id: str):
+        """Удаляет задачу из хранилища."""
         try:
-            tasks_data = []
-            for task in self.tasks.values():
-                if task.repeat_interval:  # Сохраняем только повторяющиеся задачи
-                    tasks_data.append({
-                        "task_id": task.task_id,
-                        "execute_at": task.execute_at.isoformat(),
-                        "repeat_interval_seconds": task.repeat_interval.total_seconds() if task.repeat_interval else None,
-                        "action_args": task.action_args
-                    })
-            
-            with open(self.storage_path, "w") as f:
-                json.dump({"tasks": tasks_data}, f)
+            self._db().execute("DELETE FROM tasks WHERE task_id = ?", (task_id,))
         except Exception as e:
-            logger.warning(f"Не удалось сохранить задачи в файл: {e}")
+            logger.warning(f"Не удалось удалить задачу {task_id} из хранилища: {e}")
     
     async def start(self):
         """Запускает планировщик."""
@@ -116,17 +191,53 @@ class SchedulerService:
             except asyncio.CancelledError:
                 pass
         
-        self._save_tasks()
         logger.info("SchedulerService остановлен")
     
+    def _push(self, task: ScheduledTask):
+        """Кладет срок выполнения задачи в очередь."""
+        heapq.heappush(self._heap, (task.deadline, next(self._counter), task.task_id))
+    
+    def _seconds_until_next(self) -> Optional[float]:
+        """Сколько секунд до ближайшей задачи (None — задач нет)."""
+        while self._heap:
+            deadline, _, task_id = self._heap[0]
+            task = self.tasks.get(task_id)
+            if task is not None and task.deadline == deadline:
+                return max(deadline - time.monotonic(), 0.0)
+            heapq.heappop(self._heap)
+        return None
+    
+    def _resync_deadlines(self):
+        """Пересчитывает сроки всех задач, если системные часы ушли от монотонных (сон, перевод часов)."""
+        mono, wall = time.monotonic(), datetime.now()
+        ref_mono, ref_wall = self._clock_ref
+        self._clock_ref = (mono, wall)
+        drift = (wall - ref_wall).total_seconds() - (mono - ref_mono)
+        if abs(drift) <= SCHEDULER_RESYNC_THRESHOLD:
+            return
+        
+        logger.info(f"Системные часы сдвинулись на {drift:.0f}с относительно монотонных, пересчитываем сроки задач")
+        self._heap = []
+        for task in self.tasks.values():
+            task.sync_deadline()
+            self._push(task)
+    
     async def _run_loop(self):
-        """Основной цикл планировщика."""
-        logger.info(f"🔄 SchedulerService начал работу (интервал: {self.check_interval} сек)")
+        """Основной цикл планировщика: спит до ближайшей задачи или до появления новой."""
+        logger.info("🔄 SchedulerService начал работу")
         
         while self.running:
             try:
                 await self._check_and_execute_tasks()
-                await asyncio.sleep(self.check_interval)
+                self._wakeup.clear()
+                try:
+                    timeout = self._seconds_until_next()
+                    await asyncio.wait_for(
+                        self._wakeup.wait(),
+                        timeout=SCHEDULER_MAX_SLEEP if timeout is None else min(timeout, SCHEDULER_MAX_SLEEP)
+                    )
+                except asyncio.TimeoutError:
+                    pass
             except asyncio.CancelledError:
                 logger.info("SchedulerService получил сигнал остановки")
                 break
@@ -136,12 +247,19 @@ class SchedulerService:
     
     async def _check_and_execute_tasks(self):
         """Проверяет и выполняет задачи, которые готовы к выполнению."""
-        now = datetime.now()
+        self._resync_deadlines()
+        tick = time.monotonic()
         tasks_to_execute = []
         
-        for task_id, task in list(self.tasks.items()):
-            if task.should_execute():
+        while self._heap and self._heap[0][0] <= tick:
+            deadline, _, task_id = heapq.heappop(self._heap)
+            task = self.tasks.get(task_id)
+            if task is not None and task.deadline == deadline:
                 tasks_to_execute.append(task)
+        if not tasks_to_execute:
+            return
+        
+        now = datetime.now()
         
         for task in tasks_to_execute:
             try:
@@ -154,6 +272,9 @@ class SchedulerService:
                     next_time = task.get_next_execution_time()
                     if next_time:
                         task.execute_at = next_time
+                        task.sync_deadline()
+                        self._push(task)
+                        self._save_task(task)
                         logger.info(f"Следующее выполнение задачи {task.task_id}: {next_time}")
                 else:
                     # Удаляем одноразовую задачу
@@ -163,11 +284,8 @@ class SchedulerService:
             except Exception as e:
                 logger.error(f"Ошибка при выполнении задачи {task.task_id}: {e}")
                 # Удаляем задачу при ошибке (чтобы не повторять бесконечно)
-                if task_id in self.tasks:
-                    del self.tasks[task_id]
-        
-        if tasks_to_execute:
-            self._save_tasks()
+                self.tasks.pop(task.task_id, None)
+                self._delete_task(task.task_id)
     
     def schedule_task(
         self,
@@ -199,8 +317,14 @@ class SchedulerService:
                 repeat_interval=repeat_interval
             )
             
+            replaced = self.tasks.get(task_id)
             self.tasks[task_id] = task
-            self._save_tasks()
+            self._push(task)
+            self._wakeup.set()
+            if repeat_interval:
+                self._save_task(task)
+            elif replaced is not None and replaced.repeat_interval:
+                self._delete_task(task_id)
             
             logger.info(f"Задача {task_id} запланирована на {execute_at}")
             return True
@@ -213,7 +337,7 @@ class SchedulerService:
         """Отменяет запланированную задачу."""
         if task_id in self.tasks:
             del self.tasks[task_id]
-            self._save_tasks()
+            self._delete_task(task_id)
             logger.info(f"Задача {task_id} отменена")
             return True
         return False
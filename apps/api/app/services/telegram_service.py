@@ -1,6 +1,9 @@
 """
 Сервис для работы с Telegram Bot API.
 """
+import asyncio
+import re
+from functools import lru_cache
 from typing import Optional, List, Dict, Any
 
 try:
@@ -22,97 +25,77 @@ from tenacity import (
 from app.config import get_settings
 
 
+# Теги, которые поддерживает Telegram (остаются как есть)
+TELEGRAM_ALLOWED_TAGS = {'b', 'i', 'u', 's', 'a', 'code', 'pre', 'blockquote'}
+
+# Чем заменяются открывающий и закрывающий неподдерживаемые теги; остальные теги удаляются
+_BLOCK_TAG = ('', '\n')
+_TELEGRAM_TAG_REPLACEMENTS = {
+    'br': ('\n', ''),
+    'ul': ('', ''),
+    'ol': ('', ''),
+    'li': ('• ', '\n'),
+    **{f'h{level}': ('', '\n\n') for level in range(1, 7)},
+    'strong': ('<b>', '</b>'),
+    'em': ('<i>', '</i>'),
+    'p': ('', '\n\n'),
+    'div': _BLOCK_TAG,
+    'section': _BLOCK_TAG,
+    'article': _BLOCK_TAG,
+    'header': _BLOCK_TAG,
+    'footer': _BLOCK_TAG,
+    'nav': _BLOCK_TAG,
+    'table': _BLOCK_TAG,
+    'tr': _BLOCK_TAG,
+    'td': (' ', ''),
+}
+# Тег с атрибутами: значения в кавычках могут содержать '>'. Имя берется целиком (\b), а '<' внутри тега
+# не допускается, поэтому на незакрытых тегах поиск не уходит в квадратичный перебор
+_HTML_TAG_RE = re.compile(r"""<(/?)(\w+)\b(?:[^<>"']|"[^"<]*"|'[^'<]*')*>""")
+_EXTRA_NEWLINES_RE = re.compile(r'\n{3,}')
+
+# Сколько личных сообщений отправляется одновременно (лимит Bot API ~30 сообщений/с на бота)
+TELEGRAM_SEND_CONCURRENCY = 25
+
+# Эмодзи приоритета задачи в саммари и минутках встречи
+_PRIORITY_EMOJI = {'High': '🔴', 'Medium': '🟡', 'Low': '🟢'}
+
+
+def _replace_tag(match: re.Match) -> str:
+    """Замена одного тега при очистке HTML для Telegram."""
+    name = match.group(2).lower()
+    if name in TELEGRAM_ALLOWED_TAGS:
+        return match.group(0)
+    replacement = _TELEGRAM_TAG_REPLACEMENTS.get(name)
+    if replacement is None:
+        return ''
+    return replacement[1] if match.group(1) else replacement[0]
+
+
+@lru_cache(maxsize=256)
 def sanitize_html_for_telegram(html_text: str) -> str:
     """
     Очищает HTML от неподдерживаемых Telegram тегов.
     
     Telegram поддерживает только: <b>, <i>, <u>, <s>, <a>, <code>, <pre>, <blockquote>
     Удаляет: <li>, <ul>, <ol>, <p>, <div>, <span>, <h1>-<h6>, <strong>, <em> и другие неподдерживаемые теги.
-    """
-    import re
     
+    Результат кешируется: минутки и саммари уходят одним и тем же текстом админу и каждому участнику.
+    """
     if not html_text:
         return ""
     
-    text = html_text
-    
-    # КРИТИЧНО: Заменяем <br> и <br/> на перенос строки ПЕРВЫМ (до других замен)
-    text = re.sub(r'<br\s*/?>', '\n', text, flags=re.IGNORECASE)
-    
-    # Удаляем неподдерживаемые теги списков
-    text = re.sub(r'<ul[^>]*>', '', text, flags=re.IGNORECASE | re.DOTALL)
-    text = re.sub(r'</ul>', '', text, flags=re.IGNORECASE)
-    text = re.sub(r'<ol[^>]*>', '', text, flags=re.IGNORECASE | re.DOTALL)
-    text = re.sub(r'</ol>', '', text, flags=re.IGNORECASE)
-    text = re.sub(r'<li[^>]*>', '• ', text, flags=re.IGNORECASE)
-    text = re.sub(r'</li>', '\n', text, flags=re.IGNORECASE)
+    # Один проход по тегам: поддерживаемые остаются, списки/заголовки/блоки/таблицы
+    # превращаются в текст с переносами, strong/em -> b/i, остальные удаляются с сохранением содержимого.
+    # Большинство напоминаний и уведомлений без разметки — для них regex не запускается
+    text = _HTML_TAG_RE.sub(_replace_tag, html_text) if '<' in html_text else html_text
     
-    # Удаляем заголовки (h1-h6)
-    text = re.sub(r'<h[1-6][^>]*>', '', text, flags=re.IGNORECASE)
-    text = re.sub(r'</h[1-6]>', '\n\n', text, flags=re.IGNORECASE)
-    
-    # Заменяем <strong> и <em> на поддерживаемые теги
-    text = re.sub(r'<strong[^>]*>', '<b>', text, flags=re.IGNORECASE)
-    text = re.sub(r'</strong>', '</b>', text, flags=re.IGNORECASE)
-    text = re.sub(r'<em[^>]*>', '<i>', text, flags=re.IGNORECASE)
-    text = re.sub(r'</em>', '</i>', text, flags=re.IGNORECASE)
-    
-    # Удаляем другие неподдерживаемые теги
-    text = re.sub(r'<p[^>]*>', '', text, flags=re.IGNORECASE)
-    text = re.sub(r'</p>', '\n\n', text, flags=re.IGNORECASE)
-    text = re.sub(r'<div[^>]*>', '', text, flags=re.IGNORECASE)
-    text = re.sub(r'</div>', '\n', text, flags=re.IGNORECASE)
-    text = re.sub(r'<span[^>]*>', '', text, flags=re.IGNORECASE)
-    text = re.sub(r'</span>', '', text, flags=re.IGNORECASE)
-    
-    # Удаляем другие распространенные неподдерживаемые теги
-    text = re.sub(r'<section[^>]*>', '', text, flags=re.IGNORECASE)
-    text = re.sub(r'</section>', '\n', text, flags=re.IGNORECASE)
-    text = re.sub(r'<article[^>]*>', '', text, flags=re.IGNORECASE)
-    text = re.sub(r'</article>', '\n', text, flags=re.IGNORECASE)
-    text = re.sub(r'<header[^>]*>', '', text, flags=re.IGNORECASE)
-    text = re.sub(r'</header>', '\n', text, flags=re.IGNORECASE)
-    text = re.sub(r'<footer[^>]*>', '', text, flags=re.IGNORECASE)
-    text = re.sub(r'</footer>', '\n', text, flags=re.IGNORECASE)
-    text = re.sub(r'<nav[^>]*>', '', text, flags=re.IGNORECASE)
-    text = re.sub(r'</nav>', '\n', text, flags=re.IGNORECASE)
-    
-    # Удаляем теги таблиц (Telegram не поддерживает)
-    text = re.sub(r'<table[^>]*>', '', text, flags=re.IGNORECASE | re.DOTALL)
-    text = re.sub(r'</table>', '\n', text, flags=re.IGNORECASE)
-    text = re.sub(r'<tr[^>]*>', '', text, flags=re.IGNORECASE)
-    text = re.sub(r'</tr>', '\n', text, flags=re.IGNORECASE)
-    text = re.sub(r'<td[^>]*>', ' ', text, flags=re.IGNORECASE)
-    text = re.sub(r'</td>', '', text, flags=re.IGNORECASE)
-    text = re.sub(r'<th[^>]*>', '', text, flags=re.IGNORECASE)
-    text = re.sub(r'</th>', '', text, flags=re.IGNORECASE)
-    
-    # Удаляем все остальные HTML теги, кроме поддерживаемых Telegram
-    # Поддерживаемые: <b>, <i>, <u>, <s>, <a>, <code>, <pre>, <blockquote>
-    allowed_tags = ['b', 'i', 'u', 's', 'a', 'code', 'pre', 'blockquote']
-    
-    # Рекурсивно удаляем неподдерживаемые теги, сохраняя содержимое
-    def clean_unsupported_tags(text_content):
-        # Находим первый тег
-        match = re.search(r'<(/?)(\w+)[^>]*>', text_content)
-        if not match:
-            return text_content
-            
-        tag_name = match.group(2).lower()
-        is_closing = match.group(1) == '/'
-        
-        if tag_name in allowed_tags:
-            # Если тег разрешен, оставляем его и ищем дальше после него
-            return text_content[:match.end()] + clean_unsupported_tags(text_content[match.end():])
-        else:
-            # Если тег запрещен, удаляем его и ищем дальше
-            return text_content[:match.start()] + clean_unsupported_tags(text_content[match.end():])
-
-    # Применяем очистку
-    text = clean_unsupported_tags(text)
+    # Однострочный текст: чистить переносы не нужно
+    if '\n' not in text:
+        return text.strip()
     
     # Очищаем множественные переносы строк
-    text = re.sub(r'\n{3,}', '\n\n', text)
+    text = _EXTRA_NEWLINES_RE.sub('\n\n', text)
     
     # Удаляем лишние пробелы в начале и конце строк
     lines = [line.strip() for line in text.split('\n')]
@@ -161,6 +144,25 @@ class TelegramService:
                 logger.error(f"❌ TELEGRAM_BOT_TOKEN невалиден или API недоступен: {e}")
             return False
     
+    async def _send_raw(self, chat_id: str, message: str, parse_mode: Optional[str] = None) -> int:
+        """
+        Отправляет уже подготовленное сообщение без очистки HTML.
+        
+        Args:
+            chat_id: Chat ID получателя
+            message: Текст сообщения (для HTML — уже очищенный sanitize_html_for_telegram)
+            parse_mode: Режим парсинга (HTML, Markdown или None)
+            
+        Returns:
+            ID отправленного сообщения
+        """
+        result = await self.bot.send_message(
+            chat_id=chat_id,
+            text=message,
+            parse_mode=parse_mode
+        )
+        return result.message_id
+    
     @retry(
         stop=stop_after_attempt(2),
         wait=wait_exponential(multiplier=1, min=1, max=3),
@@ -183,14 +185,10 @@ class TelegramService:
             if parse_mode == "HTML":
                 message = sanitize_html_for_telegram(message)
             
-            result = await self.bot.send_message(
-                chat_id=self.admin_chat_id,
-                text=message,
-                parse_mode=parse_mode
-            )
+            message_id = await self._send_raw(self.admin_chat_id, message, parse_mode)
             
-            logger.info(f"Уведомление отправлено в Telegram: {result.message_id}")
-            return result.message_id
+            logger.info(f"Уведомление отправлено в Telegram: {message_id}")
+            return message_id
         except Exception as e:
             error_msg = str(e).lower()
             if "unauthorized" in error_msg or "401" in error_msg:
@@ -252,14 +250,10 @@ class TelegramService:
             if parse_mode == "HTML":
                 message = sanitize_html_for_telegram(message)
             
-            result = await self.bot.send_message(
-                chat_id=self.ok_chat_id,
-                text=message,
-                parse_mode=parse_mode
-            )
+            message_id = await self._send_raw(self.ok_chat_id, message, parse_mode)
             
-            logger.info(f"Сообщение отправлено в OK чат: {result.message_id}")
-            return result.message_id
+            logger.info(f"Сообщение отправлено в OK чат: {message_id}")
+            return message_id
         except Exception as e:
             logger.error(f"Ошибка при отправке в OK чат: {e}")
             raise
@@ -290,29 +284,30 @@ class TelegramService:
             }
         """
         # Формируем сообщение
-        message = f"<b>📋 Саммари встречи</b>\n\n"
+        parts: List[str] = ["<b>📋 Саммари встречи</b>\n\n"]
         
         if participants:
-            message += f"<b>Участники:</b> {', '.join([p.get('name', str(p)) if isinstance(p, dict) else str(p) for p in participants])}\n\n"
+            parts.append(f"<b>Участники:</b> {', '.join([p.get('name', str(p)) if isinstance(p, dict) else str(p) for p in participants])}\n\n")
         
         # Очищаем summary от неподдерживаемых HTML тегов (особенно <br>)
         summary_clean = sanitize_html_for_telegram(summary)
-        message += f"{summary_clean}\n\n"
+        parts.append(f"{summary_clean}\n\n")
         
         if action_items:
-            message += "<b>Задачи:</b>\n"
+            parts.append("<b>Задачи:</b>\n")
             for i, item in enumerate(action_items[:10], 1):  # Первые 10 задач
                 if isinstance(item, dict):
-                    priority_emoji = {'High': '🔴', 'Medium': '🟡', 'Low': '🟢'}.get(item.get('priority', 'Medium'), '⚪')
+                    priority_emoji = _PRIORITY_EMOJI.get(item.get('priority', 'Medium'), '⚪')
                     assignee_text = f" ({item.get('assignee', '')})" if item.get('assignee') else ""
-                    message += f"{i}. {priority_emoji} {item.get('text', '')}{assignee_text}\n"
+                    parts.append(f"{i}. {priority_emoji} {item.get('text', '')}{assignee_text}\n")
                 else:
-                    message += f"{i}. {str(item)}\n"
+                    parts.append(f"{i}. {str(item)}\n")
             
             if len(action_items) > 10:
-                message += f"\n... и еще {len(action_items) - 10} задач\n"
+                parts.append(f"\n... и еще {len(action_items) - 10} задач\n")
         
-        message += "\n"
+        parts.append("\n")
+        message = "".join(parts)
         
         result = {
             "ok_message_id": None,
@@ -371,7 +366,7 @@ class TelegramService:
             }
         """
         # Формируем сообщение
-        message = f"<b>📋 Минутки встречи</b>\n\n"
+        parts: List[str] = ["<b>📋 Минутки встречи</b>\n\n"]
         
         if participants:
             # Формируем список участников с тегами (формат: Name @username)
@@ -392,53 +387,62 @@ class TelegramService:
                     participants_list.append(str(p))
             
             if participants_list:
-                message += f"<b>Участники:</b> {', '.join(participants_list)}\n\n"
+                parts.append(f"<b>Участники:</b> {', '.join(participants_list)}\n\n")
         
         # Очищаем summary от неподдерживаемых HTML тегов
         summary_clean = sanitize_html_for_telegram(summary)
-        message += f"{summary_clean}\n\n"
+        parts.append(f"{summary_clean}\n\n")
         
         if action_items:
-            message += "<b>Задачи:</b>\n"
+            # Участники по всем вариантам имени (name, original_name, matched_name) — один раз на встречу
+            participants_by_name: Dict[str, Dict[str, Any]] = {}
+            participant_names: List[tuple] = []
+            for p in participants or []:
+                if not isinstance(p, dict):
+                    continue
+                for key in ('name', 'original_name', 'matched_name'):
+                    alias = (p.get(key) or '').lower().strip()
+                    if alias:
+                        participants_by_name.setdefault(alias, p)
+                p_name = (p.get('name') or '').lower().strip()
+                if p_name:
+                    participant_names.append((p_name, p))
+            
+            parts.append("<b>Задачи:</b>\n")
             for i, item in enumerate(action_items[:10], 1):  # Первые 10 задач
                 if isinstance(item, dict):
-                    priority_emoji = {'High': '🔴', 'Medium': '🟡', 'Low': '🟢'}.get(item.get('priority', 'Medium'), '⚪')
+                    priority_emoji = _PRIORITY_EMOJI.get(item.get('priority', 'Medium'), '⚪')
                     assignee = item.get('assignee', '')
                     
-                    # Ищем telegram_username для ответственного
+                    # Ищем telegram_username для ответственного: точное совпадение имени, затем вхождение
                     assignee_tag = ""
-                    if assignee and participants:
+                    if assignee:
                         assignee_lower = assignee.lower().strip()
-                        for p in participants:
-                            if isinstance(p, dict):
-                                p_name = p.get('name', '').lower().strip()
-                                p_username = p.get('telegram_username', '')
-                                original_name = p.get('original_name', '').lower().strip()
-                                matched_name = p.get('matched_name', '').lower().strip()
-                                
-                                # Сравниваем имя ответственного с участником (разные варианты)
-                                if (assignee_lower == p_name or 
-                                    assignee_lower == original_name or 
-                                    assignee_lower == matched_name or
-                                    assignee_lower in p_name or 
-                                    p_name in assignee_lower):
-                                    if p_username:
-                                        assignee_tag = f" @{p_username}"
-                                    else:
-                                        assignee_tag = f" ({p.get('name', assignee)})"
-                                    break
+                        p = participants_by_name.get(assignee_lower)
+                        if p is None:
+                            p = next(
+                                (p for p_name, p in participant_names if assignee_lower in p_name or p_name in assignee_lower),
+                                None
+                            )
+                        if p is not None:
+                            p_username = p.get('telegram_username', '')
+                            if p_username:
+                                assignee_tag = f" @{p_username}"
+                            else:
+                                assignee_tag = f" ({p.get('name', assignee)})"
                     
                     if not assignee_tag and assignee:
                         assignee_tag = f" ({assignee})"
                     
-                    message += f"{i}. {priority_emoji} {item.get('text', '')}{assignee_tag}\n"
+                    parts.append(f"{i}. {priority_emoji} {item.get('text', '')}{assignee_tag}\n")
                 else:
-                    message += f"{i}. {str(item)}\n"
+                    parts.append(f"{i}. {str(item)}\n")
             
             if len(action_items) > 10:
-                message += f"\n... и еще {len(action_items) - 10} задач\n"
+                parts.append(f"\n... и еще {len(action_items) - 10} задач\n")
         
-        message += "\n"
+        parts.append("\n")
+        message = "".join(parts)
         
         result = {
             "admin_message_id": None,
@@ -454,8 +458,17 @@ class TelegramService:
             except Exception as e:
                 logger.error(f"Ошибка при отправке минуток админу: {e}")
         
-        # Отправляем всем участникам с telegram_chat_id или telegram_username
+        # Отправляем всем участникам с telegram_chat_id параллельно (не больше TELEGRAM_SEND_CONCURRENCY запросов);
+        # HTML очищается один раз на всю рассылку (тот же результат, что у send_notification выше — из кэша)
         if send_to_participants and participants:
+            semaphore = asyncio.Semaphore(TELEGRAM_SEND_CONCURRENCY)
+            participant_message = sanitize_html_for_telegram(message)
+            
+            async def send(chat_id: str) -> int:
+                async with semaphore:
+                    return await self._send_raw(chat_id, participant_message, "HTML")
+            
+            recipients = []
             for participant in participants:
                 if not isinstance(participant, dict):
                     continue
@@ -473,18 +486,7 @@ class TelegramService:
                 
                 # Пробуем отправить по chat_id (приоритет)
                 if chat_id:
-                    try:
-                        message_id = await self.send_message_to_user(
-                            chat_id=str(chat_id),
-                            message=message,
-                            parse_mode="HTML"
-                        )
-                        participant_result["message_id"] = message_id
-                        logger.info(f"✅ Минутки отправлены участнику {name} (chat_id: {chat_id}): {message_id}")
-                    except Exception as e:
-                        error_msg = str(e)
-                        participant_result["error"] = error_msg
-                        logger.warning(f"⚠️ Не удалось отправить минутки участнику {name} (chat_id: {chat_id}): {error_msg}")
+                    recipients.append(participant_result)
                 elif username:
                     # Если есть только username, но нет chat_id, логируем предупреждение
                     # В будущем можно добавить поиск chat_id по username через базу контактов
@@ -495,6 +497,18 @@ class TelegramService:
                     logger.debug(f"Участник {name} не имеет telegram_chat_id или telegram_username, пропускаем")
                 
                 result["participants"].append(participant_result)
+            
+            sent = await asyncio.gather(*(send(str(r["chat_id"])) for r in recipients), return_exceptions=True)
+            for participant_result, message_id in zip(recipients, sent):
+                name = participant_result["name"]
+                chat_id = participant_result["chat_id"]
+                if isinstance(message_id, BaseException):
+                    error_msg = str(message_id)
+                    participant_result["error"] = error_msg
+                    logger.warning(f"⚠️ Не удалось отправить минутки участнику {name} (chat_id: {chat_id}): {error_msg}")
+                else:
+                    participant_result["message_id"] = message_id
+                    logger.info(f"✅ Минутки отправлены участнику {name} (chat_id: {chat_id}): {message_id}")
         
         # Сохраняем минутку в Notion после отправки в Telegram
         try:
@@ -543,15 +557,11 @@ class TelegramService:
             if parse_mode == "HTML":
                 message = sanitize_html_for_telegram(message)
             
-            result = await self.bot.send_message(
-                chat_id=chat_id,
-                text=message,
-                parse_mode=parse_mode
-            )
+            message_id = await self._send_raw(chat_id, message, parse_mode)
             
-            logger.info(f"✅ Сообщение успешно отправлено в Telegram: message_id={result.message_id}")
+            logger.info(f"✅ Сообщение успешно отправлено в Telegram: message_id={message_id}")
             return {
-                "message_id": result.message_id,
+                "message_id": message_id,
                 "chat_id": chat_id,
                 "success": True
             }
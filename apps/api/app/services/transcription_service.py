@@ -1,19 +1,69 @@
 import os
-import whisper
 import asyncio
 import torch
 from pathlib import Path
 from loguru import logger
 from typing import Optional, Union
 
+try:
+    from faster_whisper import WhisperModel, decode_audio
+    FASTER_WHISPER_AVAILABLE = True
+except ImportError:
+    FASTER_WHISPER_AVAILABLE = False
+    WhisperModel = None  # type: ignore
+    decode_audio = None  # type: ignore
+
+try:
+    # Батчевое декодирование речевых фрагментов (faster-whisper >= 1.1)
+    from faster_whisper import BatchedInferencePipeline
+except ImportError:
+    BatchedInferencePipeline = None  # type: ignore
+
+try:
+    import whisper
+    WHISPER_AVAILABLE = True
+except ImportError:
+    WHISPER_AVAILABLE = False
+    whisper = None  # type: ignore
+
+# Размер модели Whisper
+WHISPER_MODEL_SIZE = "small"
+
+# Сколько речевых фрагментов декодируется за раз в BatchedInferencePipeline
+WHISPER_BATCH_SIZE = 16
+
+# Паузы длиннее полусекунды режутся VAD и не попадают в энкодер
+WHISPER_VAD_PARAMETERS = {"min_silence_duration_ms": 500}
+
+# Частота дискретизации, которую ожидает Whisper
+WHISPER_SAMPLE_RATE = 16000
+
+
+def _load_audio(audio_path: str):
+    """
+    Декодирует аудиофайл в 16kHz mono float32 (numpy).
+    
+    Массив не кешируется: час записи занимает ~230MB и нужен только на время транскрипции.
+    
+    Args:
+        audio_path: Путь к аудиофайлу
+        
+    Returns:
+        Массив сэмплов
+    """
+    if FASTER_WHISPER_AVAILABLE:
+        return decode_audio(audio_path, sampling_rate=WHISPER_SAMPLE_RATE)
+    return whisper.load_audio(audio_path, sr=WHISPER_SAMPLE_RATE)
+
 class TranscriptionService:
     """
-    Сервис для локальной транскрипции аудио с использованием OpenAI Whisper.
-    Оптимизировано для Apple Silicon (Metal).
+    Сервис для локальной транскрипции аудио с использованием Whisper.
+    Если установлен faster-whisper (CTranslate2, int8/fp16) — используется он, иначе OpenAI Whisper.
     """
     
     _instance = None
     _model = None
+    _load_lock = asyncio.Lock()  # Одновременные первые запросы не должны загружать модель (~500MB) дважды
 
     def __new__(cls):
         if cls._instance is None:
@@ -35,12 +85,51 @@ class TranscriptionService:
     async def _get_model(self):
         """Ленивая загрузка модели."""
         if self._model is None:
-            logger.info("📥 Загрузка модели Whisper (small)...")
-            # Загружаем модель в отдельном потоке, чтобы не блокировать event loop
-            self._model = await asyncio.to_thread(whisper.load_model, "small", device=self.device)
-            logger.info("✅ Модель Whisper загружена")
+            async with self._load_lock:
+                if self._model is None:
+                    logger.info(f"📥 Загрузка модели Whisper ({WHISPER_MODEL_SIZE})...")
+                    # Загружаем модель в отдельном потоке, чтобы не блокировать event loop
+                    if FASTER_WHISPER_AVAILABLE:
+                        # CTranslate2 не поддерживает MPS — на Apple Silicon считаем на CPU в int8
+                        if self.device == "cuda":
+                            device, compute_type = "cuda", "float16"
+                        else:
+                            device, compute_type = "cpu", "int8"
+                        model = await asyncio.to_thread(
+                            WhisperModel, WHISPER_MODEL_SIZE, device=device, compute_type=compute_type
+                        )
+                        if BatchedInferencePipeline is not None:
+                            model = BatchedInferencePipeline(model=model)
+                        logger.info(f"✅ Модель faster-whisper загружена ({device}, {compute_type})")
+                    elif WHISPER_AVAILABLE:
+                        model = await asyncio.to_thread(whisper.load_model, WHISPER_MODEL_SIZE, device=self.device)
+                        model.eval()
+                        logger.info("✅ Модель Whisper загружена")
+                    else:
+                        raise ImportError("Whisper не установлен. Установите: pip install faster-whisper")
+                    TranscriptionService._model = model
         return self._model
 
+    @staticmethod
+    def _transcribe_sync(model, audio, language: str, fp16: bool) -> str:
+        """Транскрипция в текст (выполняется в отдельном потоке)."""
+        if FASTER_WHISPER_AVAILABLE:
+            # VAD отбрасывает паузы до декодера; сегменты — генератор, декодирование идет по мере чтения
+            kwargs = {}
+            if BatchedInferencePipeline is not None and isinstance(model, BatchedInferencePipeline):
+                kwargs["batch_size"] = WHISPER_BATCH_SIZE
+            segments, _ = model.transcribe(
+                audio,
+                language=language,
+                beam_size=5,
+                vad_filter=True,
+                vad_parameters=WHISPER_VAD_PARAMETERS,
+                **kwargs
+            )
+            return "".join(segment.text for segment in segments)
+        with torch.inference_mode():
+            return model.transcribe(audio, language=language, fp16=fp16).get("text", "")
+
     async def transcribe(self, audio_path: Union[str, Path], language: str = "ru") -> Optional[str]:
         """
         Транскрибирует аудиофайл в текст.
@@ -62,18 +151,24 @@ class TranscriptionService:
 
             logger.info(f"🎙 Начало транскрипции файла: {audio_path}...")
             
+            # Декодируем заранее в отдельном потоке и передаем модели готовый массив
+            audio = await asyncio.to_thread(_load_audio, audio_path)
+            
             # Запускаем транскрипцию в отдельном потоке
-            # Отключаем fp16 для MPS, так как это вызывает ошибки (NaN)
+            # Отключаем fp16 для MPS, так как это вызывает ошибки (NaN). Перевод весов в bfloat16 не помогает:
+            # слои openai-whisper приводят веса к dtype входа (float32), так что считать все равно будем в fp32.
+            # Быстрый путь на Apple Silicon — faster-whisper (int8 на CPU)
             use_fp16 = (self.device == "cuda")
             
-            result = await asyncio.to_thread(
-                model.transcribe, 
-                audio_path, 
+            text = await asyncio.to_thread(
+                self._transcribe_sync,
+                model,
+                audio,
                 language=language,
                 fp16=use_fp16
             )
             
-            text = result.get("text", "").strip()
+            text = text.strip()
             logger.info(f"✅ Транскрипция завершена ({len(text)} симв.)")
             return text
 
@@ -13,6 +13,9 @@ from app.db.models import KnowledgeItem
 from app.db.database import AsyncSessionLocal
 from app.utils.text_splitter import RecursiveCharacterTextSplitter
 
+# Сколько чанков документа пишется в ChromaDB одним батчем
+CHUNK_INDEX_BATCH_SIZE = 200
+
 
 class KnowledgeWorkflow:
     """Workflow для индексации документов."""
@@ -57,21 +60,23 @@ class KnowledgeWorkflow:
             chunks = self.text_splitter.split_text(text_content)
             logger.info(f"Создано {len(chunks)} чанков")
             
-            # Шаг 3: Индексация каждого чанка в ChromaDB
-            chunk_ids = []
-            for i, chunk in enumerate(chunks):
-                chunk_id = f"{doc_id}-chunk-{i}"
-                await self.rag.add_knowledge(
-                    doc_id=chunk_id,
-                    content=chunk,
-                    metadata={
+            # Шаг 3: Индексация чанков в ChromaDB батчами по CHUNK_INDEX_BATCH_SIZE
+            chunk_ids = [f"{doc_id}-chunk-{i}" for i in range(len(chunks))]
+            items = [
+                (
+                    chunk_id,
+                    chunk,
+                    {
                         "source_file": filename,
                         "file_type": file_type,
                         "chunk_index": i,
                         "total_chunks": len(chunks)
                     }
                 )
-                chunk_ids.append(chunk_id)
+                for i, (chunk_id, chunk) in enumerate(zip(chunk_ids, chunks))
+            ]
+            for start in range(0, len(items), CHUNK_INDEX_BATCH_SIZE):
+                await self.rag.add_knowledge_batch(items[start:start + CHUNK_INDEX_BATCH_SIZE])
             
             # Шаг 4: Сохранение метаданных в SQLite
             async with AsyncSessionLocal() as session:
@@ -20,18 +20,26 @@ from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select
 from pathlib import Path
 import asyncio
+import re
 import tempfile
 import os
 
+# Упоминания проектов в транскрипте ("проект X", "в проекте Y") — источник тегов встречи
+PROJECT_TAG_PATTERNS = (
+    re.compile(r'проект[ае]?\s+([a-zа-яё]+)'),
+    re.compile(r'в\s+проекте\s+([a-zа-яё]+)'),
+    re.compile(r'проект\s+"([^"]+)"'),
+)
+
 
 class MeetingWorkflow:
     """Workflow для обработки встреч."""
     
     def __init__(self):
         self.context_loader = ContextLoader()
+        self.rag = RAGService()
         self.ollama = OllamaService(context_loader=self.context_loader)
         self.notion = NotionService()
-        self.rag = RAGService()
         self.telegram = TelegramService()
     
     async def process_meeting(
@@ -429,15 +437,8 @@ class MeetingWorkflow:
         
         # Извлекаем теги из упоминаний проектов в транскрипте
         # Ищем паттерны типа "проект X", "в проекте Y"
-        import re
-        project_patterns = [
-            r'проект[ае]?\s+([a-zа-яё]+)',
-            r'в\s+проекте\s+([a-zа-яё]+)',
-            r'проект\s+"([^"]+)"',
-        ]
-        
-        for pattern in project_patterns:
-            matches = re.findall(pattern, transcript_lower)
+        for pattern in PROJECT_TAG_PATTERNS:
+            matches = pattern.findall(transcript_lower)
             for match in matches:
                 if isinstance(match, tuple):
                     match = match[0]
@@ -255,6 +255,78 @@ async def transcription_worker(
     if summarized_chunks is None:
         summarized_chunks = []
     
+    # Суммаризация идет в фоне: воркер сразу берет следующий чанк на транскрипцию,
+    # а запросы к Ollama разных чанков выполняются параллельно
+    pending_summaries: list = []
+    
+    async def summarize_and_append(text: str, chunk_number: int, slot: int, previous: asyncio.Task = None):
+        """Суммаризирует чанк с контекстом и дозаписывает его в Notion после предыдущего чанка."""
+        summary = None
+        summarization_start = datetime.now()
+        try:
+            # Извлекаем сущности из текста
+            entities = await context_loader.resolve_entity(text, use_fuzzy=True, fuzzy_threshold=0.6)
+            projects = entities.get('projects', [])
+            people = entities.get('people', [])
+            terms = context_loader.find_glossary_terms(text)
+            
+            entities_count = len(projects) + len(people) + len(terms)
+            logger.info(
+                f"🔍 Чанк #{chunk_number}: найдено сущностей - "
+                f"проекты: {len(projects)}, люди: {len(people)}, термины: {len(terms)} "
+                f"(всего: {entities_count})"
+            )
+            
+            # Суммаризируем с контекстом (не больше ollama_num_parallel запросов к Ollama на процесс)
+            async with ollama.parallel_semaphore:
+                summary = await ollama.summarize_chunk_with_context(
+                    chunk_text=text,
+                    chunk_number=chunk_number,
+                    projects=projects,
+                    people=people,
+                    terms=terms
+                )
+            
+            summarization_time = (datetime.now() - summarization_start).total_seconds()
+            summary_length = len(summary)
+            logger.info(
+                f"⏱️ Суммаризация чанка #{chunk_number} завершена: "
+                f"время={summarization_time:.2f}сек, длина={summary_length} симв., "
+                f"сущностей={entities_count}"
+            )
+            
+            # Сохраняем суммаризированный чанк на его место
+            summarized_chunks[slot] = summary
+            
+        except Exception as summary_error:
+            summarization_time = (datetime.now() - summarization_start).total_seconds()
+            logger.error(
+                f"❌ Ошибка суммаризации чанка #{chunk_number}: {summary_error}\n"
+                f"   Тип ошибки: {type(summary_error).__name__}\n"
+                f"   Время до ошибки: {summarization_time:.2f} сек\n"
+                f"   Длина текста: {len(text)} символов\n"
+                f"   Найдено сущностей: {entities_count if 'entities_count' in locals() else 0}"
+            )
+            # Продолжаем работу, даже если суммаризация не удалась
+            # (в слоте остается сырой текст как fallback)
+            summary = None
+        
+        # Дозаписываем в Notion строго после предыдущего чанка
+        if previous is not None:
+            await previous
+        
+        # Дозаписываем в Notion с обработкой ошибок
+        try:
+            notion_content = f"\n\n[Чанк #{chunk_number}]\n{text}"
+            if summary:
+                notion_content += f"\n\n📋 Саммари: {summary}"
+            
+            await notion_service.append_to_meeting(page_id, notion_content)
+            logger.info(f"✅ Чанк #{chunk_number} добавлен в Notion" + (f" (с саммари)" if summary else ""))
+        except Exception as e:
+            logger.error(f"❌ Ошибка при добавлении в Notion: {e}")
+            # Продолжаем работу, даже если не удалось записать в Notion
+
     while True:
         try:
             # Получаем путь к файлу из очереди
@@ -262,6 +334,8 @@ async def transcription_worker(
             
             if audio_file is None:  # Сигнал остановки
                 logger.info("🛑 Воркер транскрипции получил сигнал остановки")
+                # Дожидаемся фоновых суммаризаций перед финальным саммари
+                await asyncio.gather(*pending_summaries)
                 break
             
             chunk_counter += 1
@@ -291,69 +365,13 @@ async def transcription_worker(
                 
                 logger.info(f"✅ Чанк #{chunk_counter} транскрибирован ({len(text)} симв.)")
                 
-                # Суммаризируем чанк с контекстом
-                summary = None
-                summarization_start = datetime.now()
-                try:
-                    # Извлекаем сущности из текста
-                    entities = await context_loader.resolve_entity(text, use_fuzzy=True, fuzzy_threshold=0.6)
-                    projects = entities.get('projects', [])
-                    people = entities.get('people', [])
-                    terms = context_loader.find_glossary_terms(text)
-                    
-                    entities_count = len(projects) + len(people) + len(terms)
-                    logger.info(
-                        f"🔍 Чанк #{chunk_counter}: найдено сущностей - "
-                        f"проекты: {len(projects)}, люди: {len(people)}, термины: {len(terms)} "
-                        f"(всего: {entities_count})"
-                    )
-                    
-                    # Суммаризируем с контекстом
-                    summary = await ollama.summarize_chunk_with_context(
-                        chunk_text=text,
-                        chunk_number=chunk_counter,
-                        projects=projects,
-                        people=people,
-                        terms=terms
-                    )
-                    
-                    summarization_time = (datetime.now() - summarization_start).total_seconds()
-                    summary_length = len(summary)
-                    logger.info(
-                        f"⏱️ Суммаризация чанка #{chunk_counter} завершена: "
-                        f"время={summarization_time:.2f}сек, длина={summary_length} симв., "
-                        f"сущностей={entities_count}"
-                    )
-                    
-                    # Сохраняем суммаризированный чанк
-                    summarized_chunks.append(summary)
-                    
-                except Exception as summary_error:
-                    summarization_time = (datetime.now() - summarization_start).total_seconds()
-                    logger.error(
-                        f"❌ Ошибка суммаризации чанка #{chunk_counter}: {summary_error}\n"
-                        f"   Тип ошибки: {type(summary_error).__name__}\n"
-                        f"   Время до ошибки: {summarization_time:.2f} сек\n"
-                        f"   Длина текста: {len(text)} символов\n"
-                        f"   Найдено сущностей: {entities_count if 'entities_count' in locals() else 0}"
-                    )
-                    # Продолжаем работу, даже если суммаризация не удалась
-                    summary = None
-                    # Сохраняем сырой текст как fallback
-                    if text:
-                        summarized_chunks.append(text[:150] + "...")
-                
-                # Дозаписываем в Notion с обработкой ошибок
-                try:
-                    notion_content = f"\n\n[Чанк #{chunk_counter}]\n{text}"
-                    if summary:
-                        notion_content += f"\n\n📋 Саммари: {summary}"
-                    
-                    await notion_service.append_to_meeting(page_id, notion_content)
-                    logger.info(f"✅ Чанк #{chunk_counter} добавлен в Notion" + (f" (с саммари)" if summary else ""))
-                except Exception as e:
-                    logger.error(f"❌ Ошибка при добавлении в Notion: {e}")
-                    # Продолжаем работу, даже если не удалось записать в Notion
+                # Суммаризируем чанк в фоне; в слоте до готовности лежит сырой текст как fallback
+                slot = len(summarized_chunks)
+                summarized_chunks.append(text[:150] + "...")
+                previous = pending_summaries[-1] if pending_summaries else None
+                pending_summaries.append(
+                    asyncio.create_task(summarize_and_append(text, chunk_counter, slot, previous))
+                )
             else:
                 logger.warning(f"⚠️ Чанк #{chunk_counter}: транскрипция вернула пустой текст или произошла ошибка")
             
@@ -368,6 +386,8 @@ async def transcription_worker(
             
         except asyncio.CancelledError:
             logger.info("🛑 Воркер транскрипции получил сигнал отмены")
+            for task in pending_summaries:
+                task.cancel()
             break
         except Exception as e:
             logger.error(f"❌ Ошибка в воркере транскрипции: {e}")
@@ -591,7 +611,14 @@ async def main():
                 # Генерируем финальное саммари из суммаризированных чанков
                 if summarized_chunks:
                     logger.info("🤖 Генерирую финальное саммари из суммаризированных чанков...")
-                    summary = await ollama.summarize_from_chunks(summarized_chunks)
+                    # Печатаем саммари по мере генерации, чтобы не ждать его целиком после остановки записи
+                    print("\n📋 Саммари встречи:\n")
+                    summary_parts = []
+                    async for piece in ollama.summarize_from_chunks_stream(summarized_chunks):
+                        summary_parts.append(piece)
+                        print(piece, end="", flush=True)
+                    print("\n")
+                    summary = "".join(summary_parts).strip()
                 else:
                     # Fallback: если не было суммаризированных чанков, используем обычную суммаризацию
                     logger.warning("⚠️ Нет суммаризированных чанков, использую обычную суммаризацию")
@@ -206,8 +206,12 @@ def mock_context_loader():
     mock.find_people_in_text.return_value = [mock.people["testuser"]]
     mock.find_projects_in_text.return_value = [mock.projects[0]]
     mock.get_person_context.return_value = "Developer: Тестовый контекст"
+    mock.render_people.return_value = "- Тестовый Пользователь (@testuser) - Developer: Тестовый контекст (также: тест, test)"
+    mock.render_projects.return_value = "- Тестовый Проект (TEST): Тестовое описание [Статус: Active] (теги: test, тест)"
+    mock.get_glossary_head.return_value = "- тест: Проверочный процесс\n- API: Application Programming Interface\n"
     mock.resolve_entity = AsyncMock(return_value=mock.people["testuser"])
     mock.ensure_notion_sync = AsyncMock()
+    mock.fingerprint = "test-context"
     
     return mock
 
@@ -0,0 +1,127 @@
+"""
+Unit тесты для BatchScheduler.
+"""
+import asyncio
+
+import pytest
+
+from app.core.batching import BatchScheduler
+
+
+@pytest.mark.asyncio
+class TestBatchScheduler:
+    """Тесты для агрегации запросов в батчи."""
+
+    async def test_window_collects_concurrent_items(self):
+        """Тест что одновременные элементы уходят одним вызовом, а результаты возвращаются по порядку."""
+        batches = []
+
+        async def handler(items):
+            batches.append(items)
+            return [item * 2 for item in items]
+
+        scheduler = BatchScheduler(handler, max_batch=8, max_delay=0.01)
+        results = await asyncio.gather(*(scheduler.submit(i) for i in range(5)))
+
+        assert results == [0, 2, 4, 6, 8]
+        assert batches == [[0, 1, 2, 3, 4]]
+
+    async def test_full_batch_flushes_without_waiting(self):
+        """Тест что полный батч отправляется сразу, а остаток — следующим батчем."""
+        batches = []
+
+        async def handler(items):
+            batches.append(items)
+
+        scheduler = BatchScheduler(handler, max_batch=2, max_delay=10)
+        results = await asyncio.wait_for(asyncio.gather(*(scheduler.submit(i) for i in range(4))), timeout=1)
+
+        assert results == [None] * 4
+        assert batches == [[0, 1], [2, 3]]
+
+    async def test_idle_single_item_skips_window(self):
+        """Тест что одиночный элемент в простаивающем планировщике не ждет окно."""
+        batches = []
+
+        async def handler(items):
+            batches.append(items)
+            return items
+
+        scheduler = BatchScheduler(handler, max_delay=10, flush_when_idle=True)
+
+        assert await asyncio.wait_for(scheduler.submit("x"), timeout=1) == "x"
+        assert await asyncio.wait_for(asyncio.gather(scheduler.submit(1), scheduler.submit(2)), timeout=1) == [1, 2]
+        assert batches == [["x"], [1, 2]]
+
+    async def test_items_during_running_batch_wait_for_window(self):
+        """Тест что пока идет батч, новые элементы копятся окном и уходят одним вызовом."""
+        batches = []
+        release = asyncio.Event()
+
+        async def handler(items):
+            batches.append(items)
+            if items == ["first"]:
+                await release.wait()
+            return items
+
+        scheduler = BatchScheduler(handler, max_delay=0.01, flush_when_idle=True)
+        first = asyncio.ensure_future(scheduler.submit("first"))
+        await asyncio.sleep(0.001)
+        rest = asyncio.ensure_future(asyncio.gather(scheduler.submit(1), scheduler.submit(2)))
+        await asyncio.sleep(0.001)
+        release.set()
+
+        assert await asyncio.wait_for(first, timeout=1) == "first"
+        assert await asyncio.wait_for(rest, timeout=1) == [1, 2]
+        assert batches == [["first"], [1, 2]]
+
+    async def test_error_reaches_every_item(self):
+        """Тест что общая ошибка обработчика достается всем элементам батча."""
+        async def handler(items):
+            raise RuntimeError("chroma down")
+
+        scheduler = BatchScheduler(handler, max_delay=0.01)
+        results = await asyncio.gather(scheduler.submit(1), scheduler.submit(2), return_exceptions=True)
+
+        assert all(isinstance(r, RuntimeError) for r in results)
+
+    async def test_bad_item_fails_only_its_caller(self):
+        """Тест что после ошибки батча элементы повторяются по одному и ошибку получает только плохой."""
+        batches = []
+
+        async def handler(items):
+            batches.append(items)
+            if "плохой" in items:
+                raise ValueError("плохой документ")
+            return [item.upper() for item in items]
+
+        scheduler = BatchScheduler(handler, max_delay=0.01)
+        results = await asyncio.gather(
+            scheduler.submit("первый"), scheduler.submit("плохой"), scheduler.submit("третий"),
+            return_exceptions=True
+        )
+
+        assert results[0] == "ПЕРВЫЙ" and results[2] == "ТРЕТИЙ"
+        assert isinstance(results[1], ValueError)
+        assert batches == [["первый", "плохой", "третий"], ["первый"], ["плохой"], ["третий"]]
+
+    async def test_running_flushes_are_referenced(self):
+        """Тест что запущенный сброс удерживается планировщиком, пока не завершится."""
+        import gc
+
+        release = asyncio.Event()
+
+        async def handler(items):
+            await release.wait()
+            return items
+
+        scheduler = BatchScheduler(handler, max_batch=1)
+        pending = asyncio.ensure_future(scheduler.submit("x"))
+        await asyncio.sleep(0)
+        gc.collect()
+
+        assert len(scheduler._tasks) == 1
+        release.set()
+        assert await asyncio.wait_for(pending, timeout=1) == "x"
+        await asyncio.sleep(0)
+        assert scheduler._tasks == set()
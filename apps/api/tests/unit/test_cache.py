@@ -4,6 +4,7 @@ Unit тесты для системы кеширования.
 import pytest
 import asyncio
 from datetime import datetime, timedelta
+import numpy as np
 
 from app.core.cache import InMemoryCache, OllamaCacheService, CacheEntry
 
@@ -206,6 +207,64 @@ class TestOllamaCacheService:
         assert ollama_cache.get_cached_response("persona_response", user_input="вопрос2") == "ответ2"
         assert ollama_cache.get_cached_response("classification", user_input="вопрос1") == "ответ3"
 
+    
+    def test_similar_response_hit(self):
+        """Тест семантического попадания по близкому эмбеддингу."""
+        cache = InMemoryCache()
+        ollama_cache = OllamaCacheService(cache)
+        
+        ollama_cache.cache_response(
+            "analysis", {"summary": "итог"}, user_input="встреча 1", embedding=[1.0, 0.0, 0.0]
+        )
+        
+        assert ollama_cache.get_similar_response("analysis", [0.99, 0.05, 0.0]) == {"summary": "итог"}
+        assert ollama_cache.get_similar_response("analysis", [0.0, 1.0, 0.0]) is None
+        assert ollama_cache.get_similar_response("task_intent", [1.0, 0.0, 0.0]) is None
+        assert next(iter(ollama_cache._embeddings[("analysis", "")].values())).dtype == np.float16
+    
+    def test_similar_response_skips_expired(self):
+        """Тест что истекшие записи не возвращаются по эмбеддингу."""
+        cache = InMemoryCache()
+        ollama_cache = OllamaCacheService(cache)
+        ollama_cache.ttl_config["analysis"] = 0
+        
+        ollama_cache.cache_response("analysis", "старый", user_input="x", embedding=[1.0, 0.0])
+        
+        import time
+        time.sleep(0.001)
+        
+        assert ollama_cache.get_similar_response("analysis", [1.0, 0.0]) is None
+        assert ("analysis", "") not in ollama_cache._embeddings
+    
+    def test_similar_response_respects_scope(self):
+        """Тест что приближенный поиск не выходит за пределы scope."""
+        cache = InMemoryCache()
+        ollama_cache = OllamaCacheService(cache)
+        
+        ollama_cache.cache_response(
+            "persona_response", "ответ", user_input="привет", embedding=[1.0, 0.0], scope="ctx1"
+        )
+        
+        assert ollama_cache.get_similar_response("persona_response", [1.0, 0.0], scope="ctx1") == "ответ"
+        assert ollama_cache.get_similar_response("persona_response", [1.0, 0.0], scope="ctx2") is None
+    
+    def test_embeddings_bounded_by_cache_size(self):
+        """Тест что эмбеддинги удаляются вместе с вытесненными записями, а пустые scope — целиком."""
+        cache = InMemoryCache(max_size=100)
+        ollama_cache = OllamaCacheService(cache)
+        
+        for i in range(1000):
+            ollama_cache.cache_response(
+                "persona_response", f"ответ {i}", user_input=f"вопрос {i}", embedding=[1.0, 0.0], scope=f"ctx{i}"
+            )
+        
+        assert len(ollama_cache._embeddings) == 100
+        assert sum(len(vectors) for vectors in ollama_cache._embeddings.values()) == 100
+        assert ollama_cache.get_similar_response("persona_response", [1.0, 0.0], scope="ctx999") == "ответ 999"
+        
+        cache.clear()
+        assert ollama_cache._embeddings == {}
+
 
 @pytest.mark.asyncio
 class TestCacheIntegration:
@@ -0,0 +1,105 @@
+"""
+Unit тесты для ContextLoader.
+"""
+import pytest
+
+from app.services.context_loader import ContextLoader
+
+
+class TestGlossaryHead:
+    """Тесты для отрендеренного фрагмента глоссария."""
+
+    @pytest.fixture
+    def loader(self, tmp_path):
+        loader = ContextLoader(data_dir=str(tmp_path))
+        loader.glossary = {"API": "Интерфейс", "SLA": "Уровень сервиса", "KPI": "Метрика"}
+        return loader
+
+    def test_glossary_head_renders_limit(self, loader):
+        """Тест рендеринга первых терминов."""
+        assert loader.get_glossary_head(2) == "- API: Интерфейс\n- SLA: Уровень сервиса\n"
+
+    def test_glossary_head_follows_glossary(self, loader):
+        """Тест что текст отражает текущий глоссарий."""
+        loader.get_glossary_head(2)
+        loader.glossary = {"NEW": "Новый термин"}
+
+        assert loader.get_glossary_head(2) == "- NEW: Новый термин\n"
+
+    def test_glossary_head_shared_across_instances(self, loader, tmp_path, monkeypatch):
+        """Тест что новый загрузчик с тем же глоссарием берет текст из общего кеша."""
+        from collections import OrderedDict
+        from app.services import context_loader
+
+        monkeypatch.setattr(context_loader, "_glossary_heads", OrderedDict())
+        head = loader.get_glossary_head(2)
+
+        other = ContextLoader(data_dir=str(tmp_path))
+        other.glossary = {"API": "Интерфейс", "SLA": "Уровень сервиса", "KPI": "Метрика"}
+        monkeypatch.setattr(context_loader, "islice", None)
+
+        assert other.get_glossary_head(2) == head
+        assert len(context_loader._glossary_heads) == 1
+
+
+class TestFingerprint:
+    """Тесты для отпечатка загруженных данных."""
+
+    def test_same_data_same_fingerprint(self, tmp_path):
+        """Тест что загрузчики с одинаковыми данными дают один отпечаток, а изменения его меняют."""
+        first = ContextLoader(data_dir=str(tmp_path))
+        second = ContextLoader(data_dir=str(tmp_path))
+        assert first.fingerprint == second.fingerprint
+
+        second.glossary = {"API": "Интерфейс"}
+        second._build_lookup_maps()
+        assert second.fingerprint != first.fingerprint
+
+
+class TestEntityRendering:
+    """Тесты для отрендеренных описаний людей и проектов."""
+
+    @pytest.fixture
+    def loader(self, tmp_path):
+        return ContextLoader(data_dir=str(tmp_path))
+
+    def test_render_people(self, loader):
+        """Тест формата описания людей."""
+        people = [
+            {"name": "Иван", "telegram_username": "ivan", "role": "PM", "context": "Ведет релизы", "aliases": ["Ваня"]},
+            {"name": "Мария"}
+        ]
+
+        assert loader.render_people(people) == "- Иван (@ivan) - PM: Ведет релизы (также: Ваня)\n- Мария"
+
+    def test_render_projects(self, loader):
+        """Тест формата описания проектов."""
+        project = {"key": "ALPHA", "name": "Альфа", "status": "Active"}
+
+        assert loader.render_projects([project]) == "- Альфа (ALPHA) [Статус: Active]"
+
+        project["status"] = "Done"
+        assert loader.render_projects([project]) == "- Альфа (ALPHA) [Статус: Done]"
+
+
+class TestFindInText:
+    """Тесты для точного поиска сущностей по готовым индексам."""
+
+    @pytest.fixture
+    def loader(self, tmp_path):
+        loader = ContextLoader(data_dir=str(tmp_path))
+        loader.people = {"ivan": {"name": "Иван", "aliases": ["Ваня"]}}
+        loader.projects = [{"key": "ALPHA", "name": "Альфа", "keywords": ["альфа"]}]
+        loader._build_lookup_maps()
+        return loader
+
+    def test_finds_people_and_projects_without_sync(self, loader, monkeypatch):
+        """Тест что поиск не дублирует сущности и не ходит в Notion."""
+        async def fail_sync():
+            raise AssertionError("синхронизация не ожидалась")
+
+        monkeypatch.setattr(loader, "ensure_notion_sync", fail_sync)
+
+        assert loader.find_people_in_text("Ваня и Иван обсудили Альфа") == [loader.people["ivan"]]
+        assert loader.find_projects_in_text("Ваня и Иван обсудили Альфа") == [loader.projects[0]]
+        assert loader.find_people_in_text("никого") == []
@@ -0,0 +1,1141 @@
+"""
+Unit тесты для OllamaService.
+"""
+import pytest
+import asyncio
+
+from app.services.ollama_service import OllamaService, _extract_text, _extract_json, _TRAILING_COMMA_RE, _JsonEndScanner, _content_key, _clean_persona_text
+
+
+class ConcurrencyProbe:
+    """Считает, сколько вызовов одновременно находятся внутри run."""
+
+    def __init__(self):
+        self.in_flight = 0
+        self.peak = 0
+
+    async def run(self, result=None, delay=0.01):
+        """Держит вызов открытым delay секунд и возвращает result."""
+        self.in_flight += 1
+        self.peak = max(self.peak, self.in_flight)
+        try:
+            await asyncio.sleep(delay)
+        finally:
+            self.in_flight -= 1
+        return result
+
+
+@pytest.fixture(autouse=True)
+def fresh_entities_cache(monkeypatch):
+    """Изолирует общий LRU блоков сущностей между тестами."""
+    from collections import OrderedDict
+    from app.services import ollama_service
+
+    monkeypatch.setattr(ollama_service, "_known_entities", OrderedDict())
+
+
+@pytest.fixture
+def concurrency_probe():
+    return ConcurrencyProbe()
+
+
+@pytest.fixture
+def parallel_limit(monkeypatch):
+    """Задает ollama_num_parallel и сбрасывает общие семафоры хостов."""
+    from app.config import get_settings
+    from app.services import ollama_service
+
+    def set_limit(limit: int):
+        settings = get_settings().model_copy(update={"ollama_num_parallel": limit})
+        monkeypatch.setattr(ollama_service, "get_settings", lambda: settings)
+        monkeypatch.setattr(ollama_service, "_parallel_semaphores", {})
+
+    return set_limit
+
+
+class TestExtractText:
+    """Тесты для извлечения текста из ответа Ollama."""
+
+    def test_typed_response(self):
+        """Тест типизированного ChatResponse."""
+        from ollama import ChatResponse
+
+        response = ChatResponse(message={"role": "assistant", "content": "ответ"})
+        assert _extract_text(response) == "ответ"
+
+    def test_dict_response(self):
+        """Тест ответа в виде словаря."""
+        assert _extract_text({"message": {"content": "ответ"}}) == "ответ"
+        assert _extract_text({"response": "ответ"}) == "ответ"
+
+    def test_unknown_response(self):
+        """Тест неизвестного формата ответа."""
+        assert _extract_text(object()) == ""
+        assert _extract_text({"message": None}) == ""
+
+
+class TestTrailingCommas:
+    """Тесты для удаления висячих запятых из JSON ответа."""
+
+    def test_removes_trailing_commas(self):
+        """Тест удаления запятых перед } и ] за один проход."""
+        text = '{"items": [1, 2, ], "name": "x",\n}'
+        assert _TRAILING_COMMA_RE.sub(r'\1', text) == '{"items": [1, 2], "name": "x"}'
+
+    def test_extract_json_strips_fences(self):
+        """Тест снятия обрамления ```json и висячих запятых одним хелпером."""
+        assert _extract_json('```json\n{"a": [1,],}\n```') == '{"a": [1]}'
+        assert _extract_json('```\n{"a": 1}```') == '{"a": 1}'
+        assert _extract_json(' {"a": 1} ') == '{"a": 1}'
+
+
+class TestTruncateInput:
+    """Тесты для обрезки входа модели."""
+
+    def test_truncates_by_tokens_when_tokenizer_available(self, monkeypatch):
+        """Тест обрезки по токенам с токенизатором и по символам без него."""
+        from app.services import ollama_service
+
+        class Tokenizer:
+            def encode(self, text, add_special_tokens=False):
+                return text.split()
+
+            def decode(self, ids):
+                return " ".join(ids)
+
+        monkeypatch.setattr(ollama_service, "_tokenizer", lambda: None)
+        assert ollama_service._truncate_input("раз два три", max_tokens=2, max_chars=5) == "раз д"
+
+        monkeypatch.setattr(ollama_service, "_tokenizer", lambda: Tokenizer())
+        assert ollama_service._truncate_input("раз два три", max_tokens=2, max_chars=5) == "раз два"
+        assert ollama_service._truncate_input("раз два", max_tokens=2, max_chars=5) == "раз два"
+
+
+class TestCleanPersonaText:
+    """Тесты для очистки ответа персоны."""
+
+    def test_strips_echoed_prefixes(self):
+        """Тест удаления повторенных из промпта префиксов только в начале ответа."""
+        assert _clean_persona_text("  ТВОЙ ОТВЕТ: Ответ: Работаю. ") == "Работаю."
+        assert _clean_persona_text("ТВОЙ ОТВЕТ (кратко, по-человечески): Ок") == "Ок"
+        assert _clean_persona_text("Ну. Ответ: нет") == "Ну. Ответ: нет"
+
+
+class TestJsonEndScanner:
+    """Тесты для поиска конца JSON в потоке."""
+
+    def test_detects_end_across_chunks(self):
+        """Тест закрытия JSON, пришедшего несколькими фрагментами."""
+        scanner = _JsonEndScanner()
+        assert not scanner.feed('```json\n{"a": [1, ')
+        assert not scanner.feed('{"b": 2}]')
+        assert scanner.feed(', "c": 3}\n```')
+
+    def test_ignores_brackets_in_strings(self):
+        """Тест что скобки и экранированные кавычки внутри строк не считаются."""
+        scanner = _JsonEndScanner()
+        assert not scanner.feed('{"text": "} ] \\" }"')
+        assert scanner.feed('}')
+
+
+class TestContentKey:
+    """Тесты для ключа кеша по содержимому."""
+
+    def test_key_is_stable_and_short(self):
+        """Тест что ключ детерминирован, короток и различает тексты."""
+        content = "транскрипция " * 500
+        assert _content_key(content) == _content_key(content)
+        assert len(_content_key(content)) == 32
+        assert _content_key(content) != _content_key(content + ".")
+
+
+class TestFallbackResponse:
+    """Тесты для fallback-ответов при сбое LLM."""
+
+    def test_category_by_keywords(self):
+        """Тест выбора ответа по категории ключевых слов."""
+        from app.services.ollama_service import FALLBACK_RESPONSES
+
+        service = OllamaService()
+
+        assert service._get_fallback_response("Создай подзадачу на завтра") in FALLBACK_RESPONSES["task"]
+        assert service._get_fallback_response("Обработай встречу") in FALLBACK_RESPONSES["meeting"]
+        assert service._get_fallback_response("ты работаешь? нужно кое-что") in FALLBACK_RESPONSES["ping"]
+        assert service._get_fallback_response("ну привет") in FALLBACK_RESPONSES["default"]
+
+
+class TestSharedClient:
+    """Тесты для общего клиента Ollama."""
+
+    def test_instances_share_client(self):
+        """Тест что экземпляры сервиса переиспользуют один пул соединений."""
+        assert OllamaService().client is OllamaService().client
+
+    def test_httpx_fallback_keeps_connections_alive(self, monkeypatch):
+        """Тест что без aiohttp используется AsyncClient с таймаутом подключения и keep-alive пулом."""
+        from ollama import AsyncClient
+        from app.services import ollama_service
+
+        monkeypatch.setattr(ollama_service, "AIOHTTP_AVAILABLE", False)
+        monkeypatch.setattr(ollama_service, "_ollama_clients", {})
+
+        client = ollama_service.get_ollama_client("http://ollama-test:11434")
+
+        assert isinstance(client, AsyncClient)
+        assert client._client.timeout.connect == ollama_service.OLLAMA_CONNECT_TIMEOUT_SEC
+        assert client._client.timeout.read is None
+
+
+class TestAiohttpClient:
+    """Тесты для aiohttp-клиента Ollama."""
+
+    @pytest.mark.parametrize("use_orjson", [True, False])
+    def test_json_roundtrip(self, monkeypatch, use_orjson):
+        """Тест сериализации тела запроса с orjson и без него."""
+        from app.services import ollama_service
+
+        monkeypatch.setattr(ollama_service, "ORJSON_AVAILABLE", use_orjson and ollama_service.orjson is not None)
+        payload = {"model": "qwen", "messages": [{"role": "user", "content": "Привет"}], "stream": False}
+
+        data = ollama_service._json_dumps(payload)
+
+        assert isinstance(data, bytes)
+        assert ollama_service._json_loads(data) == payload
+
+    def test_session_per_loop_closed(self):
+        """Тест что сессия закрытого event loop закрывается при смене loop, а close() закрывает остальные."""
+        from app.services.ollama_service import _OllamaAiohttpClient
+
+        client = _OllamaAiohttpClient("http://localhost:11434")
+
+        async def session():
+            return client._get_session()
+
+        first = asyncio.run(session())
+
+        async def second_loop():
+            second = client._get_session()
+            assert client._get_session() is second
+            await asyncio.sleep(0)
+            await client.close()
+            return second
+
+        second = asyncio.run(second_loop())
+
+        assert first is not second
+        assert first.closed and second.closed
+        assert client._sessions == {}
+
+    def test_stale_close_failure_is_consumed(self):
+        """Тест что ошибка закрытия сессии завершенного loop логируется и не остается невостребованной."""
+        from app.services.ollama_service import _OllamaAiohttpClient
+
+        class BrokenSession:
+            closed = False
+
+            async def close(self):
+                raise RuntimeError("connector broken")
+
+        client = _OllamaAiohttpClient("http://localhost:11434")
+        stale_loop = asyncio.new_event_loop()
+        stale_loop.close()
+        client._sessions[stale_loop] = BrokenSession()
+
+        async def run():
+            client._get_session()
+            (task,) = client._closing
+            await asyncio.gather(task, return_exceptions=True)
+            await asyncio.sleep(0)
+            assert not client._closing
+            await client.close()
+
+        asyncio.run(run())
+
+    async def _serve(self, handler):
+        from aiohttp import web
+        from aiohttp.test_utils import TestServer
+
+        app = web.Application()
+        app.router.add_post("/api/chat", handler)
+        server = TestServer(app)
+        await server.start_server()
+        return server
+
+    @pytest.mark.asyncio
+    async def test_chat_and_stream(self):
+        """Тест обычного и стримингового ответа /api/chat."""
+        import json as json_lib
+        from aiohttp import web
+        from app.services.ollama_service import _OllamaAiohttpClient
+
+        async def handler(request):
+            payload = await request.json()
+            if not payload["stream"]:
+                return web.json_response({"message": {"role": "assistant", "content": payload["model"]}})
+            response = web.StreamResponse()
+            await response.prepare(request)
+            for piece in ["При", "вет"]:
+                await response.write((json_lib.dumps({"message": {"content": piece}}) + "\n").encode())
+            await response.write_eof()
+            return response
+
+        server = await self._serve(handler)
+        client = _OllamaAiohttpClient(str(server.make_url("")))
+        try:
+            response = await client.chat(model="qwen", messages=[{"role": "user", "content": "x"}])
+            stream = await client.chat(model="qwen", messages=[], stream=True)
+            pieces = [_extract_text(part) async for part in stream]
+        finally:
+            await client.close()
+            await server.close()
+
+        assert _extract_text(response) == "qwen"
+        assert pieces == ["При", "вет"]
+
+    @pytest.mark.asyncio
+    async def test_error_status_raises(self):
+        """Тест что HTTP-ошибка Ollama превращается в ResponseError."""
+        import ollama
+        from aiohttp import web
+        from app.services.ollama_service import _OllamaAiohttpClient
+
+        async def handler(request):
+            return web.json_response({"error": "model not found"}, status=404)
+
+        server = await self._serve(handler)
+        client = _OllamaAiohttpClient(str(server.make_url("")))
+        try:
+            with pytest.raises(ollama.ResponseError):
+                await client.chat(model="missing", messages=[])
+        finally:
+            await client.close()
+            await server.close()
+
+
+@pytest.mark.asyncio
+class TestSummarizeChunksBatch:
+    """Тесты для параллельной суммаризации чанков."""
+
+    async def test_batch_preserves_order(self):
+        """Тест сохранения порядка результатов."""
+        service = OllamaService()
+
+        async def fake_summarize(chunk_text, chunk_number, projects=None, people=None, terms=None):
+            # Первый чанк отвечает дольше остальных
+            await asyncio.sleep(0.02 if chunk_number == 1 else 0)
+            return f"{chunk_number}: {chunk_text}"
+
+        service.summarize_chunk_with_context = fake_summarize
+
+        result = await service.summarize_chunks_batch([("a", 1), ("b", 2), ("c", 3)])
+
+        assert result == ["1: a", "2: b", "3: c"]
+
+    async def test_parallel_limit_shared_across_instances(self, parallel_limit, concurrency_probe):
+        """Тест что лимит одновременных запросов общий для всех экземпляров сервиса."""
+        parallel_limit(2)
+
+        async def fake_summarize(chunk_text, chunk_number, projects=None, people=None, terms=None):
+            return await concurrency_probe.run(chunk_text)
+
+        services = [OllamaService(), OllamaService()]
+        for service in services:
+            service.summarize_chunk_with_context = fake_summarize
+
+        await asyncio.gather(*(service.summarize_chunks_batch([(str(i), i) for i in range(4)]) for service in services))
+
+        assert concurrency_probe.peak == 2
+        assert services[0].parallel_semaphore is services[1].parallel_semaphore
+
+
+@pytest.mark.asyncio
+class TestSemanticCache:
+    """Тесты для кеширования ответов LLM."""
+
+    async def test_embed_runs_off_event_loop(self):
+        """Тест что синхронный эмбеддер вызывается в отдельном потоке, а асинхронный — ожидается."""
+        import threading
+
+        threads = []
+
+        def sync_embedder(text):
+            threads.append(threading.current_thread())
+            return [1.0, 0.0]
+
+        async def async_embedder(text):
+            return [0.0, 1.0]
+
+        assert await OllamaService(embedder=sync_embedder)._embed("текст") == [1.0, 0.0]
+        assert threads and threads[0] is not threading.current_thread()
+        assert await OllamaService(embedder=async_embedder)._embed("текст") == [0.0, 1.0]
+
+    async def test_persona_exact_hit_skips_embedding(self):
+        """Тест что точное совпадение ответа персоны не считает эмбеддинг, а промах считает его один раз."""
+        from unittest.mock import AsyncMock, MagicMock
+        from app.core.cache import InMemoryCache, OllamaCacheService
+
+        embedder = MagicMock(return_value=[1.0, 0.0])
+        service = OllamaService(embedder=embedder)
+        service.cache = OllamaCacheService(InMemoryCache())
+        service.client = AsyncMock()
+        service.client.chat.return_value = {"message": {"content": "Работаю."}}
+
+        assert await service.generate_persona_response("работаешь?") == "Работаю."
+        assert embedder.call_count == 1
+
+        assert await service.generate_persona_response("работаешь?") == "Работаю."
+        assert [piece async for piece in service.generate_persona_response_stream("работаешь?")] == ["Работаю."]
+        assert embedder.call_count == 1
+        service.client.chat.assert_called_once()
+
+    async def test_task_intent_similar_request_not_served_from_cache(self):
+        """Тест что близкий, но не совпадающий запрос задачи идет в Ollama, а эмбеддинг не считается."""
+        from unittest.mock import AsyncMock, MagicMock
+        from app.core.cache import InMemoryCache, OllamaCacheService
+
+        embedder = MagicMock(return_value=[1.0, 0.0])
+        service = OllamaService(embedder=embedder)
+        service.cache = OllamaCacheService(InMemoryCache())
+        service.client = AsyncMock()
+        service.client.chat.return_value = {
+            "message": {"content": '{"intent": "Сделать отчет к понедельнику", "priority": "Medium"}'}
+        }
+
+        service.cache.cache_response(
+            "task_intent", {"intent": "Сделать отчет к пятнице"},
+            user_input=_content_key("сделать отчет к пятнице"), embedding=[1.0, 0.0]
+        )
+
+        result = await service.extract_task_intent("сделать отчет к понедельнику")
+
+        assert result["intent"] == "Сделать отчет к понедельнику"
+        service.client.chat.assert_called_once()
+        embedder.assert_not_called()
+
+    async def test_analysis_cache_hit_skips_validation(self):
+        """Тест что закешированный анализ возвращается без повторной валидации."""
+        from unittest.mock import AsyncMock
+        from app.core.cache import InMemoryCache, OllamaCacheService
+        from app.models.schemas import MeetingAnalysis
+
+        service = OllamaService()
+        service.cache = OllamaCacheService(InMemoryCache())
+        service.client = AsyncMock()
+
+        analysis = MeetingAnalysis(summary_md="Итог", participants=[{"name": "Иван"}])
+        service.cache.cache_response(
+            "analysis", analysis,
+            user_input=_content_key("текст встречи"), sender_username=None, schema="MeetingAnalysis"
+        )
+
+        trusted = await service.analyze_meeting("текст встречи", [], MeetingAnalysis)
+        revalidated = await service.analyze_meeting("текст встречи", [], MeetingAnalysis, trust_cache=False)
+
+        assert trusted is analysis
+        assert revalidated is not analysis
+        assert revalidated == analysis
+        service.client.chat.assert_not_called()
+
+    async def test_analysis_ignores_similar_meetings(self):
+        """Тест что анализ встречи с похожим началом не берется из кеша другой встречи."""
+        from unittest.mock import AsyncMock
+        from app.core.cache import InMemoryCache, OllamaCacheService
+        from app.models.schemas import MeetingAnalysis
+
+        service = OllamaService(embedder=lambda text: [1.0, 0.0])
+        service.cache = OllamaCacheService(InMemoryCache())
+        service.client = AsyncMock()
+        service.client.chat.return_value = {"message": {"content": '{"summary_md": "Вторник"}'}}
+
+        monday = MeetingAnalysis(summary_md="Понедельник")
+        service.cache.cache_response(
+            "analysis", monday,
+            user_input=_content_key("Всем привет, стендап. Понедельник"), sender_username=None,
+            schema="MeetingAnalysis", embedding=[1.0, 0.0], scope="None:MeetingAnalysis"
+        )
+
+        result = await service.analyze_meeting("Всем привет, стендап. Вторник", [], MeetingAnalysis)
+
+        assert result.summary_md == "Вторник"
+        assert service.client.chat.called
+
+
+@pytest.mark.asyncio
+class TestStreamingJson:
+    """Тесты для стримингового получения JSON."""
+
+    async def test_stops_reading_after_json_end(self):
+        """Тест что поток обрывается сразу после закрытия JSON."""
+        from unittest.mock import AsyncMock
+        from app.models.schemas import MeetingAnalysis
+
+        consumed = []
+
+        async def stream():
+            for piece in ['{"summary_md": ', '"Итог"}', '\n```', ' лишний хвост']:
+                consumed.append(piece)
+                yield {"message": {"content": piece}}
+
+        service = OllamaService()
+        service.client = AsyncMock()
+        service.client.chat.return_value = stream()
+
+        result = await service.generate_structured("промпт", MeetingAnalysis)
+
+        assert result.summary_md == "Итог"
+        assert service.client.chat.call_args.kwargs["format"] == MeetingAnalysis.model_json_schema()
+        assert "JSON схема" not in service.client.chat.call_args.kwargs["messages"][0]["content"]
+        assert consumed == ['{"summary_md": ', '"Итог"}']
+        assert service.client.chat.call_args.kwargs["stream"] is True
+
+    async def test_falls_back_to_non_streaming(self):
+        """Тест повтора без стриминга при ошибке стрима."""
+        from unittest.mock import AsyncMock
+
+        service = OllamaService()
+        service.client = AsyncMock()
+        service.client.chat.side_effect = [TypeError("stream not supported"), {"message": {"content": '{"a": 1}'}}]
+
+        text = await service._chat_json([{"role": "user", "content": "x"}], {})
+
+        assert text == '{"a": 1}'
+        assert "stream" not in service.client.chat.call_args.kwargs
+
+    async def test_transport_errors_not_retried_without_streaming(self):
+        """Тест что недоступный сервер и ошибки Ollama не дублируются запросом без стриминга."""
+        from unittest.mock import AsyncMock
+        import ollama
+
+        for error in (ConnectionRefusedError("refused"), ollama.ResponseError("model not found", 404)):
+            service = OllamaService()
+            service.client = AsyncMock()
+            service.client.chat.side_effect = error
+
+            with pytest.raises(type(error)):
+                await service._chat_json([{"role": "user", "content": "x"}], {})
+            assert service.client.chat.call_count == 1
+
+
+@pytest.mark.asyncio
+class TestSummarizeText:
+    """Тесты для суммаризации текста."""
+
+    async def test_repeated_text_uses_cache(self):
+        """Тест что повторная суммаризация того же текста не вызывает Ollama."""
+        from unittest.mock import AsyncMock
+        from app.core.cache import InMemoryCache, OllamaCacheService
+
+        service = OllamaService()
+        service.cache = OllamaCacheService(InMemoryCache())
+        service.client = AsyncMock()
+        service.client.chat.return_value = {"message": {"content": "кратко"}}
+
+        first = await service.summarize_text("длинный текст", max_length=50)
+        second = await service.summarize_text("длинный текст", max_length=50)
+
+        assert first == second == "кратко"
+        assert service.client.chat.call_count == 1
+
+    async def test_fallback_truncates_by_words(self):
+        """Тест что fallback обрезает текст по словам, а не по символам."""
+        from unittest.mock import AsyncMock
+        from app.core.cache import InMemoryCache, OllamaCacheService
+
+        service = OllamaService()
+        service.cache = OllamaCacheService(InMemoryCache())
+        service.client = AsyncMock()
+        service.client.chat.side_effect = RuntimeError("ollama down")
+
+        result = await service.summarize_text("один  два\nтри четыре", max_length=3)
+
+        assert result == "один два три..."
+
+
+@pytest.mark.asyncio
+class TestExtractTaskIntent:
+    """Тесты для извлечения intent задачи."""
+
+    async def test_uses_schema_constrained_output(self):
+        """Тест что схема передается в format= и ответ кешируется по исходному тексту."""
+        from unittest.mock import AsyncMock
+        from app.core.cache import InMemoryCache, OllamaCacheService
+        from app.models.schemas import TaskExtraction
+
+        service = OllamaService()
+        service.cache = OllamaCacheService(InMemoryCache())
+        service.client = AsyncMock()
+        service.client.chat.return_value = {
+            "message": {"content": '{"intent": "Сделать отчет", "priority": "High"}'}
+        }
+
+        first = await service.extract_task_intent("сделать отчет срочно")
+        second = await service.extract_task_intent("сделать отчет срочно")
+
+        kwargs = service.client.chat.call_args.kwargs
+        assert kwargs["format"] == TaskExtraction.model_json_schema()
+        assert "JSON схема" not in kwargs["messages"][1]["content"]
+        assert first == second
+        assert first["intent"] == "Сделать отчет"
+        assert service.client.chat.call_count == 1
+
+    async def test_concurrent_duplicates_coalesced(self):
+        """Тест что одновременные одинаковые запросы делят один вызов Ollama, а результаты не общие."""
+        from unittest.mock import AsyncMock
+        from app.core.cache import InMemoryCache, OllamaCacheService
+
+        async def slow_chat(**kwargs):
+            await asyncio.sleep(0.01)
+            return {"message": {"content": '{"intent": "Созвониться", "priority": "Low"}'}}
+
+        service = OllamaService()
+        service.cache = OllamaCacheService(InMemoryCache())
+        service.client = AsyncMock()
+        service.client.chat.side_effect = slow_chat
+
+        results = await asyncio.gather(*(service.extract_task_intent("созвониться с Петром") for _ in range(3)))
+
+        assert service.client.chat.call_count == 1
+        assert all(r["intent"] == "Созвониться" for r in results)
+        results[0]["intent"] = "изменено"
+        assert results[1]["intent"] == "Созвониться"
+
+
+
+@pytest.mark.asyncio
+class TestAnalyzeMeetingRetry:
+    """Тесты для повторов analyze_meeting."""
+
+    async def test_malformed_json_retried_quickly(self):
+        """Тест что битый JSON перегенерируется без долгой паузы."""
+        import time
+        from unittest.mock import AsyncMock
+        from app.core.cache import InMemoryCache, OllamaCacheService
+        from app.models.schemas import MeetingAnalysis
+
+        replies = iter(['{"summary_md": ', '{"summary_md": "Итог"}'])
+
+        calls = 0
+
+        async def chat(**kwargs):
+            nonlocal calls
+            calls += 1
+            reply = next(replies)
+
+            async def stream():
+                yield {"message": {"content": reply}}
+            return stream()
+
+        service = OllamaService()
+        service.cache = OllamaCacheService(InMemoryCache())
+        service.client = AsyncMock()
+        service.client.chat.side_effect = chat
+
+        started = time.monotonic()
+        result = await service.analyze_meeting("текст встречи", [], MeetingAnalysis)
+
+        assert result.summary_md == "Итог"
+        assert calls == 2
+        assert time.monotonic() - started < 2
+
+    async def test_retry_wait_does_not_block_event_loop(self):
+        """Тест что пауза между повторами — asyncio.sleep: другие корутины выполняются во время ожидания."""
+        from unittest.mock import AsyncMock
+        from app.core.cache import InMemoryCache, OllamaCacheService
+        from app.models.schemas import MeetingAnalysis
+
+        replies = iter(['{"summary_md": ', '{"summary_md": "Итог"}'])
+
+        async def chat(**kwargs):
+            reply = next(replies)
+
+            async def stream():
+                yield {"message": {"content": reply}}
+            return stream()
+
+        service = OllamaService()
+        service.cache = OllamaCacheService(InMemoryCache())
+        service.client = AsyncMock()
+        service.client.chat.side_effect = chat
+
+        ticks = 0
+
+        async def ticker():
+            nonlocal ticks
+            while True:
+                await asyncio.sleep(0.01)
+                ticks += 1
+
+        ticker_task = asyncio.ensure_future(ticker())
+        try:
+            await service.analyze_meeting("текст встречи", [], MeetingAnalysis)
+        finally:
+            ticker_task.cancel()
+
+        assert ticks > 0
+
+    async def test_retry_keeps_known_entities(self):
+        """Тест что при повторе в промпт снова попадают известные сущности."""
+        from unittest.mock import AsyncMock, MagicMock
+        from app.core.cache import InMemoryCache, OllamaCacheService
+        from app.models.schemas import MeetingAnalysis
+
+        replies = iter(['{"summary_md": ', '{"summary_md": "Итог"}'])
+
+        async def chat(**kwargs):
+            reply = next(replies)
+
+            async def stream():
+                yield {"message": {"content": reply}}
+            return stream()
+
+        context_loader = MagicMock()
+        context_loader.glossary = {}
+        context_loader.fingerprint = "v1"
+        context_loader.ensure_notion_sync = AsyncMock()
+        context_loader.resolve_entity = AsyncMock(return_value={"people": [{"name": "Анна"}], "projects": []})
+        context_loader.render_people.return_value = "- Анна"
+
+        service = OllamaService(context_loader=context_loader)
+        service.cache = OllamaCacheService(InMemoryCache())
+        service.client = AsyncMock()
+        service.client.chat.side_effect = chat
+
+        await service.analyze_meeting("Анна покажет демо", [], MeetingAnalysis)
+
+        # Повтор берет блок сущностей из общего LRU
+        assert context_loader.resolve_entity.await_count == 1
+        system_prompt = service.client.chat.call_args.kwargs["messages"][0]["content"]
+        assert "Известные люди из команды:\n- Анна" in system_prompt
+
+    async def test_known_entities_shared_across_instances(self):
+        """Тест что блок сущностей встречи переиспользуется новым загрузчиком с теми же данными."""
+        from unittest.mock import AsyncMock, MagicMock
+
+        def make_loader():
+            loader = MagicMock()
+            loader.glossary = {"API": "Интерфейс"}
+            loader.fingerprint = "v1"
+            loader.ensure_notion_sync = AsyncMock()
+            loader.resolve_entity = AsyncMock(return_value={"people": [{"name": "Анна"}], "projects": []})
+            loader.render_people.return_value = "- Анна"
+            loader.get_glossary_head.return_value = "- API: Интерфейс\n"
+            return loader
+
+        first, second = make_loader(), make_loader()
+        first_service = OllamaService(context_loader=first)
+        second_service = OllamaService(context_loader=second)
+
+        block = await first_service._resolved_entities("meeting", "Анна и API", first_service._render_meeting_entities)
+        again = await second_service._resolved_entities("meeting", "Анна и API", second_service._render_meeting_entities)
+        task = await second_service._resolved_entities("task", "Анна и API", second_service._render_task_entities)
+
+        assert again == block and "- API: Интерфейс" in block
+        second.ensure_notion_sync.assert_awaited()
+        second.get_glossary_head.assert_not_called()
+        assert first.resolve_entity.await_count == 1
+        assert second.resolve_entity.await_count == 1
+        assert task != block
+
+
+@pytest.mark.asyncio
+class TestAnalyzeMeetingsBatch:
+    """Тесты для параллельного анализа встреч."""
+
+    async def test_results_in_order_with_errors_in_place(self):
+        """Тест что результаты идут в порядке входа, а ошибка одной встречи не роняет остальные."""
+        from unittest.mock import AsyncMock
+
+        async def analyze(content, **kwargs):
+            await asyncio.sleep(0.01 if content == "первая" else 0)
+            if content == "битая":
+                raise ValueError("пустой ответ")
+            return content.upper()
+
+        service = OllamaService()
+        service.analyze_meeting = AsyncMock(side_effect=analyze)
+
+        results = await service.analyze_meetings_batch(
+            [{"content": c, "context": [], "response_schema": None} for c in ("первая", "битая", "третья")]
+        )
+
+        assert results[0] == "ПЕРВАЯ" and results[2] == "ТРЕТЬЯ"
+        assert isinstance(results[1], ValueError)
+
+    async def test_respects_parallel_limit(self, parallel_limit, concurrency_probe):
+        """Тест что одновременно анализируется не больше ollama_num_parallel встреч."""
+        parallel_limit(2)
+
+        async def analyze(content, **kwargs):
+            return await concurrency_probe.run(content)
+
+        service = OllamaService()
+        service.analyze_meeting = analyze
+
+        results = await service.analyze_meetings_batch([{"content": str(i)} for i in range(5)])
+
+        assert results == [str(i) for i in range(5)]
+        assert concurrency_probe.peak == 2
+
+
+@pytest.mark.asyncio
+class TestPersonaParallelLimit:
+    """Тесты для ограничения параллельных ответов персоны."""
+
+    async def test_concurrent_requests_bounded_across_instances(self, parallel_limit, concurrency_probe):
+        """Тест что ответы персоны из разных экземпляров сервиса делят один лимит ollama_num_parallel."""
+        from unittest.mock import AsyncMock
+        from app.core.cache import InMemoryCache, OllamaCacheService
+
+        parallel_limit(1)
+
+        async def chat(**kwargs):
+            return await concurrency_probe.run({"message": {"content": "Работаю."}})
+
+        services = []
+        for _ in range(3):
+            service = OllamaService()
+            service.cache = OllamaCacheService(InMemoryCache())
+            service.client = AsyncMock()
+            service.client.chat.side_effect = chat
+            services.append(service)
+
+        results = await asyncio.gather(
+            *(service.generate_persona_response(f"вопрос {i}") for i, service in enumerate(services))
+        )
+
+        assert results == ["Работаю."] * 3
+        assert concurrency_probe.peak == 1
+
+    async def test_streams_share_limit_with_regular_requests(self, parallel_limit, concurrency_probe):
+        """Тест что стримы персоны занимают тот же лимит, что и обычные ответы."""
+        from unittest.mock import AsyncMock
+        from app.core.cache import InMemoryCache, OllamaCacheService
+
+        parallel_limit(1)
+
+        async def chat(stream=False, **kwargs):
+            if not stream:
+                return await concurrency_probe.run({"message": {"content": "Работаю."}})
+
+            async def pieces():
+                concurrency_probe.in_flight += 1
+                concurrency_probe.peak = max(concurrency_probe.peak, concurrency_probe.in_flight)
+                try:
+                    for piece in ["Стри", "млю."]:
+                        await asyncio.sleep(0.01)
+                        yield {"message": {"content": piece}}
+                finally:
+                    concurrency_probe.in_flight -= 1
+            return pieces()
+
+        service = OllamaService()
+        service.cache = OllamaCacheService(InMemoryCache())
+        service.client = AsyncMock()
+        service.client.chat.side_effect = chat
+
+        async def collect(user_input):
+            return "".join([piece async for piece in service.generate_persona_response_stream(user_input)])
+
+        results = await asyncio.gather(
+            collect("стрим 1"), collect("стрим 2"), service.generate_persona_response("обычный вопрос")
+        )
+
+        assert results == ["Стримлю.", "Стримлю.", "Работаю."]
+        assert concurrency_probe.peak == 1
+
+
+@pytest.mark.asyncio
+class TestPersonaStream:
+    """Тесты для стриминга ответа персоны."""
+
+    async def test_stream_cleans_short_answer_and_caches_result(self):
+        """Тест что у короткого ответа убирается префикс, а полный ответ кешируется."""
+        from unittest.mock import AsyncMock
+        from app.core.cache import InMemoryCache, OllamaCacheService
+
+        async def stream():
+            for piece in ["Ответ: Ра", "ботаю.", ""]:
+                yield {"message": {"content": piece}}
+
+        service = OllamaService()
+        service.cache = OllamaCacheService(InMemoryCache())
+        service.client = AsyncMock()
+        service.client.chat.return_value = stream()
+
+        pieces = [piece async for piece in service.generate_persona_response_stream("работаешь?")]
+
+        assert pieces == ["Работаю."]
+        assert await service.generate_persona_response("работаешь?") == "Работаю."
+        assert service.client.chat.call_count == 1
+
+    async def test_stream_strips_prefix_and_fits_length(self):
+        """Тест что длинный стрим отдается по словам без префикса и обрезается как обычный ответ."""
+        from unittest.mock import AsyncMock
+        from app.core.cache import InMemoryCache, OllamaCacheService
+        from app.services.ollama_service import _fit_length
+
+        words = ["ТВОЙ ОТВЕТ (кратко, по-человечески): "] + [f"слово{i} " for i in range(40)]
+
+        async def stream():
+            for piece in words:
+                yield {"message": {"content": piece}}
+
+        service = OllamaService()
+        service.cache = OllamaCacheService(InMemoryCache())
+        service.client = AsyncMock()
+        service.client.chat.return_value = stream()
+
+        pieces = [piece async for piece in service.generate_persona_response_stream("расскажи", max_length=60)]
+
+        assert len(pieces) > 1
+        assert "".join(pieces) == _fit_length("".join(words[1:]).strip(), 60)
+        assert service.cache.get_cached_response("persona_response", user_input="расскажи", context="") is None
+
+    async def test_stream_falls_back_on_error(self):
+        """Тест fallback-ответа, если стрим упал до первого фрагмента."""
+        from unittest.mock import AsyncMock
+        from app.core.cache import InMemoryCache, OllamaCacheService
+
+        service = OllamaService()
+        service.cache = OllamaCacheService(InMemoryCache())
+        service.client = AsyncMock()
+        service.client.chat.side_effect = RuntimeError("ollama down")
+
+        pieces = [piece async for piece in service.generate_persona_response_stream("работаешь?")]
+
+        assert len(pieces) == 1
+        assert pieces[0]
+
+    async def test_similar_question_served_from_cache(self):
+        """Тест что близкий по смыслу вопрос с тем же контекстом берется из кеша."""
+        from unittest.mock import AsyncMock
+        from app.core.cache import InMemoryCache, OllamaCacheService
+
+        vectors = {"ты работаешь?": [1.0, 0.0], "работаешь?": [0.99, 0.02], "что по дедлайнам?": [0.0, 1.0]}
+        service = OllamaService(embedder=lambda text: vectors[text])
+        service.cache = OllamaCacheService(InMemoryCache())
+        service.client = AsyncMock()
+        service.client.chat.return_value = {"message": {"content": "Работаю."}}
+
+        assert await service.generate_persona_response("ты работаешь?") == "Работаю."
+        assert await service.generate_persona_response("работаешь?") == "Работаю."
+        assert service.client.chat.call_count == 1
+
+        await service.generate_persona_response("работаешь?", context="другой контекст")
+        assert service.client.chat.call_count == 2
+
+    async def test_prompt_prefix_is_stable(self):
+        """Тест что переменные части промпта идут после неизменного префикса."""
+        from unittest.mock import AsyncMock, MagicMock
+        from app.core.cache import InMemoryCache, OllamaCacheService
+        from app.services.ollama_service import PERSONA_PROMPT_PREFIX
+
+        context_loader = MagicMock()
+        context_loader.find_people_in_text.return_value = [{"name": "Петр"}, {"name": "Анна"}]
+        context_loader.find_projects_in_text.return_value = []
+        context_loader.render_people.side_effect = lambda people: "\n".join(p["name"] for p in people)
+
+        service = OllamaService(context_loader=context_loader)
+        service.cache = OllamaCacheService(InMemoryCache())
+        service.client = AsyncMock()
+        service.client.chat.return_value = {"message": {"content": "Ок."}}
+
+        await service.generate_persona_response("Анна и Петр", max_length=100)
+        await service.generate_persona_response("Петр и Анна", max_length=300)
+
+        prompts = [call.kwargs["messages"][0]["content"] for call in service.client.chat.call_args_list]
+        assert all(prompt.startswith(PERSONA_PROMPT_PREFIX) for prompt in prompts)
+        assert "Люди:\nАнна\nПетр" in prompts[0]
+        assert "до 100 символов" in prompts[0] and "до 300 символов" in prompts[1]
+        context_loader.resolve_entity.assert_not_called()
+
+    async def test_known_entities_shared_across_instances(self):
+        """Тест что блок сущностей персоны переиспользуется загрузчиками с теми же данными."""
+        from unittest.mock import MagicMock
+
+        def make_loader(fingerprint):
+            loader = MagicMock()
+            loader.fingerprint = fingerprint
+            loader.find_people_in_text.return_value = [{"name": "Петр"}]
+            loader.find_projects_in_text.return_value = []
+            loader.render_people.side_effect = lambda people: "\n".join(p["name"] for p in people)
+            return loader
+
+        first, second, changed = make_loader("v1"), make_loader("v1"), make_loader("v2")
+
+        block = OllamaService(context_loader=first)._build_known_entities("где Петр?")
+        assert OllamaService(context_loader=second)._build_known_entities("где Петр?") == block
+        OllamaService(context_loader=changed)._build_known_entities("где Петр?")
+
+        assert "Петр" in block
+        assert first.find_people_in_text.call_count == 1
+        second.find_people_in_text.assert_not_called()
+        assert changed.find_people_in_text.call_count == 1
+
+    async def test_known_entities_cache_bounded(self, monkeypatch):
+        """Тест что LRU блоков сущностей не растет больше лимита."""
+        from unittest.mock import MagicMock
+        from app.services import ollama_service
+
+        monkeypatch.setattr(ollama_service, "KNOWN_ENTITIES_CACHE_SIZE", 2)
+        loader = MagicMock()
+        loader.fingerprint = "v1"
+        loader.find_people_in_text.return_value = []
+        loader.find_projects_in_text.return_value = []
+        service = OllamaService(context_loader=loader)
+
+        for text in ("раз", "два", "три"):
+            service._build_known_entities(text)
+
+        assert len(ollama_service._known_entities) == 2
+        service._build_known_entities("раз")
+        assert loader.find_people_in_text.call_count == 4
+
+    async def test_concurrent_identical_requests_coalesced(self):
+        """Тест что одновременные одинаковые запросы делают один вызов Ollama."""
+        from unittest.mock import AsyncMock
+        from app.core.cache import InMemoryCache, OllamaCacheService
+
+        async def slow_chat(**kwargs):
+            await asyncio.sleep(0.01)
+            return {"message": {"content": "Занят."}}
+
+        service = OllamaService()
+        service.cache = OllamaCacheService(InMemoryCache())
+        service.client = AsyncMock()
+        service.client.chat.side_effect = slow_chat
+
+        results = await asyncio.gather(*(service.generate_persona_response("ты где?") for _ in range(5)))
+
+        assert results == ["Занят."] * 5
+        assert service.client.chat.call_count == 1
+
+    async def test_cache_shared_across_max_length(self):
+        """Тест что max_length не дробит кеш, а длинный ответ укорачивается по границе слова."""
+        from unittest.mock import AsyncMock
+        from app.core.cache import InMemoryCache, OllamaCacheService
+
+        service = OllamaService()
+        service.cache = OllamaCacheService(InMemoryCache())
+        service.client = AsyncMock()
+        service.client.chat.return_value = {"message": {"content": "Созвон перенесли на завтра, детали в чате."}}
+
+        full = await service.generate_persona_response("что с созвоном?", max_length=200)
+        short = await service.generate_persona_response("что с созвоном?", max_length=20)
+
+        assert service.client.chat.call_count == 1
+        assert full == "Созвон перенесли на завтра, детали в чате."
+        assert short == "Созвон перенесли на"
+        assert await service.generate_persona_response("что с созвоном?", max_length=22) == "Созвон перенесли на"
+
+
+class TestAdaptiveNumPredict:
+    """Тесты для адаптивного лимита генерации."""
+
+    def test_uses_default_until_enough_samples(self):
+        """Тест что без статистики используется лимит по умолчанию, затем p95 с запасом."""
+        operation = "test_adaptive"
+        assert OllamaService._adaptive_num_predict(operation, default=800, cap=800) == 800
+
+        for tokens in range(100, 300, 10):
+            OllamaService._record_output_length(operation, tokens)
+
+        assert OllamaService._adaptive_num_predict(operation, default=800, cap=800) == int(280 * 1.2) + 1
+        assert OllamaService._adaptive_num_predict(operation, default=800, cap=200) == 200
+
+
+
+class TestFinalSummaryPrompt:
+    """Тесты для промпта финального саммари."""
+
+    def test_duplicate_chunks_collapsed(self):
+        """Тест что повторяющиеся саммари чанков попадают в промпт один раз."""
+        prompt = OllamaService._build_final_summary_prompt(
+            ["Обсуждение проекта X.", "  обсуждение  проекта x. ", "Решили выпустить релиз.", ""]
+        )
+
+        assert "Чанк 1: Обсуждение проекта X." in prompt
+        assert "Чанк 2: Решили выпустить релиз." in prompt
+        assert "Чанк 3" not in prompt
+
+    @pytest.mark.asyncio
+    async def test_stream_yields_summary_pieces(self, monkeypatch, parallel_limit):
+        """Тест что стрим отдает фрагменты саммари, держит слот хоста и запоминает длину ответа."""
+        from unittest.mock import AsyncMock
+        from app.services import ollama_service
+
+        parallel_limit(1)
+        monkeypatch.setattr(ollama_service, "_output_lengths", {})
+        service = OllamaService()
+        service.client = AsyncMock()
+
+        async def chat(**kwargs):
+            async def stream():
+                for piece in ("Обсудили ", "релиз."):
+                    assert service.parallel_semaphore.locked()
+                    yield {"message": {"content": piece}}
+            return stream()
+
+        service.client.chat.side_effect = chat
+
+        pieces = [piece async for piece in service.summarize_from_chunks_stream(["Чанк про релиз."])]
+
+        assert pieces == ["Обсудили ", "релиз."]
+        assert not service.parallel_semaphore.locked()
+        assert service.client.chat.call_args.kwargs["stream"] is True
+        assert len(ollama_service._output_lengths["summary_final"]) == 1
+
+    @pytest.mark.asyncio
+    async def test_stream_falls_back_to_chunks(self):
+        """Тест что при сбое до первого фрагмента отдаются склеенные чанки."""
+        from unittest.mock import AsyncMock
+
+        service = OllamaService()
+        service.client = AsyncMock()
+        service.client.chat.side_effect = ConnectionError("ollama down")
+
+        pieces = [piece async for piece in service.summarize_from_chunks_stream(["Первый.", "Второй."])]
+
+        assert pieces == ["Первый.\n\nВторой."]
+
+
+
+@pytest.mark.asyncio
+class TestWarmup:
+    """Тесты для прогрева моделей."""
+
+    async def test_warmup_each_model_once(self):
+        """Тест что каждая модель прогревается одним коротким запросом, ошибки не пробрасываются."""
+        from unittest.mock import AsyncMock
+
+        service = OllamaService()
+        service.model_name = "qwen3:8b"
+        service.persona_model = "qwen2.5:1.5b"
+        service.client = AsyncMock()
+        service.client.chat.side_effect = [{"message": {"content": "p"}}, Exception("down")]
+
+        assert await service.warmup() is False
+        models = [call.kwargs["model"] for call in service.client.chat.call_args_list]
+        assert models == ["qwen3:8b", "qwen2.5:1.5b"]
+        assert service.client.chat.call_args.kwargs["options"] == {"num_predict": 1}
+
+
+@pytest.mark.asyncio
+class TestPersonaModel:
+    """Тесты для выбора модели ответов персоны."""
+
+    async def test_persona_uses_configured_model(self):
+        """Тест что ответ персоны идет в отдельную модель, если она задана."""
+        from unittest.mock import AsyncMock
+        from app.core.cache import InMemoryCache, OllamaCacheService
+
+        service = OllamaService()
+        service.persona_model = "qwen2.5:1.5b"
+        service.cache = OllamaCacheService(InMemoryCache())
+        service.client = AsyncMock()
+        service.client.chat.return_value = {"message": {"content": "Ок."}}
+
+        await service.generate_persona_response("модель?")
+
+        assert service.client.chat.call_args.kwargs["model"] == "qwen2.5:1.5b"
+        assert service.client.chat.call_args.kwargs["keep_alive"] == service.keep_alive
@@ -0,0 +1,536 @@
+"""
+Unit тесты для RAGService.
+"""
+import threading
+
+import numpy as np
+import pytest
+
+from app.core.cache import InMemoryCache, OllamaCacheService
+from app.services import rag_service
+from app.services.rag_service import RAGService
+
+
+class FakeCollection:
+    """Коллекция ChromaDB, считающая запросы."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.queries = 0
+        self.upserts = 0
+        self.deletes = 0
+        self.gets = 0
+        self.records = {}
+        self.embeddings = {}
+
+    @property
+    def documents(self):
+        return [document for document, _ in self.records.values()]
+
+    def query(self, query_embeddings, n_results, include=None):
+        self.queries += 1
+        self.include = include
+        docs = self.documents[:n_results]
+        return {"documents": [docs], "metadatas": [[{} for _ in docs]], "distances": [[0.1 for _ in docs]]}
+
+    def count(self):
+        return len(self.records)
+
+    def get(self, ids=None, include=None):
+        self.gets += 1
+        found = [item_id for item_id in (self.records if ids is None else ids) if item_id in self.records]
+        return {
+            "ids": found,
+            "documents": [self.records[item_id][0] for item_id in found],
+            "metadatas": [self.records[item_id][1] for item_id in found],
+            "embeddings": [self.embeddings[item_id] for item_id in found],
+        }
+
+    def delete(self, ids):
+        self.deletes += 1
+        for item_id in ids:
+            self.records.pop(item_id, None)
+
+    def upsert(self, ids, embeddings, documents, metadatas):
+        self.upserts += 1
+        self.records.update(zip(ids, zip(documents, metadatas)))
+        self.embeddings.update(zip(ids, np.asarray(embeddings, dtype=np.float32).tolist()))
+        self.metadatas = metadatas
+
+
+class FakeEmbedder:
+    """Модель эмбеддингов: вектор зависит от первого слова текста."""
+
+    def __init__(self):
+        self.calls = 0
+
+    @staticmethod
+    def _vector(text):
+        return np.array([1.0, 0.0]) if text.split()[0] == "бюджет" else np.array([0.0, 1.0])
+
+    def encode(self, text, **kwargs):
+        self.calls += 1
+        self.thread = threading.current_thread().name
+        if isinstance(text, list):
+            return np.stack([self._vector(t) for t in text])
+        return self._vector(text)
+
+
+@pytest.fixture
+def rag(monkeypatch):
+    monkeypatch.setattr(rag_service, "_embedding_cache", rag_service.OrderedDict())
+    monkeypatch.setattr(rag_service, "_collection_versions", {})
+    monkeypatch.setattr(rag_service, "_doc_collections", {})
+    monkeypatch.setattr(rag_service, "_collection_snapshots", {})
+    monkeypatch.setattr(rag_service, "_batch_schedulers", {})
+    service = RAGService.__new__(RAGService)
+    service.cache = OllamaCacheService(InMemoryCache())
+    service.cache_sim_threshold = 0.97
+    service.brute_force_max = 0
+    service.embedding_model = FakeEmbedder()
+    service.meetings_collection = FakeCollection("meetings")
+    service.knowledge_collection = FakeCollection("knowledge")
+    service.tasks_collection = FakeCollection("tasks")
+    service.meetings_collection.records["m1"] = ("Встреча по бюджету", {})
+    return service
+
+
+@pytest.mark.asyncio
+class TestSearchCache:
+    """Тесты для кеша поиска RAG."""
+
+    async def test_repeated_and_similar_queries_reuse_results(self, rag):
+        """Тест что точный повтор не считает эмбеддинг, а близкий запрос не идет в ChromaDB."""
+        first = await rag.search_similar_meetings("бюджет проекта")
+        await rag.search_similar_meetings("бюджет проекта")
+        similar = await rag.search_similar_meetings("бюджет на квартал")
+
+        assert rag.meetings_collection.queries == 1
+        assert rag.meetings_collection.include == ["documents", "metadatas", "distances"]
+        assert rag.embedding_model.calls == 2
+        assert similar == first
+
+    async def test_concurrent_queries_share_one_encode(self, rag):
+        """Тест что одновременные поиски по разным коллекциям кодируют запросы одним вызовом модели."""
+        import asyncio
+
+        await asyncio.gather(
+            rag.search_similar_meetings("бюджет проекта"),
+            rag.search_knowledge("сроки релиза"),
+            rag.search_similar_tasks("риски"),
+        )
+
+        assert rag.embedding_model.calls == 1
+        assert len(rag_service._embedding_cache) == 3
+        assert rag.embedding_model.thread.startswith("rag")
+
+    async def test_lone_query_skips_batch_window(self, rag, monkeypatch):
+        """Тест что одиночный поиск не ждет окно батча эмбеддингов."""
+        import asyncio
+        from types import SimpleNamespace
+
+        monkeypatch.setattr(
+            rag_service, "get_settings", lambda: SimpleNamespace(rag_max_batch=8, rag_batch_window_ms=10_000)
+        )
+
+        results = await asyncio.wait_for(rag.search_similar_meetings("бюджет проекта"), timeout=1)
+
+        assert len(results) == 1
+
+    async def test_write_invalidates_collection_results(self, rag):
+        """Тест что после добавления документа поиск идет в коллекцию заново."""
+        await rag.search_similar_meetings("бюджет проекта")
+        await rag.add_meeting("m2", "бюджет утвержден")
+        results = await rag.search_similar_meetings("бюджет проекта")
+
+        assert rag.meetings_collection.queries == 2
+        assert len(results) == 2
+
+
+@pytest.mark.asyncio
+class TestBatchAdd:
+    """Тесты для пакетного добавления документов."""
+
+    async def test_unchanged_and_duplicate_documents_not_reembedded(self, rag):
+        """Тест что повтор ID в батче схлопывается, а неизменный документ не кодируется и не пишется заново."""
+        await rag.add_knowledge_batch([
+            ("d1", "бюджет черновик", None),
+            ("d1", "бюджет утвержден", None),
+        ])
+        rag_service._embedding_cache.clear()
+        await rag.add_knowledge_batch([
+            ("d1", "бюджет утвержден", None),
+            ("d2", "сроки сдвинуты", None),
+        ])
+        await rag.add_knowledge_batch([("d2", "сроки сдвинуты", None)])
+
+        collection = rag.knowledge_collection
+        assert collection.documents == ["бюджет утвержден", "сроки сдвинуты"]
+        assert collection.upserts == 2
+        assert [metadata["doc_id"] for metadata in collection.metadatas] == ["d2"]
+        assert rag.embedding_model.calls == 2
+
+    async def test_changed_metadata_rewrites_document(self, rag):
+        """Тест что документ с тем же текстом, но новыми метаданными записывается заново."""
+        await rag.add_knowledge_batch([("d1", "бюджет утвержден", {"status": "draft"})])
+        await rag.add_knowledge_batch([("d1", "бюджет утвержден", {"status": "final"})])
+        await rag.add_knowledge_batch([("d1", "бюджет утвержден", {"status": "final"})])
+
+        collection = rag.knowledge_collection
+        assert collection.upserts == 2
+        assert collection.records["d1"][1]["status"] == "final"
+
+    async def test_single_collection_add_and_one_encode(self, rag):
+        """Тест что батч кодируется одним вызовом модели и пишется одним add."""
+        await rag.add_knowledge_batch([
+            ("d1", "бюджет утвержден", {"source": "notion"}),
+            ("d2", "сроки сдвинуты", None),
+        ])
+
+        assert rag.knowledge_collection.upserts == 1
+        assert rag.knowledge_collection.documents == ["бюджет утвержден", "сроки сдвинуты"]
+        assert [
+            {k: v for k, v in metadata.items() if k != "content_hash"} for metadata in rag.knowledge_collection.metadatas
+        ] == [{"source": "notion", "doc_id": "d1"}, {"doc_id": "d2"}]
+        assert rag.embedding_model.calls == 1
+
+        rag._get_embedding("сроки сдвинуты")
+        assert rag.embedding_model.calls == 1
+
+    async def test_concurrent_single_adds_share_one_batch(self, rag):
+        """Тест что одновременные add_task собираются в один collection.add."""
+        import asyncio
+
+        await asyncio.gather(*(rag.add_task(f"t{i}", f"задача {i}") for i in range(3)))
+
+        assert rag.tasks_collection.upserts == 1
+        assert rag.tasks_collection.documents == ["задача 0", "задача 1", "задача 2"]
+
+    async def test_bad_single_add_fails_only_its_caller(self, rag):
+        """Тест что плохой документ в общем окне батча не роняет add_task остальных вызывающих."""
+        import asyncio
+
+        upsert = rag.tasks_collection.upsert
+
+        def flaky_upsert(ids, **kwargs):
+            if "t-bad" in ids:
+                raise ValueError("bad metadata")
+            upsert(ids, **kwargs)
+
+        rag.tasks_collection.upsert = flaky_upsert
+        results = await asyncio.gather(
+            rag.add_task("t1", "задача 1"), rag.add_task("t-bad", "задача 2"), rag.add_task("t3", "задача 3"),
+            return_exceptions=True
+        )
+
+        assert results[0] is None and results[2] is None
+        assert isinstance(results[1], ValueError)
+        assert sorted(rag.tasks_collection.records) == ["t1", "t3"]
+
+    async def test_auto_index_fetches_pages_concurrently(self, rag):
+        """Тест что страницы Notion читаются параллельно, а ошибки и короткие страницы не мешают батчу."""
+        import asyncio
+
+        class Notion:
+            active = peak = 0
+
+            async def get_page_content(self, page_id, include_metadata=False):
+                Notion.active += 1
+                Notion.peak = max(Notion.peak, Notion.active)
+                await asyncio.sleep(0.01)
+                Notion.active -= 1
+                if page_id == "bad":
+                    raise RuntimeError("404")
+                return "коротко" if page_id == "short" else f"бюджет страницы {page_id} " * 5
+
+        results = await rag.auto_index_notion_pages(["p1", "bad", "short", "p2"], Notion())
+
+        assert Notion.peak == rag_service.NOTION_FETCH_CONCURRENCY
+        assert [item["page_id"] for item in results["indexed"]] == ["p1", "p2"]
+        assert results["failed"] == [{"page_id": "bad", "error": "404"}]
+        assert [item["page_id"] for item in results["skipped"]] == ["short"]
+        assert rag.knowledge_collection.upserts == 1
+        assert rag.embedding_model.calls == 1
+
+    async def test_auto_index_falls_back_to_single_pages(self, rag):
+        """Тест что при ошибке батча страницы индексируются по одной и падает только проблемная."""
+        class Notion:
+            async def get_page_content(self, page_id, include_metadata=False):
+                return f"страница {page_id} " * 10
+
+        upsert = rag.knowledge_collection.upsert
+
+        def flaky_upsert(ids, **kwargs):
+            if "notion-page-bad" in ids:
+                raise ValueError("bad metadata")
+            upsert(ids, **kwargs)
+
+        rag.knowledge_collection.upsert = flaky_upsert
+        results = await rag.auto_index_notion_pages(["p1", "bad", "p2"], Notion())
+
+        assert [item["page_id"] for item in results["indexed"]] == ["p1", "p2"]
+        assert results["failed"] == [{"page_id": "bad", "error": "bad metadata"}]
+        assert sorted(rag.knowledge_collection.records) == ["notion-page-p1", "notion-page-p2"]
+
+    async def test_auto_index_skips_unchanged_page(self, rag):
+        """Тест что повторная индексация той же страницы Notion не кодирует и не пишет ее заново."""
+        class Notion:
+            async def get_page_content(self, page_id, include_metadata=False):
+                return f"бюджет страницы {page_id} " * 5
+
+        await rag.auto_index_notion_pages(["p1"], Notion())
+        rag_service._embedding_cache.clear()
+        await rag.auto_index_notion_pages(["p1"], Notion())
+
+        assert rag.knowledge_collection.upserts == 1
+        assert rag.embedding_model.calls == 1
+
+
+@pytest.mark.asyncio
+class TestUpdateIndex:
+    """Тесты для обновления индекса."""
+
+    async def test_known_document_updated_with_single_upsert(self, rag):
+        """Тест что известный документ обновляется одним upsert без удалений, а смена типа переносит его."""
+        await rag.add_task("t1", "задача старая")
+        await rag.update_index("t1", "задача новая", {"type": "task"})
+
+        collections = (rag.meetings_collection, rag.knowledge_collection, rag.tasks_collection)
+        assert sum(c.deletes for c in collections) == 0
+        assert rag.tasks_collection.documents == ["задача новая"]
+
+        await rag.update_index("t1", "заметка", {"type": "note"})
+
+        assert rag.tasks_collection.deletes == 1 and rag.tasks_collection.documents == []
+        assert rag.knowledge_collection.documents == ["заметка"]
+        assert rag.meetings_collection.deletes == 0
+
+    async def test_unknown_document_removed_from_other_collections(self, rag):
+        """Тест что для документа без известного владельца чистятся остальные коллекции."""
+        rag.tasks_collection.records["x1"] = ("задача", {})
+        await rag.update_index("x1", "встреча", {"type": "meeting"})
+
+        assert rag.tasks_collection.documents == []
+        assert rag.knowledge_collection.deletes == 1
+        assert rag.meetings_collection.deletes == 0
+        assert "встреча" in rag.meetings_collection.documents
+
+
+@pytest.mark.asyncio
+class TestBruteForceSearch:
+    """Тесты для точного поиска по небольшим коллекциям."""
+
+    async def test_small_collection_searched_in_memory(self, rag):
+        """Тест что небольшая коллекция ищется по снимку без query, а запись обновляет снимок."""
+        rag.brute_force_max = 10
+        await rag.add_knowledge_batch([("d1", "бюджет утвержден", None), ("d2", "сроки сдвинуты", None)])
+
+        results = await rag.search_knowledge("бюджет проекта", limit=1)
+        await rag.add_knowledge("d3", "сроки перенесены")
+        await rag.search_knowledge("сроки релиза", limit=5)
+
+        collection = rag.knowledge_collection
+        assert collection.queries == 0
+        assert results[0]["content"] == "бюджет утвержден"
+        assert results[0]["score"] == pytest.approx(1.0)
+        assert collection.gets == 4
+
+    async def test_large_collection_goes_to_chroma(self, rag):
+        """Тест что коллекция больше порога ищется через ChromaDB."""
+        rag.brute_force_max = 1
+        await rag.add_knowledge_batch([("d1", "бюджет утвержден", None), ("d2", "сроки сдвинуты", None)])
+
+        results = await rag.search_knowledge("бюджет проекта")
+
+        assert rag.knowledge_collection.queries == 1
+        assert results[0]["score"] == pytest.approx(0.95)
+
+
+class TestQueryHits:
+    """Тесты для разбора результатов ChromaDB."""
+
+    def test_missing_fields_get_defaults(self):
+        """Тест что отсутствующие метаданные и расстояния заменяются значениями по умолчанию."""
+        hits = rag_service._query_hits({"documents": [["a", "b"]], "metadatas": [[None, {"k": 1}]], "distances": None})
+
+        assert hits == [("a", {}, None), ("b", {"k": 1}, None)]
+        assert rag_service._query_hits({"documents": [[]]}) == []
+
+
+class TestEmbeddingCache:
+    """Тесты для LRU эмбеддингов."""
+
+    def test_lru_evicts_oldest(self, rag, monkeypatch):
+        """Тест что повторный текст не кодируется заново, а кеш ограничен по размеру."""
+        monkeypatch.setattr(rag_service, "EMBEDDING_CACHE_SIZE", 2)
+
+        rag._get_embedding("бюджет")
+        rag._get_embedding("бюджет")
+        rag._get_embedding("сроки")
+        rag._get_embedding("риски")
+
+        assert rag.embedding_model.calls == 3
+        assert len(rag_service._embedding_cache) == 2
+
+    def test_embeddings_stay_compact_arrays(self, rag):
+        """Тест что LRU хранит эмбеддинги во float16, а наружу они отдаются float32, батч — матрицей."""
+        single = rag._get_embedding("бюджет")
+        batch = rag._get_embeddings(["бюджет", "сроки"])
+
+        assert single.dtype == np.float32 and single.shape == (2,)
+        assert batch.dtype == np.float32 and batch.shape == (2, 2)
+        assert np.array_equal(batch[0], single)
+        assert all(vector.dtype == np.float16 for vector in rag_service._embedding_cache.values())
+
+    @pytest.mark.asyncio
+    async def test_chroma_gets_float32_vectors(self, rag):
+        """Тест что в ChromaDB пишутся и ищутся неокругленные float32 векторы модели."""
+        vector = np.array([0.1234567, 0.7654321])
+        rag.embedding_model._vector = lambda text: vector
+        upserts, queries = [], []
+        upsert = rag.knowledge_collection.upsert
+        query = rag.knowledge_collection.query
+
+        def record_upsert(ids, embeddings, **kwargs):
+            upserts.append(embeddings)
+            upsert(ids, embeddings, **kwargs)
+
+        def record_query(query_embeddings, **kwargs):
+            queries.append(query_embeddings)
+            return query(query_embeddings, **kwargs)
+
+        rag.knowledge_collection.upsert = record_upsert
+        rag.knowledge_collection.query = record_query
+        await rag.add_knowledge_batch([("d1", "бюджет утвержден", None)])
+        await rag.update_index("d1", "бюджет изменен")
+        await rag.search_knowledge("бюджет проекта")
+
+        assert len(upserts) == 2 and len(queries) == 1
+        for sent in upserts + queries:
+            assert sent.dtype == np.float32
+            assert np.array_equal(sent[0], vector.astype(np.float32))
+
+    def test_lru_safe_across_threads(self, rag, monkeypatch):
+        """Тест что одновременные чтения и записи из нескольких потоков не ломают LRU."""
+        from concurrent.futures import ThreadPoolExecutor
+
+        monkeypatch.setattr(rag_service, "EMBEDDING_CACHE_SIZE", 8)
+        texts = [f"текст {i % 32}" for i in range(2000)]
+
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            list(pool.map(rag._get_embedding, texts))
+
+        assert len(rag_service._embedding_cache) == 8
+
+
+class TestOnnxEmbedder:
+    """Тесты для ONNX-эмбеддера."""
+
+    @pytest.fixture
+    def embedder(self):
+        class Session:
+            def run(self, outputs, feeds):
+                ids = feeds["input_ids"].astype(np.float32)
+                return [np.stack([ids, np.ones_like(ids)], axis=-1)]
+
+        def tokenizer(texts, **kwargs):
+            width = max(len(t.split()) for t in texts)
+            ids = np.array([[len(w) for w in t.split()] + [0] * (width - len(t.split())) for t in texts])
+            mask = np.array([[1] * len(t.split()) + [0] * (width - len(t.split())) for t in texts])
+            return {"input_ids": ids, "attention_mask": mask, "token_type_ids": np.zeros_like(ids)}
+
+        embedder = rag_service._OnnxEmbedder.__new__(rag_service._OnnxEmbedder)
+        embedder.session = Session()
+        embedder.input_names = {"input_ids", "attention_mask"}
+        embedder.tokenizer = tokenizer
+        return embedder
+
+    def test_mean_pooling_ignores_padding_and_normalizes(self, embedder):
+        """Тест что паддинг не влияет на вектор, а результат нормирован."""
+        single = embedder.encode("ab c")
+        batch = embedder.encode(["ab c", "abc de fghij"])
+
+        assert batch.shape == (2, 2)
+        np.testing.assert_allclose(batch[0], single)
+        np.testing.assert_allclose(np.linalg.norm(batch, axis=1), [1.0, 1.0], rtol=1e-6)
+        np.testing.assert_allclose(single, np.array([1.5, 1.0]) / np.linalg.norm([1.5, 1.0]), rtol=1e-6)
+
+    def test_batches_by_length_and_restores_order(self, embedder):
+        """Тест что батчи собираются из текстов близкой длины, а результат идет в исходном порядке."""
+        widths = []
+        tokenize = embedder.tokenizer
+
+        def tokenizer(texts, **kwargs):
+            tokens = tokenize(texts, **kwargs)
+            widths.append(tokens["input_ids"].shape[1])
+            return tokens
+
+        embedder.tokenizer = tokenizer
+        texts = ["a b c d e f", "x", "yy z", "q"]
+        batch = embedder.encode(texts, batch_size=2)
+
+        assert widths == [1, 6]
+        np.testing.assert_allclose(batch, np.stack([embedder.encode(text) for text in texts]), rtol=1e-6)
+
+
+class TestEmbeddingModel:
+    """Тесты для общей модели эмбеддингов."""
+
+    def test_loaded_once_and_warmed(self, monkeypatch):
+        """Тест что модель загружается один раз на процесс, а прогрев кодирует пробный текст."""
+        from concurrent.futures import ThreadPoolExecutor
+
+        loads = []
+
+        def load():
+            loads.append(1)
+            rag_service._embedding_model = FakeEmbedder()
+
+        monkeypatch.setattr(rag_service, "_embedding_model", None)
+        monkeypatch.setattr(rag_service, "_embedding_model_loaded", False)
+        monkeypatch.setattr(rag_service, "_load_embedding_model", load)
+
+        with ThreadPoolExecutor(4) as pool:
+            models = list(pool.map(lambda _: rag_service.get_embedding_model(), range(8)))
+
+        assert len(loads) == 1
+        assert all(model is models[0] for model in models)
+        assert rag_service.warmup_embedding_model() is True
+        assert models[0].calls == 1
+
+    def test_torch_threads_applied_on_load(self, monkeypatch):
+        """Тест что число потоков torch задается из настроек при загрузке sentence-transformers."""
+        from types import SimpleNamespace
+
+        import sentence_transformers
+        import torch
+
+        threads = []
+        monkeypatch.setattr(rag_service, "_embedding_model", None)
+        monkeypatch.setattr(
+            rag_service, "get_settings", lambda: SimpleNamespace(rag_onnx_model_dir=None, rag_torch_threads=2)
+        )
+        monkeypatch.setattr(sentence_transformers, "SentenceTransformer", lambda name: FakeEmbedder())
+        monkeypatch.setattr(torch, "set_num_threads", threads.append)
+
+        rag_service._load_embedding_model()
+
+        assert isinstance(rag_service._embedding_model, FakeEmbedder)
+        assert threads == [2]
+
+
+class TestChromaClient:
+    """Тесты для клиента ChromaDB."""
+
+    def test_persistent_collection_gets_hnsw_params(self, tmp_path):
+        """Тест что persistent-клиент пишет в каталог, а параметры HNSW попадают в метаданные коллекции."""
+        from types import SimpleNamespace
+
+        settings = SimpleNamespace(chroma_mode="persistent", chroma_persist_dir=str(tmp_path / "db"))
+        client = rag_service._create_chroma_client(settings)
+        collection = client.get_or_create_collection(
+            name="meetings", metadata={"hnsw:M": 32, "hnsw:search_ef": 64}
+        )
+
+        assert (tmp_path / "db").is_dir()
+        assert collection.metadata["hnsw:search_ef"] == 64
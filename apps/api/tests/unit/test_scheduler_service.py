@@ -0,0 +1,187 @@
+"""
+Unit тесты для SchedulerService.
+"""
+import asyncio
+from datetime import datetime, timedelta
+
+import pytest
+
+from app.services.scheduler_service import SchedulerService
+
+
+@pytest.fixture
+def scheduler(tmp_path, monkeypatch):
+    monkeypatch.setattr(SchedulerService, "_load_tasks", lambda self: None)
+    service = SchedulerService()
+    service.storage_path = tmp_path / "scheduled_tasks.db"
+    return service
+
+
+@pytest.mark.asyncio
+class TestSchedulerLoop:
+    """Тесты для цикла планировщика."""
+
+    async def test_new_task_wakes_idle_loop(self, scheduler):
+        """Тест что пустой планировщик не опрашивает задачи, а новая задача выполняется в срок."""
+        executed = []
+        checks = 0
+        check = scheduler._check_and_execute_tasks
+
+        async def counting_check():
+            nonlocal checks
+            checks += 1
+            await check()
+
+        async def action(name):
+            executed.append(name)
+
+        scheduler._check_and_execute_tasks = counting_check
+        await scheduler.start()
+        await asyncio.sleep(0.05)
+        assert checks == 1
+
+        scheduler.schedule_task("t1", datetime.now() + timedelta(milliseconds=50), action, {"name": "t1"})
+        await asyncio.sleep(0.2)
+        await scheduler.stop()
+
+        assert executed == ["t1"]
+        assert "t1" not in scheduler.tasks
+
+    async def test_cancelled_and_repeating_tasks(self, scheduler):
+        """Тест что отмененная задача не выполняется, а повторяющаяся перепланируется."""
+        executed = []
+
+        async def action(name):
+            executed.append(name)
+
+        now = datetime.now()
+        scheduler.schedule_task("once", now, action, {"name": "once"})
+        scheduler.schedule_task("cancelled", now, action, {"name": "cancelled"})
+        scheduler.schedule_task("repeat", now, action, {"name": "repeat"}, repeat_interval=timedelta(hours=1))
+        scheduler.cancel_task("cancelled")
+
+        await scheduler._check_and_execute_tasks()
+
+        assert sorted(executed) == ["once", "repeat"]
+        assert list(scheduler.tasks) == ["repeat"]
+        assert 3590 < scheduler._seconds_until_next() <= 3600
+
+
+    async def test_small_clock_adjustment_keeps_deadlines(self, scheduler, monkeypatch):
+        """Тест что небольшая подстройка системных часов (NTP) не сдвигает сроки задач."""
+        from app.services import scheduler_service
+
+        executed = []
+
+        async def action():
+            executed.append(1)
+
+        scheduler.schedule_task("later", datetime.now() + timedelta(hours=1), action, {})
+        deadline = scheduler.tasks["later"].deadline
+
+        class Adjusted(datetime):
+            @classmethod
+            def now(cls, tz=None):
+                return datetime.now(tz) + timedelta(seconds=2)
+
+        monkeypatch.setattr(scheduler_service, "datetime", Adjusted)
+        await scheduler._check_and_execute_tasks()
+
+        assert executed == []
+        assert scheduler.tasks["later"].deadline == deadline
+
+    async def test_sleep_gap_resyncs_deadlines(self, scheduler, monkeypatch):
+        """Тест что после сна (системные часы ушли вперед, монотонные стояли) просроченная задача выполняется."""
+        from app.services import scheduler_service
+
+        executed = []
+
+        async def action():
+            executed.append(1)
+
+        scheduler.schedule_task("later", datetime.now() + timedelta(hours=1), action, {})
+
+        class Resumed(datetime):
+            @classmethod
+            def now(cls, tz=None):
+                return datetime.now(tz) + timedelta(hours=2)
+
+        monkeypatch.setattr(scheduler_service, "datetime", Resumed)
+        await scheduler._check_and_execute_tasks()
+
+        assert executed == [1]
+        assert "later" not in scheduler.tasks
+
+    async def test_repeating_task_keeps_time_of_day(self, scheduler):
+        """Тест что повтор отсчитывается от запланированного времени, а пропущенные запуски не догоняются."""
+        executed = []
+
+        async def action():
+            executed.append(1)
+
+        planned = datetime.now() - timedelta(days=3, hours=1)
+        scheduler.schedule_task("daily", planned, action, {}, repeat_interval=timedelta(days=1))
+
+        await scheduler._check_and_execute_tasks()
+        await scheduler._check_and_execute_tasks()
+
+        task = scheduler.tasks["daily"]
+        assert executed == [1]
+        assert task.execute_at == planned + timedelta(days=4)
+        assert 22 * 3600 < scheduler._seconds_until_next() <= 23 * 3600
+
+
+@pytest.mark.asyncio
+class TestSchedulerStorage:
+    """Тесты для хранилища повторяющихся задач."""
+
+    async def test_only_repeating_tasks_are_stored_row_by_row(self, scheduler):
+        """Тест что хранятся только повторяющиеся задачи, а выполнение и отмена меняют одну строку."""
+        async def action(name):
+            pass
+
+        now = datetime.now()
+        scheduler.schedule_task("once", now, action, {"name": "once"})
+        scheduler.schedule_task("daily", now, action, {"name": "daily"}, repeat_interval=timedelta(days=1))
+        scheduler.schedule_task("weekly", now + timedelta(hours=1), action, {"name": "w"}, repeat_interval=timedelta(days=7))
+
+        def rows():
+            return dict(scheduler._db().execute("SELECT task_id, execute_at FROM tasks"))
+
+        assert set(rows()) == {"daily", "weekly"}
+
+        await scheduler._check_and_execute_tasks()
+        assert rows()["daily"] == scheduler.tasks["daily"].execute_at.isoformat()
+
+        scheduler.cancel_task("weekly")
+        assert set(rows()) == {"daily"}
+
+
+    async def test_action_args_roundtrip(self, scheduler):
+        """Тест что аргументы задачи сохраняются как JSON (включая кириллицу)."""
+        import json
+
+        async def action(**kwargs):
+            pass
+
+        args = {"chat_id": 42, "text": "Напоминание"}
+        scheduler.schedule_task("daily", datetime.now(), action, args, repeat_interval=timedelta(days=1))
+
+        (stored,) = scheduler._db().execute("SELECT action_args FROM tasks").fetchone()
+        assert json.loads(stored) == args
+
+
+class TestDumpArgs:
+    """Тесты для сериализации аргументов задачи."""
+
+    def test_orjson_and_json_paths_match(self, monkeypatch):
+        """Тест что оба пути принимают наивные даты как есть и дают одинаковую строку."""
+        from app.services import scheduler_service
+
+        args = {"chat_id": 42, "text": "Напоминание", "at": datetime(2025, 1, 2, 3, 4, 5)}
+        dumps = set()
+        for available in {scheduler_service.ORJSON_AVAILABLE, False}:
+            monkeypatch.setattr(scheduler_service, "ORJSON_AVAILABLE", available)
+            dumps.add(scheduler_service._dump_args(args))
+
+        assert dumps == {'{"chat_id":42,"text":"Напоминание","at":"2025-01-02T03:04:05"}'}
@@ -0,0 +1,150 @@
+"""
+Unit тесты для очистки HTML перед отправкой в Telegram.
+"""
+import asyncio
+
+import pytest
+
+from app.services.telegram_service import TelegramService, sanitize_html_for_telegram
+
+
+class TestSanitizeHtml:
+    """Тесты для sanitize_html_for_telegram."""
+
+    def test_lists_headers_and_blocks(self):
+        """Тест что списки, заголовки и блочные теги превращаются в текст с переносами."""
+        html = "<h2>Итоги</h2><ul><li>Один</li><li>Два</li></ul><p>Текст<br/>дальше</p><div>конец</div>"
+
+        assert sanitize_html_for_telegram(html) == "Итоги\n\n• Один\n• Два\nТекст\nдальше\n\nконец"
+
+    def test_supported_tags_kept_and_emphasis_converted(self):
+        """Тест что поддерживаемые теги остаются, а strong/em заменяются на b/i."""
+        html = '<strong>важно</strong> <em>курсив</em> <a href="https://x">ссылка</a> <code>c</code> <font>f</font>'
+
+        assert sanitize_html_for_telegram(html) == '<b>важно</b> <i>курсив</i> <a href="https://x">ссылка</a> <code>c</code> f'
+
+    def test_tables_and_many_tags(self):
+        """Тест что таблицы разворачиваются в строки, а длинный HTML обрабатывается без рекурсии."""
+        table = "<table><tr><th>A</th><td>1</td></tr></table>"
+        many = "<span>x</span>" * 2000
+
+        assert sanitize_html_for_telegram(table) == "A 1"
+        assert sanitize_html_for_telegram(many) == "x" * 2000
+        assert sanitize_html_for_telegram("") == ""
+
+    def test_tag_names_matched_exactly(self):
+        """Тест что теги сопоставляются по имени целиком: <pre> не принимается за <p>, <strongest> — за <strong>."""
+        html = "<pre>код</pre><strongest>x</strongest><link rel=a><br class=x>конец"
+
+        assert sanitize_html_for_telegram(html) == "<pre>код</pre>x\nконец"
+
+    def test_plain_text_fast_path(self):
+        """Тест что текст без тегов только чистится от лишних пробелов и переносов."""
+        assert sanitize_html_for_telegram("  Напоминание: созвон в 15:00  ") == "Напоминание: созвон в 15:00"
+        assert sanitize_html_for_telegram(" a < b \n\n\n\n  c ") == "a < b\n\nc"
+
+    def test_quoted_attributes_and_unclosed_tags(self):
+        """Тест что '>' в кавычках не обрывает тег, а незакрытый тег на длинном тексте не вызывает перебора."""
+        assert sanitize_html_for_telegram('<span title="1 > 0">x</span>') == "x"
+        assert sanitize_html_for_telegram('<a href="https://x?a>b">ссылка</a>') == '<a href="https://x?a>b">ссылка</a>'
+        assert sanitize_html_for_telegram("<" + "a" * 50000) == "<" + "a" * 50000
+
+    def test_repeated_message_served_from_cache(self):
+        """Тест что повторная очистка того же текста (рассылка участникам) берется из кеша."""
+        message = "<b>📋 Минутки встречи</b>\n\n<p>Итоги для рассылки</p>"
+        first = sanitize_html_for_telegram(message)
+        hits = sanitize_html_for_telegram.cache_info().hits
+
+        assert sanitize_html_for_telegram(message) == first
+        assert sanitize_html_for_telegram.cache_info().hits == hits + 1
+
+
+@pytest.mark.asyncio
+class TestMeetingMinutes:
+    """Тесты для сообщения с минутками встречи."""
+
+    async def test_assignees_tagged_by_alias_and_substring(self, monkeypatch):
+        """Тест что ответственные находятся по любому варианту имени, а без совпадения выводятся как есть."""
+        from app.services import notion_service
+
+        class Notion:
+            async def save_meeting_minutes(self, **kwargs):
+                return "block"
+
+        sent = []
+
+        async def send_notification(message, parse_mode="HTML"):
+            sent.append(message)
+            return 1
+
+        monkeypatch.setattr(notion_service, "NotionService", Notion)
+        service = TelegramService.__new__(TelegramService)
+        service.send_notification = send_notification
+
+        participants = [
+            {"name": "", "telegram_username": "nobody"},
+            {"name": "Анна Петрова", "original_name": "Аня", "telegram_username": "anna"},
+            {"name": "Иван", "matched_name": "Ivan Sidorov"},
+        ]
+        action_items = [
+            {"text": "Бюджет", "assignee": "Аня", "priority": "High"},
+            {"text": "Сроки", "assignee": "ivan sidorov"},
+            {"text": "Отчет", "assignee": "Петрова"},
+            {"text": "Риски", "assignee": "Олег"},
+        ]
+        await service.send_meeting_minutes(
+            "Итоги", action_items=action_items, participants=participants, send_to_participants=False
+        )
+
+        lines = [line for line in sent[0].split("\n") if line[:2] in ("1.", "2.", "3.", "4.")]
+        assert lines == [
+            "1. 🔴 Бюджет @anna",
+            "2. 🟡 Сроки (Иван)",
+            "3. 🟡 Отчет @anna",
+            "4. 🟡 Риски (Олег)",
+        ]
+
+    async def test_participants_sent_concurrently(self, monkeypatch):
+        """Тест что участникам отправляется параллельно одно и то же очищенное сообщение, а результаты и ошибки остаются в порядке участников."""
+        from app.services import notion_service
+
+        class Notion:
+            async def save_meeting_minutes(self, **kwargs):
+                return "block"
+
+        in_flight = 0
+        max_in_flight = 0
+        messages = set()
+
+        async def send_raw(chat_id, message, parse_mode=None):
+            nonlocal in_flight, max_in_flight
+            messages.add(id(message))
+            in_flight += 1
+            max_in_flight = max(max_in_flight, in_flight)
+            await asyncio.sleep(0.01)
+            in_flight -= 1
+            if chat_id == "2":
+                raise RuntimeError("blocked")
+            return int(chat_id) * 10
+
+        monkeypatch.setattr(notion_service, "NotionService", Notion)
+        service = TelegramService.__new__(TelegramService)
+        service._send_raw = send_raw
+
+        participants = [
+            {"name": "A", "telegram_chat_id": 1},
+            {"name": "B", "telegram_username": "b"},
+            {"name": "C", "telegram_chat_id": 2},
+            {"name": "D", "telegram_chat_id": 3},
+        ]
+        sanitize_html_for_telegram.cache_clear()
+        result = await service.send_meeting_minutes("Итоги", participants=participants, send_to_admin=False)
+
+        assert max_in_flight == 3
+        assert len(messages) == 1
+        assert sanitize_html_for_telegram.cache_info().misses == 2  # summary и итоговое сообщение
+        assert [(p["name"], p["message_id"]) for p in result["participants"]] == [
+            ("A", 10), ("B", None), ("C", None), ("D", 30)
+        ]
+        assert result["participants"][2]["error"] == "blocked"
+        assert "telegram_chat_id" in result["participants"][1]["error"]
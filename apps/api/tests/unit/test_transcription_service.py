@@ -0,0 +1,135 @@
+"""
+Unit тесты для TranscriptionService.
+"""
+import asyncio
+import time
+
+import pytest
+
+from app.services import transcription_service as transcription_module
+from app.services.transcription_service import TranscriptionService
+
+
+@pytest.fixture
+def service(monkeypatch):
+    monkeypatch.setattr(TranscriptionService, "_model", None)
+    monkeypatch.setattr(TranscriptionService, "_load_lock", asyncio.Lock())
+    monkeypatch.setattr(transcription_module, "FASTER_WHISPER_AVAILABLE", False)
+    return TranscriptionService()
+
+
+@pytest.mark.asyncio
+class TestModelLoading:
+    """Тесты для ленивой загрузки модели."""
+
+    async def test_concurrent_first_requests_load_model_once(self, service, monkeypatch):
+        """Тест что одновременные первые запросы загружают модель один раз и получают один объект."""
+        loads = []
+
+        class Model:
+            def eval(self):
+                return self
+
+        def load_model(name, device=None):
+            loads.append((name, device))
+            time.sleep(0.05)
+            return Model()
+
+        monkeypatch.setattr(transcription_module.whisper, "load_model", load_model)
+        models = await asyncio.gather(*(service._get_model() for _ in range(4)))
+
+        assert len(loads) == 1
+        assert all(model is models[0] for model in models)
+        assert TranscriptionService()._model is models[0]
+
+    async def test_faster_whisper_preferred_and_joins_segments(self, service, monkeypatch, tmp_path):
+        """Тест что при наличии faster-whisper модель грузится в int8/fp16, а текст собирается из сегментов."""
+        calls = {}
+
+        class Segment:
+            def __init__(self, text):
+                self.text = text
+
+        class FasterModel:
+            def __init__(self, size, device, compute_type):
+                calls["load"] = (size, device, compute_type)
+
+            def transcribe(self, audio, **kwargs):
+                calls["transcribe"] = kwargs
+                return iter([Segment(" Привет,"), Segment(" мир. ")]), None
+
+        monkeypatch.setattr(transcription_module, "FASTER_WHISPER_AVAILABLE", True)
+        monkeypatch.setattr(transcription_module, "WhisperModel", FasterModel)
+        monkeypatch.setattr(transcription_module, "BatchedInferencePipeline", None)
+        monkeypatch.setattr(service, "device", "mps")
+        monkeypatch.setattr(transcription_module, "_load_audio", lambda path: "samples")
+        audio = tmp_path / "meeting.wav"
+        audio.write_bytes(b"")
+
+        text = await service.transcribe(audio)
+
+        assert text == "Привет, мир."
+        assert calls["load"] == ("small", "cpu", "int8")
+        assert calls["transcribe"]["vad_filter"] is True
+        assert calls["transcribe"]["language"] == "ru"
+        assert "batch_size" not in calls["transcribe"]
+
+    async def test_batched_pipeline_used_when_available(self, service, monkeypatch):
+        """Тест что модель оборачивается в BatchedInferencePipeline и декодирует фрагменты батчами."""
+        calls = {}
+
+        class FasterModel:
+            def __init__(self, size, device, compute_type):
+                pass
+
+        class Pipeline:
+            def __init__(self, model):
+                self.model = model
+
+            def transcribe(self, audio, **kwargs):
+                calls.update(kwargs)
+                return iter([]), None
+
+        monkeypatch.setattr(transcription_module, "FASTER_WHISPER_AVAILABLE", True)
+        monkeypatch.setattr(transcription_module, "WhisperModel", FasterModel)
+        monkeypatch.setattr(transcription_module, "BatchedInferencePipeline", Pipeline)
+
+        model = await service._get_model()
+        TranscriptionService._transcribe_sync(model, "meeting.wav", language="ru", fp16=False)
+
+        assert isinstance(model, Pipeline)
+        assert calls["batch_size"] == transcription_module.WHISPER_BATCH_SIZE
+        assert calls["vad_parameters"] == {"min_silence_duration_ms": 500}
+
+
+@pytest.mark.asyncio
+class TestAudioDecoding:
+    """Тесты для декодирования аудио."""
+
+    async def test_audio_decoded_per_call_and_passed_as_array(self, service, monkeypatch, tmp_path):
+        """Тест что аудио декодируется один раз на транскрипцию, модель получает готовый массив, а массив не кешируется."""
+        decoded = []
+        transcribed = []
+
+        class Model:
+            def eval(self):
+                return self
+
+            def transcribe(self, audio, **kwargs):
+                transcribed.append(audio)
+                return {"text": "текст"}
+
+        def load_audio(path, sr=16000):
+            decoded.append(path)
+            return f"samples-{len(decoded)}"
+
+        monkeypatch.setattr(transcription_module.whisper, "load_model", lambda name, device=None: Model())
+        monkeypatch.setattr(transcription_module.whisper, "load_audio", load_audio)
+        audio = tmp_path / "meeting.wav"
+        audio.write_bytes(b"v1")
+
+        assert await service.transcribe(audio) == "текст"
+        assert await service.transcribe(audio, language="en") == "текст"
+
+        assert decoded == [str(audio), str(audio)]
+        assert transcribed == ["samples-1", "samples-2"]